@@ -0,0 +1,162 @@
+"""Memory behaviour of the per-frame hot loop with and without GraphCut.frame_context().
+
+    python -m benchmarks.allocation_benchmark --fixture benchmarks/fixtures/beaver.json --frames 60
+    python -m benchmarks.allocation_benchmark --fixture benchmarks/fixtures/totoro.json --mode 2d --json alloc.json
+
+The clip is decoded first, then segmented with propagate() twice on copies of the same model:
+
+    fresh      every intermediate allocated per frame (the default outside a frame context)
+    buffers    inside frame_context(): work arrays, the RGBA image and the max-flow graph reused
+
+For each run it reports the time per frame and, per frame:
+
+    page faults   minor page faults; a freshly allocated large array faults every page it touches,
+                  a reused buffer does not, so this counts the allocator's work in pages
+    traced peak   peak memory allocated through Python's allocators (numpy data included) above the
+                  level at the start of the frame, i.e. the transient working set of one frame
+    gc            garbage collections and the time spent in them
+    rss           resident set size at the start and the end of the run
+
+and, for the buffered run, how many buffers were allocated (all of them at the first frame).
+Masks are compared between the runs; they must be identical.
+"""
+
+import argparse
+import contextlib
+import copy
+import gc
+import json
+import resource
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.common import VIDEO_HEIGHT, VIDEO_WIDTH, build_graph_cut, load_annotation
+from code.instrumentation import current_rss_mb
+from code.propagation import propagate
+from code.video_io import read_frames
+
+
+class GCMonitor:
+    """Counts collections per generation and their total pause through gc.callbacks."""
+
+    def __init__(self):
+        self.collections = [0, 0, 0]
+        self.pause = 0.0
+        self.started = None
+
+    def __call__(self, phase: str, info: dict):
+        if phase == "start":
+            self.started = time.perf_counter()
+        elif self.started is not None:
+            self.pause += time.perf_counter() - self.started
+            self.collections[info["generation"]] += 1
+            self.started = None
+
+    def __enter__(self):
+        gc.callbacks.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        gc.callbacks.remove(self)
+        return False
+
+
+def segment(graph_cut, decoded: list, init_mask: np.ndarray, is_3d: bool, energy_term_3d: float, buffers: bool) -> dict:
+    faults, peaks, seconds, masks = [], [], [], []
+    rss_start = current_rss_mb()
+    gc.collect()
+    context = graph_cut.frame_context() if buffers else contextlib.nullcontext()
+    with GCMonitor() as monitor, context as frame_buffers:
+        frames = propagate(graph_cut, decoded, init_mask, is_3d, energy_term_3d)
+        while True:
+            tracemalloc.reset_peak()
+            traced = tracemalloc.get_traced_memory()[0]
+            minflt = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+            start = time.perf_counter()
+            item = next(frames, None)
+            if item is None:
+                break
+            seconds.append(time.perf_counter() - start)
+            faults.append(resource.getrusage(resource.RUSAGE_SELF).ru_minflt - minflt)
+            peaks.append(tracemalloc.get_traced_memory()[1] - traced)
+            masks.append(item[2])
+            if frame_buffers and len(masks) == 1:
+                first_allocations = frame_buffers.allocations
+    # the first frame sizes the buffers; the steady state is what a long clip costs
+    steady = slice(1, None) if len(seconds) > 1 else slice(None)
+    return {
+        "ms_per_frame": float(np.median(seconds[steady])) * 1000,
+        "page_faults_per_frame": float(np.median(faults[steady])),
+        "first_frame_page_faults": faults[0],
+        "traced_peak_mb_per_frame": float(np.median(peaks[steady])) / 1e6,
+        "gc_collections": monitor.collections,
+        "gc_pause_ms": monitor.pause * 1000,
+        "rss_start_mb": rss_start,
+        "rss_end_mb": current_rss_mb(),
+        "buffers_allocated": frame_buffers.allocations if frame_buffers else None,
+        "buffers_allocated_after_first_frame": frame_buffers.allocations - first_allocations if frame_buffers else None,
+        "buffers_mb": frame_buffers.nbytes / 1e6 if frame_buffers else None,
+        "masks": masks,
+    }
+
+
+def run(fixture: str, frames: int, is_3d: bool, energy_term_3d: float, traced: bool) -> dict:
+    annotation = load_annotation(fixture)
+    clip, first = annotation["clip"], annotation["frame"]
+    _, image = next(read_frames(clip, VIDEO_WIDTH, VIDEO_HEIGHT, first, first + 1))
+    graph_cut = build_graph_cut(image, annotation)
+    init_mask = graph_cut.segment_2d()
+    decoded = list(read_frames(clip, VIDEO_WIDTH, VIDEO_HEIGHT, first + 1, first + 1 + frames))
+
+    if traced:
+        tracemalloc.start()
+    try:
+        runs = {}
+        for name in ("fresh", "buffers"):
+            runs[name] = segment(copy.deepcopy(graph_cut), decoded, init_mask, is_3d, energy_term_3d, name == "buffers")
+    finally:
+        if traced:
+            tracemalloc.stop()
+    identical = all(np.array_equal(a, b) for a, b in zip(runs["fresh"].pop("masks"), runs["buffers"].pop("masks")))
+    mode = "3d" if is_3d else "2d"
+    return {"fixture": fixture, "frames": len(decoded), "mode": mode, "masks_identical": identical, "runs": runs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixture", default="benchmarks/fixtures/beaver.json")
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--mode", choices=("2d", "3d"), default="3d")
+    parser.add_argument("--energy-term-3d", type=float, default=3)
+    parser.add_argument(
+        "--no-tracemalloc", action="store_true", help="skip the traced peak; tracing slows every allocation down"
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    result = run(args.fixture, args.frames, args.mode == "3d", args.energy_term_3d, not args.no_tracemalloc)
+    print(f"{result['fixture']}, {result['frames']} frames, {result['mode']}")
+    print(f"identical masks: {result['masks_identical']}")
+    print(f"{'':<10}{'ms/frame':>10}{'faults':>9}{'peak MB':>9}{'gc (0/1/2)':>13}{'gc ms':>8}{'rss MB':>16}")
+    for name, r in result["runs"].items():
+        collections = "/".join(map(str, r["gc_collections"]))
+        rss = f"{r['rss_start_mb']:.0f} -> {r['rss_end_mb']:.0f}"
+        print(
+            f"{name:<10}{r['ms_per_frame']:>10.1f}{r['page_faults_per_frame']:>9.0f}"
+            f"{r['traced_peak_mb_per_frame']:>9.2f}{collections:>13}{r['gc_pause_ms']:>8.1f}{rss:>16}"
+        )
+    buffered = result["runs"]["buffers"]
+    print(
+        f"frame context: {buffered['buffers_allocated']} buffers, {buffered['buffers_mb']:.1f} MB, "
+        f"{buffered['buffers_allocated_after_first_frame']} allocated after the first frame"
+    )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
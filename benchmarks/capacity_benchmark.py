@@ -0,0 +1,95 @@
+"""Speed and accuracy of integer vs. float max-flow capacities.
+
+    python -m benchmarks.capacity_benchmark mp4/totoro.mp4 --frames 20 --scales 1 10 100 1000
+
+Every configuration solves the same frames (3D mode uses the float result of the previous
+frame as prior, so errors do not compound) and is compared with the float32 graph.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from benchmarks.common import VIDEO_HEIGHT, VIDEO_WIDTH, build_graph_cut, centre_annotation, iou
+from code.capacity import CapacityEncoder
+from code.mrf_solver import MaxflowSolver
+from code.video_io import read_frames
+
+
+def solve_timed(solver: MaxflowSolver, unary, pairwise):
+    start = time.perf_counter()
+    g, node_ids = solver.build_graph(unary, pairwise)
+    built = time.perf_counter()
+    g.maxflow()
+    solved = time.perf_counter()
+    return solver.read_labels(g, node_ids), built - start, solved - built
+
+
+def run(video_path, frames, scales, energy_term_3d, width=VIDEO_WIDTH, height=VIDEO_HEIGHT):
+    encoders = [CapacityEncoder("float")] + [CapacityEncoder("int", scale) for scale in scales]
+    results = {repr(e): {"build": [], "maxflow": [], "agreement": [], "iou": [], "errors": 0} for e in encoders}
+
+    graph_cut = None
+    prev_mask = None
+    for _, frame in read_frames(video_path, width, height, stop=frames):
+        if graph_cut is None:
+            graph_cut = build_graph_cut(frame, centre_annotation(width, height))
+        graph_cut.image = frame
+        unary = graph_cut.unary_2d() if prev_mask is None else graph_cut.unary_3d(prev_mask, energy_term_3d)
+        pairwise = graph_cut.compute_smoothness_terms()
+
+        reference = None
+        for encoder in encoders:
+            stats = results[repr(encoder)]
+            try:
+                mask, build_time, maxflow_time = solve_timed(MaxflowSolver(encoder), unary, pairwise)
+            except OverflowError:
+                stats["errors"] += 1
+                continue
+            if reference is None:
+                reference = mask
+            stats["build"].append(build_time)
+            stats["maxflow"].append(maxflow_time)
+            stats["agreement"].append(float(np.mean(mask == reference)))
+            stats["iou"].append(iou(mask == 1, reference == 1))
+        prev_mask = reference
+
+    summary = {}
+    for name, stats in results.items():
+        summary[name] = {
+            key: float(np.mean(values)) if values else None
+            for key, values in stats.items()
+            if key != "errors"
+        }
+        summary[name]["overflow_errors"] = stats["errors"]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video")
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--energy-term-3d", type=float, default=3)
+    parser.add_argument("--json", help="write the summary to this file")
+    args = parser.parse_args()
+
+    summary = run(args.video, args.frames, args.scales, args.energy_term_3d)
+    print(f"{'capacities':<40}{'build ms':>10}{'maxflow ms':>12}{'agreement':>11}{'IoU':>8}{'overflows':>10}")
+    for name, s in summary.items():
+        if s["build"] is None:
+            print(f"{name:<40}{'-':>10}{'-':>12}{'-':>11}{'-':>8}{s['overflow_errors']:>10}")
+            continue
+        print(
+            f"{name:<40}{s['build'] * 1000:>10.1f}{s['maxflow'] * 1000:>12.1f}"
+            f"{s['agreement']:>11.5f}{s['iou']:>8.4f}{s['overflow_errors']:>10}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
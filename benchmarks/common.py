@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+import cv2 as cv
+
+from code.annotation import rasterise_annotation
+from code.graph_cut import GraphCut
+
+# working resolution used by the GUI (code/main_app.py)
+VIDEO_WIDTH = 426
+VIDEO_HEIGHT = 240
+
+
+def centre_annotation(width: int, height: int) -> dict:
+    """Rectangle over the middle 70% of the frame plus a foreground stroke at its centre."""
+    rect = [int(width * 0.15), int(height * 0.15), int(width * 0.85), int(height * 0.85)]
+    line_masks = {
+        "fg": np.zeros((height, width), dtype=np.uint8),
+        "bg": np.zeros((height, width), dtype=np.uint8),
+    }
+    cy, cx = height // 2, width // 2
+    line_masks["fg"][cy - height // 20 : cy + height // 20, cx - width // 20 : cx + width // 20] = 1
+    return {"rect": rect, "line_masks": line_masks}
+
+
+def load_annotation(path: str, width: int = VIDEO_WIDTH, height: int = VIDEO_HEIGHT) -> dict:
+    """Annotation fixture (JSON) -> clip, frame and the rect / stroke masks rasterised at width x height.
+
+    Fixtures use the annotation format of the job service (see code.annotation), with the clip
+    and the annotated frame added.
+    """
+    with open(path) as f:
+        fixture = json.load(f)
+    return {"clip": fixture["clip"], "frame": fixture["frame"], **rasterise_annotation(fixture, width, height)}
+
+
+def build_graph_cut(frame: np.ndarray, annotation: dict, **kwargs) -> GraphCut:
+    return GraphCut(frame, rect=annotation["rect"], line_masks=annotation["line_masks"], **kwargs)
+
+
+def iou(a: np.ndarray, b: np.ndarray) -> float:
+    union = np.count_nonzero(a | b)
+    return 1.0 if union == 0 else np.count_nonzero(a & b) / union
+
+
+def boundary(mask: np.ndarray) -> np.ndarray:
+    """Pixels of the mask whose 4-neighbourhood leaves the mask."""
+    return (mask != 0) & (cv.erode(mask.astype(np.uint8), cv.getStructuringElement(cv.MORPH_CROSS, (3, 3))) == 0)
+
+
+def boundary_f_score(mask: np.ndarray, reference: np.ndarray, tolerance: int = 2) -> float:
+    """F-measure of boundary pixels matched within tolerance pixels (as in the DAVIS benchmark)."""
+    b, ref = boundary(mask), boundary(reference)
+    if not b.any() and not ref.any():
+        return 1.0
+    if not b.any() or not ref.any():
+        return 0.0
+    kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (2 * tolerance + 1, 2 * tolerance + 1))
+    precision = np.mean(cv.dilate(ref.astype(np.uint8), kernel)[b] != 0)
+    recall = np.mean(cv.dilate(b.astype(np.uint8), kernel)[ref] != 0)
+    return 0.0 if precision + recall == 0 else 2 * precision * recall / (precision + recall)
+
+
+def flicker(masks: list[np.ndarray]) -> float:
+    """Mean fraction of pixels that change label between consecutive frames."""
+    if len(masks) < 2:
+        return 0.0
+    return float(np.mean([np.mean(a != b) for a, b in zip(masks, masks[1:])]))
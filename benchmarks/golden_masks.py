@@ -0,0 +1,259 @@
+"""Accuracy of the fast segmentation modes against golden masks from the exact path.
+
+    python -m benchmarks.golden_masks record --frames 20
+    python -m benchmarks.golden_masks check --preset superpixels
+    python -m benchmarks.golden_masks check --preset grabcut-opencv --min-iou 0.7
+    python -m benchmarks.golden_masks check --set solver=maxflow-tiled --set tile_size=128 --min-iou 0.98
+    python -m benchmarks.golden_masks check --preset skip-static --set duplicate_threshold=5
+    python -m benchmarks.golden_masks check --set solve_every=4 --set max_warp_error=8
+
+`record` segments every fixture in benchmarks/fixtures with the exact configuration (pixel-level
+max-flow with float capacities, GraphCut.segment_2d / segment_3d) and stores the masks in
+benchmarks/golden. `check` runs the same frames with another configuration (a preset and/or
+GraphCut keyword arguments, the video engine and the propagation options in PROPAGATION) and
+reports per clip and mode:
+
+    IoU          mean over frames of the intersection over union with the golden mask
+    boundary F   mean boundary F-score, boundaries matched within 2 px
+    flicker      fraction of pixels changing label between consecutive frames, and its increase
+                 over the golden masks
+    speed        ms per frame and speed-up over the exact path (as timed when recording)
+
+In 3D mode every configuration uses its own previous mask as prior, as it would in the GUI, so
+errors are allowed to compound. Any clip below a threshold fails the run (exit status 1).
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.common import (
+    VIDEO_HEIGHT,
+    VIDEO_WIDTH,
+    boundary_f_score,
+    build_graph_cut,
+    flicker,
+    iou,
+    load_annotation,
+)
+from code.engines import video_engine
+from code.frame_analysis import FrameChangeDetector
+from code.mask_interpolation import MaskInterpolator
+from code.propagation import propagate
+from code.video_io import read_frames
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "*.json")
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), "golden")
+
+EXACT = {"solver": "maxflow", "capacity_mode": "float", "superpixels": False}
+PRESETS = {
+    "exact": {},
+    "superpixels": {"superpixels": True},
+    "superpixels-no-refine": {"superpixels": True, "refine_band": 0},
+    "int-capacities": {"capacity_mode": "int", "capacity_scale": 100},
+    "tiled": {"solver": "maxflow-tiled", "tile_size": 128, "tile_overlap": 16},
+    "icm": {"solver": "icm"},
+    "loopy-bp": {"solver": "loopy-bp"},
+    "grabcut-opencv": {"engine": "grab_cut_opencv"},
+    "histogram": {"color_model": "histogram"},
+    "skip-static": {"skip_static": True},
+    "solve-every-3": {"solve_every": 3},
+}
+# options of code.propagation.propagate rather than of GraphCut, with their defaults (the exact path):
+#   skip_static          reuse masks of near-duplicate frames, reset at scene cuts (FrameChangeDetector)
+#   duplicate_threshold, cut_threshold    its thresholds
+#   solve_every          solve every Nth frame, flow-warp the others (MaskInterpolator)
+#   max_warp_error, min_warp_confidence, max_flow_error, max_area_change   when a warp is trusted
+PROPAGATION = {
+    "skip_static": False,
+    "duplicate_threshold": 3.0,
+    "cut_threshold": 0.5,
+    "solve_every": 1,
+    "max_warp_error": 12.0,
+    "min_warp_confidence": 0.9,
+    "max_flow_error": 1.0,
+    "max_area_change": 0.05,
+}
+
+
+def parse_value(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+def segment_clip(frames, annotation, mode, energy_term_3d, **kwargs):
+    """Masks of the annotated frame and the frames after it -> (masks, ms per frame).
+
+    engine picks the video engine (code.engines) set up from the fitted GraphCut, the keys of
+    PROPAGATION the approximations of propagate(); everything else goes to GraphCut.
+    """
+    engine = kwargs.pop("engine", "graph_cut")
+    options = {key: kwargs.pop(key, default) for key, default in PROPAGATION.items()}
+    graph_cut = build_graph_cut(frames[0], annotation, **kwargs)
+    masks = [graph_cut.segment_2d()]
+    segmenter = video_engine(engine, graph_cut, masks[0])
+    change_detector = None
+    if options["skip_static"]:
+        change_detector = FrameChangeDetector(options["duplicate_threshold"], options["cut_threshold"])
+        change_detector.prime(frames[0])
+    interpolator = None
+    if options["solve_every"] > 1:
+        interpolator = MaskInterpolator(
+            options["solve_every"],
+            options["max_warp_error"],
+            options["min_warp_confidence"],
+            max_flow_error=options["max_flow_error"],
+            max_area_change=options["max_area_change"],
+        )
+    start = time.perf_counter()
+    segmented = propagate(
+        segmenter,
+        enumerate(frames[1:], 1),
+        masks[0],
+        mode == "3d",
+        energy_term_3d,
+        change_detector=change_detector,
+        interpolator=interpolator,
+    )
+    masks.extend(mask for _, _, mask in segmented)
+    graph_cut.close()
+    return masks, (time.perf_counter() - start) * 1000 / max(len(frames) - 1, 1)
+
+
+def golden_path(name, mode):
+    return os.path.join(GOLDEN_DIR, f"{name}_{mode}.npz")
+
+
+def load_fixture_frames(path, frames):
+    annotation = load_annotation(path, VIDEO_WIDTH, VIDEO_HEIGHT)
+    start = annotation["frame"]
+    decoded = [f for _, f in read_frames(annotation["clip"], VIDEO_WIDTH, VIDEO_HEIGHT, start=start, stop=start + frames + 1)]
+    return annotation, decoded
+
+
+def record(fixtures, frames, modes, energy_term_3d):
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    for path in fixtures:
+        name = os.path.splitext(os.path.basename(path))[0]
+        annotation, decoded = load_fixture_frames(path, frames)
+        for mode in modes:
+            masks, ms_per_frame = segment_clip(decoded, annotation, mode, energy_term_3d, **EXACT)
+            masks = np.stack(masks)
+            np.savez_compressed(
+                golden_path(name, mode),
+                masks=np.packbits(masks, axis=-1),
+                shape=masks.shape,
+                ms_per_frame=ms_per_frame,
+                energy_term_3d=energy_term_3d,
+            )
+            print(f"{name} {mode}: {len(masks)} golden masks, {ms_per_frame:.1f} ms per frame")
+
+
+def evaluate(masks, golden):
+    return {
+        "iou": float(np.mean([iou(m == 1, g == 1) for m, g in zip(masks, golden)])),
+        "min_iou": float(np.min([iou(m == 1, g == 1) for m, g in zip(masks, golden)])),
+        "boundary_f": float(np.mean([boundary_f_score(m, g) for m, g in zip(masks, golden)])),
+        "flicker": flicker(masks),
+        "golden_flicker": flicker(list(golden)),
+    }
+
+
+def check(fixtures, config, modes, thresholds):
+    results = {}
+    failures = []
+    for path in fixtures:
+        name = os.path.splitext(os.path.basename(path))[0]
+        for mode in modes:
+            if not os.path.exists(golden_path(name, mode)):
+                print(f"{name} {mode}: no golden masks, run `record` first")
+                continue
+            stored = np.load(golden_path(name, mode))
+            shape = tuple(stored["shape"])
+            golden = np.unpackbits(stored["masks"], axis=-1, count=shape[-1])
+            annotation, decoded = load_fixture_frames(path, shape[0] - 1)
+            try:
+                masks, ms_per_frame = segment_clip(
+                    decoded, annotation, mode, float(stored["energy_term_3d"]), **{**EXACT, **config}
+                )
+            except OverflowError as e:  # integer capacities
+                failures.append((f"{name}/{mode}", [str(e)]))
+                print(f"{name + '/' + mode:<22}{'overflow':>8}  FAIL")
+                continue
+            result = evaluate(masks, golden)
+            result["ms_per_frame"] = ms_per_frame
+            result["speed_up"] = float(stored["ms_per_frame"]) / ms_per_frame
+            results[f"{name}/{mode}"] = result
+
+            reasons = []
+            if result["iou"] < thresholds["min_iou"]:
+                reasons.append(f"IoU {result['iou']:.4f} < {thresholds['min_iou']}")
+            if result["boundary_f"] < thresholds["min_boundary_f"]:
+                reasons.append(f"boundary F {result['boundary_f']:.4f} < {thresholds['min_boundary_f']}")
+            if result["flicker"] - result["golden_flicker"] > thresholds["max_flicker_increase"]:
+                reasons.append(f"flicker +{result['flicker'] - result['golden_flicker']:.4f}")
+            if reasons:
+                failures.append((f"{name}/{mode}", reasons))
+
+            print(
+                f"{name + '/' + mode:<22}{result['iou']:>8.4f}{result['min_iou']:>9.4f}{result['boundary_f']:>8.4f}"
+                f"{result['flicker']:>9.4f}{result['golden_flicker']:>9.4f}{ms_per_frame:>9.1f}{result['speed_up']:>8.2f}x"
+                + ("  FAIL" if reasons else "")
+            )
+    return results, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["record", "check"])
+    parser.add_argument("fixtures", nargs="*", help=f"annotation fixtures (default: {FIXTURES})")
+    parser.add_argument("--frames", type=int, default=20, help="frames after the annotated one (record)")
+    parser.add_argument("--modes", nargs="+", default=["2d", "3d"], choices=["2d", "3d"])
+    parser.add_argument("--energy-term-3d", type=float, default=3, help="(record)")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="exact")
+    parser.add_argument(
+        "--set", action="append", default=[], metavar="KEY=VALUE", help="GraphCut keyword argument, engine, or a PROPAGATION option"
+    )
+    parser.add_argument("--min-iou", type=float, default=0.95)
+    parser.add_argument("--min-boundary-f", type=float, default=0.85)
+    parser.add_argument("--max-flicker-increase", type=float, default=0.005)
+    parser.add_argument("--json", help="write the check results to this file")
+    # fixtures may come after the options
+    args = parser.parse_intermixed_args()
+
+    fixtures = args.fixtures or sorted(glob.glob(FIXTURES))
+    if args.command == "record":
+        record(fixtures, args.frames, args.modes, args.energy_term_3d)
+        return
+
+    config = dict(PRESETS[args.preset])
+    for item in args.set:
+        key, _, value = item.partition("=")
+        config[key] = parse_value(value)
+    thresholds = {
+        "min_iou": args.min_iou,
+        "min_boundary_f": args.min_boundary_f,
+        "max_flicker_increase": args.max_flicker_increase,
+    }
+    print(f"configuration: {config or 'exact'}")
+    print(f"{'clip/mode':<22}{'IoU':>8}{'min IoU':>9}{'bnd F':>8}{'flicker':>9}{'golden':>9}{'ms/frame':>9}{'speed':>9}")
+    results, failures = check(fixtures, config, args.modes, thresholds)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": config, "thresholds": thresholds, "results": results}, f, indent=2)
+    for key, reasons in failures:
+        print(f"FAILED {key}: {', '.join(reasons)}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Cold import time of the GUI and of every segmentation engine.
+
+    python -m benchmarks.import_benchmark --repeat 5 --json imports.json
+
+Each measurement runs `python -X importtime` in a fresh interpreter, so nothing is cached in
+sys.modules (the OS file cache is warm after the first run). Reported per target: the median
+total import time and the heaviest third-party packages it pulled in, at any depth.
+"first-segmentation" is what the GUI defers until the first segmentation (sklearn and maxflow).
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from code.engines import ENGINES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TARGETS = {
+    "gui": "import code.main_app",
+    "cli": "import code.propagation, code.video_io",
+    "first-segmentation": "import code.main_app; from sklearn.mixture import GaussianMixture; import maxflow",
+    **{
+        f"engine:{name}": f"from code.engines import get_engine; get_engine({name!r})"
+        for name in ENGINES
+    },
+}
+
+
+def import_times(statement: str) -> tuple[float, dict[str, float]]:
+    """Total import time in ms of statement in a fresh interpreter, and the cumulative time of every package."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement], cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    total = 0.0
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        ms = int(cumulative) / 1000
+        # top-level imports are not indented
+        if not name.startswith("  "):
+            total += ms
+        name = name.strip()
+        if "." not in name and name != "code":
+            packages[name] = max(packages.get(name, 0.0), ms)
+    return total, packages
+
+
+def run(repeat: int, top: int) -> dict:
+    results = {}
+    for target, statement in TARGETS.items():
+        try:
+            runs = [import_times(statement) for _ in range(repeat)]
+        except RuntimeError as e:
+            results[target] = {"error": str(e)}
+            continue
+        packages = {name: float(np.median([r[1].get(name, 0.0) for r in runs])) for name in runs[0][1]}
+        heaviest = sorted(packages.items(), key=lambda item: -item[1])[:top]
+        results[target] = {
+            "total_ms": float(np.median([r[0] for r in runs])),
+            "heaviest": dict(heaviest),
+            "heavy_dependencies_loaded": [m for m in ("sklearn", "scipy", "maxflow", "networkx") if m in packages],
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="heaviest packages to report")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.top)
+    for target, result in results.items():
+        if "error" in result:
+            print(f"{target:<32}{'failed':>10}  {result['error']}")
+            continue
+        heaviest = ", ".join(f"{name} {ms:.0f}" for name, ms in result["heaviest"].items())
+        print(f"{target:<32}{result['total_ms']:>8.0f} ms  ({heaviest})")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Per-stage timings of the video segmentation pipeline on the bundled clips.
+
+    python -m benchmarks.pipeline_benchmark --frames 30 --solvers maxflow icm --json results.json
+    python -m benchmarks.pipeline_benchmark --engines grab_cut_opencv --modes 3d
+    python -m benchmarks.pipeline_benchmark --baseline results.json --tolerance 0.2
+
+Every fixture in benchmarks/fixtures names a clip, the annotated frame and its rect / strokes.
+The model is learnt on that frame and the following frames are segmented in 2D and 3D mode by
+propagate() inside the engine's frame context, i.e. the code path of the app and the job service,
+with every video engine (code.engines.VIDEO_ENGINES) and, for graph_cut, every solver. Stages are
+the tracer spans of that path (code.instrumentation), summed per frame:
+
+    decode, gmm_fit, engine_fit (engines learnt from the GraphCut snapshot), data_term,
+    smoothness_term, graph_build, maxflow, readout (max-flow), solve (other solvers),
+    grabcut (grab_cut_opencv), rgba, gif_encode
+
+Stage times are per frame (median, ms) except gmm_fit, engine_fit and gif_encode, which run once.
+Results are keyed solver/mode for graph_cut and engine/mode for the other engines. With
+--baseline, medians that got slower by more than the tolerance are reported as regressions and
+the exit status is 1.
+"""
+
+import argparse
+import contextlib
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import cv2 as cv
+
+from benchmarks.common import VIDEO_HEIGHT, VIDEO_WIDTH, build_graph_cut, load_annotation
+from code.engines import VIDEO_ENGINES, video_engine
+from code.exporters import GifExporter
+from code.instrumentation import tracer
+from code.mrf_solver import SOLVERS
+from code.propagation import propagate
+from code.video_io import read_frames
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "*.json")
+# stages faster than this are dominated by timer noise and never count as a regression
+NOISE_FLOOR_MS = 0.5
+
+
+class StageTimer:
+    def __init__(self):
+        self.times = {}
+
+    def add(self, stage: str, seconds: float):
+        self.times.setdefault(stage, []).append(seconds * 1000)
+
+    def add_frame_spans(self, events: list):
+        """Tracer spans recorded inside frames, summed per frame and stage."""
+        per_frame = {}
+        for event in events:
+            if event["type"] == "span" and event["frame"] is not None and event["name"] != "frame":
+                key = (event["name"], event["frame"])
+                per_frame[key] = per_frame.get(key, 0.0) + event["dur"] / 1000
+        for (stage, _), ms in per_frame.items():
+            self.times.setdefault(stage, []).append(ms)
+
+    def summary(self) -> dict:
+        return {
+            stage: {"median_ms": float(np.median(t)), "mean_ms": float(np.mean(t)), "count": len(t)}
+            for stage, t in self.times.items()
+        }
+
+
+def decode(clip, start, frames, width, height, timer: StageTimer):
+    decoded = []
+    frames_iter = read_frames(clip, width, height, start=start, stop=start + frames + 1)
+    while True:
+        t = time.perf_counter()
+        item = next(frames_iter, None)
+        if item is None:
+            break
+        timer.add("decode", time.perf_counter() - t)
+        decoded.append(item[1])
+    return decoded
+
+
+def segment(engine, frames, init_mask, is_3d, energy_term_3d, timer: StageTimer):
+    """propagate() over frames as the app runs it, timed through the tracer -> (RGBA images, last mask)."""
+    images, mask = [], init_mask
+    context = engine.frame_context() if hasattr(engine, "frame_context") else contextlib.nullcontext()
+    tracer.enable()
+    try:
+        with context:
+            for _, img, mask in propagate(engine, enumerate(frames, 1), init_mask, is_3d, energy_term_3d):
+                images.append(img.copy())  # the image lives in a reused buffer
+    finally:
+        tracer.disable()
+    timer.add_frame_spans(tracer.events)
+    tracer.reset()
+    return images, mask
+
+
+def encode_gif(images, duration, timer: StageTimer):
+    t = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "output.gif")
+        with GifExporter(path) as exporter:
+            for img in images:
+                exporter.write(img, duration)
+        timer.add("gif_encode", time.perf_counter() - t)
+        return os.path.getsize(path)
+
+
+def run_fixture(path, frames, engines, solvers, modes, energy_term_3d, width=VIDEO_WIDTH, height=VIDEO_HEIGHT):
+    annotation = load_annotation(path, width, height)
+    decode_timer = StageTimer()
+    decoded = decode(annotation["clip"], annotation["frame"], frames, width, height, decode_timer)
+    keyframe, frames_to_segment = decoded[0], decoded[1:]
+    fps = cv.VideoCapture(annotation["clip"]).get(cv.CAP_PROP_FPS) or 30
+
+    configs = [("graph_cut", solver, solver) for solver in solvers if "graph_cut" in engines]
+    configs += [(engine, "maxflow", engine) for engine in engines if engine != "graph_cut"]
+    results = {}
+    for engine_name, solver, name in configs:
+        for mode in modes:
+            timer = StageTimer()
+            timer.times["decode"] = decode_timer.times["decode"]
+            t = time.perf_counter()
+            graph_cut = build_graph_cut(keyframe, annotation, solver=solver)
+            timer.add("gmm_fit", time.perf_counter() - t)
+            init_mask = graph_cut.segment_2d()
+            t = time.perf_counter()
+            engine = video_engine(engine_name, graph_cut, init_mask)
+            if engine is not graph_cut:
+                timer.add("engine_fit", time.perf_counter() - t)
+
+            start = time.perf_counter()
+            try:
+                images, mask = segment(engine, frames_to_segment, init_mask, mode == "3d", energy_term_3d, timer)
+            finally:
+                graph_cut.close()
+            gif_bytes = encode_gif(images, round(1000 / fps), timer)
+            total = time.perf_counter() - start
+
+            results[f"{name}/{mode}"] = {
+                "stages": timer.summary(),
+                "frames": len(images),
+                "fps": len(images) / total,
+                "foreground": float(np.mean(mask)),
+                "gif_bytes": gif_bytes,
+            }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Stages slower than baseline * (1 + tolerance) -> list of (key, stage, baseline ms, now ms)."""
+    regressions = []
+    for clip, configs in results.items():
+        for config, result in configs.items():
+            reference = baseline.get(clip, {}).get(config)
+            if reference is None:
+                continue
+            for stage, stats in result["stages"].items():
+                before = reference["stages"].get(stage, {}).get("median_ms")
+                now = stats["median_ms"]
+                if before is not None and now > NOISE_FLOOR_MS and now > before * (1 + tolerance):
+                    regressions.append((f"{clip} {config}", stage, before, now))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", nargs="*", help=f"annotation fixtures (default: {FIXTURES})")
+    parser.add_argument("--frames", type=int, default=30, help="frames segmented after the annotated one")
+    parser.add_argument("--engines", nargs="+", default=list(VIDEO_ENGINES), choices=VIDEO_ENGINES)
+    parser.add_argument(
+        "--solvers", nargs="+", default=["maxflow", "icm", "loopy-bp"], choices=sorted(SOLVERS), help="(graph_cut)"
+    )
+    parser.add_argument("--modes", nargs="+", default=["2d", "3d"], choices=["2d", "3d"])
+    parser.add_argument("--energy-term-3d", type=float, default=3)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slow-down per stage")
+    args = parser.parse_args()
+
+    results = {}
+    for path in args.fixtures or sorted(glob.glob(FIXTURES)):
+        name = os.path.splitext(os.path.basename(path))[0]
+        results[name] = run_fixture(path, args.frames, args.engines, args.solvers, args.modes, args.energy_term_3d)
+
+        stages = sorted({stage for r in results[name].values() for stage in r["stages"]})
+        widths = {stage: max(12, len(stage) + 2) for stage in stages}
+        print(f"\n{name:<22}" + "".join(f"{stage:>{widths[stage]}}" for stage in stages) + f"{'fps':>8}")
+        for config, result in results[name].items():
+            cells = "".join(
+                f"{result['stages'][stage]['median_ms']:>{widths[stage]}.2f}"
+                if stage in result["stages"]
+                else f"{'-':>{widths[stage]}}"
+                for stage in stages
+            )
+            print(f"  {config:<20}" + cells + f"{result['fps']:>8.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for key, stage, before, now in regressions:
+            print(f"REGRESSION {key} {stage}: {before:.2f} ms -> {now:.2f} ms ({now / before - 1:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"\nno stage slower than the baseline by more than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
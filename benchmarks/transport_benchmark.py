@@ -0,0 +1,162 @@
+"""Per-frame cost of handing frames and masks to pipeline workers, and of the FramePipeline end to end.
+
+    python -m benchmarks.transport_benchmark --resolutions 426x240 1280x720 1920x1080 --frames 200
+    python -m benchmarks.transport_benchmark --fixture benchmarks/fixtures/beaver.json --frames 60 --workers 4
+
+The transport part sends each frame to a worker that writes back a mask of the frame, one frame in
+flight at a time, so the time per frame is the round trip:
+
+    inline   the same work in the calling thread (no transport)
+    pickle   ProcessPoolExecutor with the frame and the mask pickled through its pipes
+    shared   ProcessPoolExecutor on a SharedRing, only the slot number is pickled
+    thread   ThreadPoolExecutor, arrays passed by reference
+
+The overhead is the round trip minus inline. With --fixture the clip is also segmented
+in 3D with the terms computed inline and by a FramePipeline on each backend, checking that the
+masks are identical.
+"""
+
+import argparse
+import copy
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.common import build_graph_cut, load_annotation
+from code.frame_transport import FramePipeline, SharedRing, init_worker, worker_ring
+from code.propagation import propagate
+from code.video_io import read_frames
+
+
+def threshold(frame: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    # stand-in work: touches every byte of the frame and writes a full mask
+    return np.greater(frame[:, :, 1], 127, out=out)
+
+
+def pickled_task(frame: np.ndarray) -> np.ndarray:
+    return threshold(frame)
+
+
+def shared_task(slot: int) -> int:
+    ring = worker_ring()
+    threshold(ring.view(slot, "frame"), out=ring.view(slot, "mask"))
+    return slot
+
+
+def time_transport(width: int, height: int, frames: int) -> dict:
+    rng = np.random.default_rng(0)
+    source = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(4)]
+    results = {}
+
+    start = time.perf_counter()
+    for i in range(frames):
+        threshold(source[i % 4])
+    results["inline"] = time.perf_counter() - start
+
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        pool.submit(pickled_task, source[0]).result()  # start the worker outside the timing
+        start = time.perf_counter()
+        for i in range(frames):
+            pool.submit(pickled_task, source[i % 4]).result()
+        results["pickle"] = time.perf_counter() - start
+
+    fields = {"frame": ((height, width, 3), np.uint8), "mask": ((height, width), np.bool_)}
+    ring = SharedRing(2, fields)
+    try:
+        with ProcessPoolExecutor(max_workers=1, initializer=init_worker, initargs=(ring,)) as pool:
+            pool.submit(shared_task, 0).result()
+            start = time.perf_counter()
+            for i in range(frames):
+                slot = ring.acquire()
+                ring.view(slot, "frame")[...] = source[i % 4]
+                pool.submit(shared_task, slot).result()
+                ring.view(slot, "mask").any()  # the caller reads the result
+                ring.release(slot)
+            results["shared"] = time.perf_counter() - start
+    finally:
+        ring.close()
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        start = time.perf_counter()
+        for i in range(frames):
+            pool.submit(threshold, source[i % 4]).result()
+        results["thread"] = time.perf_counter() - start
+
+    per_frame = {name: seconds / frames * 1e6 for name, seconds in results.items()}
+    return {
+        "resolution": f"{width}x{height}",
+        "frame_mb": width * height * 3 / 1e6,
+        "us_per_frame": per_frame,
+        "overhead_us": {name: us - per_frame["inline"] for name, us in per_frame.items() if name != "inline"},
+    }
+
+
+def time_pipeline(fixture: str, frames: int, workers: int, energy_term_3d: float) -> dict:
+    annotation = load_annotation(fixture)
+    clip, first = annotation["clip"], annotation["frame"]
+    _, image = next(read_frames(clip, 426, 240, first, first + 1))
+    graph_cut = build_graph_cut(image, annotation)
+    init_mask = graph_cut.segment_2d()
+    # decode once so only the segmentation is timed
+    decoded = list(read_frames(clip, 426, 240, first + 1, first + 1 + frames))
+
+    runs = {}
+    reference = None
+    for backend in (None, "process", "thread"):
+        model = copy.deepcopy(graph_cut)
+        pipeline = FramePipeline(model, 426, 240, backend, workers) if backend else None
+        try:
+            source = pipeline.frames(decoded) if pipeline else decoded
+            start = time.perf_counter()
+            masks = [mask for _, _, mask in propagate(model, source, init_mask, True, energy_term_3d)]
+            seconds = time.perf_counter() - start
+        finally:
+            if pipeline:
+                pipeline.close()
+        if reference is None:
+            reference = masks
+        runs[backend or "inline"] = {
+            "fps": len(masks) / seconds,
+            "identical": all(np.array_equal(a, b) for a, b in zip(reference, masks)),
+        }
+    return {"fixture": fixture, "frames": len(decoded), "workers": workers, "runs": runs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolutions", nargs="+", default=["426x240", "1280x720", "1920x1080"])
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--fixture", help="also segment this annotation fixture with each FramePipeline backend")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--energy-term-3d", type=float, default=3)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = {"transport": []}
+    print(f"{'resolution':<12}{'MB/frame':>10}" + "".join(f"{name:>10}" for name in ("inline", "pickle", "shared", "thread")))
+    for resolution in args.resolutions:
+        width, height = map(int, resolution.split("x"))
+        row = time_transport(width, height, args.frames)
+        results["transport"].append(row)
+        times = "".join(f"{row['us_per_frame'][name]:>8.0f}us" for name in ("inline", "pickle", "shared", "thread"))
+        print(f"{resolution:<12}{row['frame_mb']:>10.2f}{times}")
+    for row in results["transport"]:
+        overhead = ", ".join(f"{name} {us:.0f}us" for name, us in row["overhead_us"].items())
+        print(f"{row['resolution']} overhead per frame: {overhead}")
+
+    if args.fixture:
+        pipeline = time_pipeline(args.fixture, args.frames, args.workers, args.energy_term_3d)
+        results["pipeline"] = pipeline
+        print(f"\n{pipeline['fixture']}, {pipeline['frames']} frames, {pipeline['workers']} workers")
+        for name, run in pipeline["runs"].items():
+            print(f"  {name:<8}{run['fps']:>8.1f} fps  masks identical: {run['identical']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import base64
+
+import numpy as np
+import cv2 as cv
+
+
+def _decode_mask(data: str, width: int, height: int) -> np.ndarray:
+    """Base64 PNG (any non-zero pixel is set) -> 0/1 mask at width x height."""
+    png = np.frombuffer(base64.b64decode(data), dtype=np.uint8)
+    mask = cv.imdecode(png, cv.IMREAD_GRAYSCALE)
+    if mask is None:
+        raise ValueError("mask is not a valid PNG")
+    mask = cv.resize(mask, (width, height), interpolation=cv.INTER_NEAREST)
+    return (mask > 0).astype(np.uint8)
+
+
+def rasterise_annotation(annotation: dict, width: int, height: int) -> dict:
+    """Annotation -> rect and fg / bg stroke masks at width x height, as GraphCut takes them.
+
+    The annotation gives the rect and the strokes in the coordinates of its own "width" x "height",
+    the way the GUI records them on the snapshot: strokes as polylines ("fg_strokes" /
+    "bg_strokes", drawn "brush_size" wide), or as base64 PNG masks ("fg_mask" / "bg_mask").
+    """
+    sx, sy = width / annotation["width"], height / annotation["height"]
+    x0, y0, x1, y1 = annotation["rect"]
+    rect = [round(x0 * sx), round(y0 * sy), round(x1 * sx), round(y1 * sy)]
+    line_masks = {}
+    for key in ("fg", "bg"):
+        if f"{key}_mask" in annotation:
+            line_masks[key] = _decode_mask(annotation[f"{key}_mask"], width, height)
+            continue
+        mask = np.zeros((height, width), dtype=np.uint8)
+        for stroke in annotation.get(f"{key}_strokes", []):
+            points = np.round(np.array(stroke) * [sx, sy]).astype(np.int32)
+            cv.polylines(mask, [points], False, 1, thickness=annotation.get("brush_size", 4))
+        line_masks[key] = mask
+    return {"rect": rect, "line_masks": line_masks}
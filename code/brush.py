@@ -0,0 +1,55 @@
+import numpy as np
+import cv2 as cv
+import tkinter as tk
+from PIL import Image, ImageTk
+
+# overlay colours of the fg / bg strokes (lime / red, RGB)
+STROKE_COLOURS = {"fg": (0, 255, 0), "bg": (255, 0, 0)}
+
+
+def paint_segment(mask: np.ndarray, start: tuple[int, int], end: tuple[int, int], radius: int) -> tuple:
+    """Rasterise a round brush moved from start to end (x, y) into mask, in place.
+
+    Consecutive motion events are joined by the segment, so fast strokes have no gaps.
+    Returns the (x0, y0, x1, y1) box that may have changed, clipped to the mask.
+    """
+    cv.line(mask, start, end, 1, thickness=2 * radius + 1)
+    h, w = mask.shape
+    x0, x1 = sorted((start[0], end[0]))
+    y0, y1 = sorted((start[1], end[1]))
+    # OpenCV's thick lines can reach one pixel past the nominal radius
+    r = radius + 1
+    return max(x0 - r, 0), max(y0 - r, 0), min(x1 + r + 1, w), min(y1 + r + 1, h)
+
+
+class StrokeOverlay:
+    """The snapshot with the fg / bg strokes painted over it, shown as a single canvas image.
+
+    Only the box touched by the last segment is re-composited, and the one PhotoImage is updated
+    in place, so the canvas does not collect an item per motion event.
+    """
+
+    def __init__(self, canvas: tk.Canvas, image: np.ndarray, line_masks: dict):
+        self.canvas = canvas
+        self.image = image
+        self.line_masks = line_masks
+        self.rendered = image.copy()
+        self.photo = ImageTk.PhotoImage(Image.fromarray(self.rendered))
+        self.item = canvas.create_image(0, 0, anchor=tk.NW, image=self.photo)
+        canvas.tag_lower(self.item)  # keep the rectangle on top
+
+    def refresh(self, box: tuple = None):
+        x0, y0, x1, y1 = box or (0, 0, self.image.shape[1], self.image.shape[0])
+        if x1 <= x0 or y1 <= y0:  # the segment lies off the image
+            return
+        region = self.image[y0:y1, x0:x1].copy()
+        for mode, colour in STROKE_COLOURS.items():
+            region[self.line_masks[mode][y0:y1, x0:x1] == 1] = colour
+        self.rendered[y0:y1, x0:x1] = region
+        if box is None:
+            self.photo.paste(Image.fromarray(self.rendered))
+            return
+        # PhotoImage.paste() always replaces the whole image (its box argument is gone since
+        # Pillow 10), so only the box is uploaded and copied into place by Tk
+        patch = ImageTk.PhotoImage(Image.fromarray(region))
+        self.canvas.tk.call(str(self.photo), "copy", str(patch), "-to", x0, y0)
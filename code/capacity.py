@@ -0,0 +1,50 @@
+import numpy as np
+
+INT32_MAX = np.iinfo(np.int32).max
+
+
+class CapacityEncoder:
+    """How real-valued energies are stored as max-flow capacities.
+
+    mode="float": float32 capacities in a maxflow.Graph[float].
+    mode="int":   fixed point, round(value * scale), in a maxflow.Graph[int]. The smoothness
+                  weights are at most 1 * smoothness scale, so scale must be large enough to keep
+                  them from collapsing to 0 / 1 (the old 3D graph used an implicit scale of 1).
+    """
+
+    def __init__(self, mode: str = "float", scale: float = 1000.0):
+        if mode not in ("float", "int"):
+            raise ValueError(f"Unknown capacity mode '{mode}'. Use 'float' or 'int'")
+        self.mode = mode
+        self.scale = scale
+
+    @property
+    def graph_type(self):
+        return int if self.mode == "int" else float
+
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        if self.mode == "float":
+            return np.asarray(values, dtype=np.float32)
+        scaled = np.rint(np.asarray(values, dtype=np.float64) * self.scale)
+        if scaled.size and np.max(np.abs(scaled)) > INT32_MAX:
+            raise OverflowError(
+                f"Capacity {np.max(np.abs(values)):.3g} does not fit in int32 at scale {self.scale:g}; lower the scale"
+            )
+        return scaled.astype(np.int32)
+
+    def encode_terminals(
+        self, source: np.ndarray, sink: np.ndarray, out: tuple = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """out: three arrays shaped like source (shift, source, sink) to compute in, e.g. from FrameBuffers."""
+        # subtracting the smaller side from both leaves the minimum cut unchanged and keeps flows small
+        shift, shifted_source, shifted_sink = out or (None, None, None)
+        shift = np.minimum(source, sink, out=shift)
+        source = self.encode(np.subtract(source, shift, out=shifted_source))
+        sink = self.encode(np.subtract(sink, shift, out=shifted_sink))
+        # the total flow is bounded by either side's total capacity and is accumulated in int32 too
+        if self.mode == "int" and min(np.abs(source).sum(dtype=np.int64), np.abs(sink).sum(dtype=np.int64)) > INT32_MAX:
+            raise OverflowError(f"Total terminal capacity overflows int32 at scale {self.scale:g}; lower the scale")
+        return source, sink
+
+    def __repr__(self):
+        return f"CapacityEncoder(mode={self.mode!r}, scale={self.scale:g})" if self.mode == "int" else "CapacityEncoder()"
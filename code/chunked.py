@@ -0,0 +1,443 @@
+"""Chunked execution of one long clip over a file-based work queue shared by any number of workers.
+
+    python -m code.chunked plan benchmarks/fixtures/beaver.json /shared/beaver --chunk-frames 40 --overlap 6
+    python -m code.chunked work /shared/beaver          # on every node, as many processes as wanted
+    python -m code.chunked status /shared/beaver
+    python -m code.chunked stitch /shared/beaver beaver.webp
+    python -m code.chunked run benchmarks/fixtures/beaver.json beaver.webp --workers 4   # all of it, locally
+
+`plan` fits the colour models on the annotated frame once and splits the output frames into chunks.
+Each chunk also segments --overlap frames before its own range: they are not used in the output,
+they let the temporal prior settle after the chunk starts from a plain 2D cut with the saved model.
+The first chunk starts from the mask of the annotated frame.
+
+Queue directory layout:
+
+    job.json            validated job (see code.jobs), output frame indices and durations
+    model.pkl           fitted GraphCut, or the video engine set up from it (params["engine"])
+    seeds/NNNN.npy      boundary mask a chunk starts from (chunk 0: the annotated frame)
+    pending/NNNN.json   chunks waiting for a worker
+    claimed/NNNN.json   chunks being segmented; touched while the worker is alive
+    done/NNNN.json      finished chunks, with the worker and timings
+    results/NNNN.npz    frame indices and packed masks of a chunk
+
+A worker claims a chunk by renaming it from pending/ to claimed/, which only one rename can win on
+a local or network filesystem. Claims whose file was not touched for --stale-after seconds go back
+to pending/ (a worker died). Results are written to a temporary name and renamed into place, so a
+chunk that ends up segmented twice is harmless.
+
+`stitch` compares the masks of each overlap with the previous chunk's. When they disagree at the
+hand-over frame (IoU below --min-iou) the chunk is requeued, seeded with the previous chunk's mask
+at its boundary and without warm-up, and the stitch reports it instead of writing the output.
+`run` repeats work and stitch until every chunk agrees.
+"""
+
+import argparse
+import glob
+import json
+import os
+import pickle
+import socket
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from code.engines import video_engine
+from code.exporters import get_exporter
+from code.jobs import fitted_model, validate_job
+
+CHUNK_FRAMES = 60
+OVERLAP = 8
+MIN_IOU = 0.9
+STALE_AFTER = 300  # seconds without a heartbeat before a claim is given to another worker
+QUEUES = ("pending", "claimed", "done")
+
+
+class InconsistentChunks(RuntimeError):
+    pass
+
+
+class FrameSet:
+    """Sampler for read_frames() that keeps a fixed set of frame indices."""
+
+    def __init__(self, indices):
+        self.indices = set(indices)
+
+    def keep(self, index: int) -> bool:
+        return index in self.indices
+
+
+def chunk_name(chunk_id: int) -> str:
+    return f"{chunk_id:04d}"
+
+
+def write_json(path: str, payload):
+    # readers on other nodes never see a half-written file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp, path)
+
+
+def read_json(path: str):
+    with open(path) as f:
+        return json.load(f)
+
+
+def split_chunks(indices: list, chunk_frames: int, overlap: int) -> list:
+    """Chunk specs covering the output frame indices, each with `overlap` warm-up frames in front."""
+    chunks = []
+    for chunk_id, begin in enumerate(range(0, len(indices), chunk_frames)):
+        warm_up = max(begin - overlap, 0)
+        chunks.append(
+            {
+                "id": chunk_id,
+                "frames": indices[warm_up : begin + chunk_frames],
+                "core_from": indices[begin],
+                "seed": None,
+            }
+        )
+    return chunks
+
+
+def plan(spec: dict, queue_dir: str, chunk_frames: int = CHUNK_FRAMES, overlap: int = OVERLAP) -> dict:
+    """Fit the model, split the clip and fill the queue directory -> the planned job."""
+    import cv2 as cv
+
+    from code.video_io import FrameRateSampler
+
+    job = validate_job(spec)
+    params = job["params"]
+    for name in ("seeds", "results", *QUEUES):
+        os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+    if glob.glob(os.path.join(queue_dir, "*", "*.json")):
+        raise ValueError(f"{queue_dir} already holds a planned job")
+
+    cap = cv.VideoCapture(job["video"])
+    total = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+    sampler = FrameRateSampler(cap.get(cv.CAP_PROP_FPS), params["fps"])
+    cap.release()
+    indices = [index for index in range(job["frame"], total) if sampler.keep(index)]
+    if params["frames"]:
+        indices = indices[: params["frames"]]
+    if not indices:
+        raise ValueError(f"frame {job['frame']} is past the end of the video")
+
+    graph_cut, mask, _ = fitted_model(job)
+    with open(os.path.join(queue_dir, "model.pkl"), "wb") as f:
+        pickle.dump(video_engine(params["engine"], graph_cut, mask), f, protocol=pickle.HIGHEST_PROTOCOL)
+    chunks = split_chunks(indices, chunk_frames, overlap)
+    np.save(os.path.join(queue_dir, "seeds", "0000.npy"), mask)
+    chunks[0]["seed"] = job["frame"]
+
+    job.update(indices=indices, durations=sampler.durations[: len(indices)], chunks=len(chunks), overlap=overlap)
+    write_json(os.path.join(queue_dir, "job.json"), job)
+    for chunk in chunks:
+        write_json(os.path.join(queue_dir, "pending", f"{chunk_name(chunk['id'])}.json"), chunk)
+    return job
+
+
+def requeue_stale(queue_dir: str, stale_after: float = STALE_AFTER) -> list:
+    """Move claims without a recent heartbeat back to pending/ -> their names."""
+    requeued = []
+    for path in glob.glob(os.path.join(queue_dir, "claimed", "*.json")):
+        try:
+            if time.time() - os.path.getmtime(path) < stale_after:
+                continue
+            os.rename(path, os.path.join(queue_dir, "pending", os.path.basename(path)))
+        except FileNotFoundError:  # finished or requeued by someone else meanwhile
+            continue
+        requeued.append(os.path.basename(path)[:-5])
+    return requeued
+
+
+def claim(queue_dir: str):
+    """-> (chunk spec, claim path) of a pending chunk now owned by this process, or None."""
+    for path in sorted(glob.glob(os.path.join(queue_dir, "pending", "*.json"))):
+        claimed = os.path.join(queue_dir, "claimed", os.path.basename(path))
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:  # another worker won this one
+            continue
+        os.utime(claimed)
+        return read_json(claimed), claimed
+    return None
+
+
+def segment_chunk(queue_dir: str, job: dict, chunk: dict, heartbeat=None) -> dict:
+    """Masks of the chunk's frames -> {frame index: mask}, starting from its seed or a 2D cut."""
+    from code.frame_analysis import FrameChangeDetector
+    from code.mask_interpolation import MaskInterpolator
+    from code.propagation import propagate
+    from code.video_io import read_frames
+
+    params = job["params"]
+    with open(os.path.join(queue_dir, "model.pkl"), "rb") as f:
+        engine = pickle.load(f)
+    frames = chunk["frames"]
+    wanted = set(frames)
+    if chunk["seed"] is not None:
+        wanted.add(chunk["seed"])
+    decoded = read_frames(
+        job["video"], params["width"], params["height"], min(wanted), max(wanted) + 1, sampler=FrameSet(wanted)
+    )
+
+    index, frame = next(decoded)
+    if chunk["seed"] is not None:
+        mask = np.load(os.path.join(queue_dir, "seeds", f"{chunk_name(chunk['id'])}.npy"))
+    else:
+        _, mask = engine.segment_frame_from_learnt_gmm_2d(frame)
+    masks = {index: mask} if index in frames else {}
+
+    change_detector = None
+    if params["skip_static_frames"]:
+        change_detector = FrameChangeDetector()
+        change_detector.prime(frame)
+    interpolator = MaskInterpolator(interval=params["solve_every"]) if params["solve_every"] > 1 else None
+    segmented = propagate(
+        engine,
+        decoded,
+        mask,
+        params["mode"] == "3d",
+        params["energy_term_3d"],
+        change_detector=change_detector,
+        interpolator=interpolator,
+    )
+    for index, _, mask in segmented:
+        masks[index] = mask
+        if heartbeat:
+            heartbeat()
+    return masks
+
+
+def save_masks(path: str, masks: dict):
+    indices = sorted(masks)
+    stack = np.stack([masks[index] for index in indices]).astype(bool)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, indices=np.array(indices), shape=np.array(stack.shape), masks=np.packbits(stack))
+    os.replace(tmp, path)
+
+
+def load_masks(path: str) -> dict:
+    with np.load(path) as data:
+        shape = tuple(data["shape"])
+        stack = np.unpackbits(data["masks"], count=int(np.prod(shape))).reshape(shape)
+        return dict(zip(data["indices"].tolist(), stack))
+
+
+def work(queue_dir: str, worker_id: str = None, stale_after: float = STALE_AFTER) -> list:
+    """Claim and segment chunks until none are left -> summaries of the chunks done here."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    job = read_json(os.path.join(queue_dir, "job.json"))
+    finished = []
+    while True:
+        claimed = claim(queue_dir)
+        if claimed is None:
+            if requeue_stale(queue_dir, stale_after):
+                continue
+            return finished
+        chunk, claim_path = claimed
+        name = chunk_name(chunk["id"])
+        start = time.perf_counter()
+
+        def heartbeat():
+            try:
+                os.utime(claim_path)
+            except FileNotFoundError:  # requeued as stale; finishing anyway does no harm
+                pass
+
+        masks = segment_chunk(queue_dir, job, chunk, heartbeat)
+        save_masks(os.path.join(queue_dir, "results", f"{name}.npz"), masks)
+        seconds = time.perf_counter() - start
+        summary = {**chunk, "worker": worker_id, "seconds": seconds, "fps": len(masks) / seconds}
+        write_json(os.path.join(queue_dir, "done", f"{name}.json"), summary)
+        try:
+            os.remove(claim_path)
+        except FileNotFoundError:
+            pass
+        print(f"{worker_id} chunk {name}: {len(masks)} frames in {seconds:.1f} s")
+        finished.append(summary)
+
+
+def status(queue_dir: str) -> dict:
+    return {name: sorted(os.path.basename(p)[:-5] for p in glob.glob(os.path.join(queue_dir, name, "*.json"))) for name in QUEUES}
+
+
+def iou(a: np.ndarray, b: np.ndarray) -> float:
+    union = np.count_nonzero(a | b)
+    return np.count_nonzero(a & b) / union if union else 1.0
+
+
+def check_overlaps(queue_dir: str, job: dict, min_iou: float = MIN_IOU) -> list:
+    """Agreement of every chunk with the previous one over their shared frames.
+
+    -> [{"chunk", "frames", "mean_iou", "handover_iou", "consistent"}]; the hand-over IoU is the
+    one of the last shared frame, where the chunk's temporal prior has had the longest to settle.
+    """
+    results = [load_masks(os.path.join(queue_dir, "results", f"{chunk_name(i)}.npz")) for i in range(job["chunks"])]
+    checks = []
+    for chunk_id in range(1, job["chunks"]):
+        previous, current = results[chunk_id - 1], results[chunk_id]
+        shared = sorted(set(previous) & set(current))
+        if not shared:  # seeded from the previous chunk, nothing to compare
+            continue
+        scores = [iou(previous[index].astype(bool), current[index].astype(bool)) for index in shared]
+        checks.append(
+            {
+                "chunk": chunk_id,
+                "frames": len(shared),
+                "mean_iou": float(np.mean(scores)),
+                "handover_iou": scores[-1],
+                "consistent": scores[-1] >= min_iou,
+            }
+        )
+    return checks
+
+
+def reseed(queue_dir: str, job: dict, chunk_id: int):
+    """Requeue a chunk to start from the previous chunk's mask at its boundary, without warm-up."""
+    name = chunk_name(chunk_id)
+    chunk = read_json(os.path.join(queue_dir, "done", f"{name}.json"))
+    previous = load_masks(os.path.join(queue_dir, "results", f"{chunk_name(chunk_id - 1)}.npz"))
+    core = [index for index in chunk["frames"] if index >= chunk["core_from"]]
+    boundary = max(index for index in previous if index < chunk["core_from"])
+    np.save(os.path.join(queue_dir, "seeds", f"{name}.npy"), previous[boundary])
+    spec = {"id": chunk_id, "frames": core, "core_from": chunk["core_from"], "seed": boundary}
+    os.remove(os.path.join(queue_dir, "results", f"{name}.npz"))
+    os.remove(os.path.join(queue_dir, "done", f"{name}.json"))
+    write_json(os.path.join(queue_dir, "pending", f"{name}.json"), spec)
+
+
+def stitch(queue_dir: str, output: str, min_iou: float = MIN_IOU, force: bool = False) -> dict:
+    """Check the overlaps and export the chunks' output frames in order -> summary.
+
+    The first chunk that disagrees with its predecessor is reseeded and InconsistentChunks raised,
+    unless force is set; chunks after it are checked again once it has been segmented anew.
+    """
+    from code.matting import EdgeFeathering
+    from code.video_io import read_frames
+
+    job = read_json(os.path.join(queue_dir, "job.json"))
+    state = status(queue_dir)
+    if len(state["done"]) != job["chunks"]:
+        raise RuntimeError(f"{len(state['done'])} of {job['chunks']} chunks done")
+    checks = check_overlaps(queue_dir, job, min_iou)
+    failed = [check for check in checks if not check["consistent"]]
+    if failed and not force:
+        reseed(queue_dir, job, failed[0]["chunk"])
+        raise InconsistentChunks(
+            f"chunk {failed[0]['chunk']} disagrees with the previous one (IoU {failed[0]['handover_iou']:.3f}), requeued"
+        )
+
+    masks = {}
+    for chunk_id in range(job["chunks"]):
+        chunk = read_json(os.path.join(queue_dir, "done", f"{chunk_name(chunk_id)}.json"))
+        result = load_masks(os.path.join(queue_dir, "results", f"{chunk_name(chunk_id)}.npz"))
+        masks.update((index, mask) for index, mask in result.items() if index >= chunk["core_from"])
+    missing = [index for index in job["indices"] if index not in masks]
+    if missing:
+        raise RuntimeError(f"no mask for frames {missing[:10]}")
+
+    params = job["params"]
+    feathering = EdgeFeathering(radius=params["feather_radius"]) if params["feather_radius"] else None
+    options = {"quality": params["quality"], "lossless": params["lossless"]} if params["format"] == "webp" else {}
+    exporter = get_exporter(params["format"], output, **options)
+    decoded = read_frames(
+        job["video"],
+        params["width"],
+        params["height"],
+        job["indices"][0],
+        job["indices"][-1] + 1,
+        sampler=FrameSet(job["indices"]),
+    )
+    with exporter:
+        for (index, frame), duration in zip(decoded, job["durations"]):
+            rgba = np.dstack([frame, masks[index] * 255]).astype(np.uint8)
+            if feathering:
+                rgba[:, :, 3] = feathering.alpha(frame, masks[index])
+            exporter.write(rgba, duration)
+    return {"output": output, "frames": len(job["indices"]), "chunks": job["chunks"], "overlaps": checks}
+
+
+def run_local(spec: dict, output: str, workers: int, queue_dir: str, chunk_frames: int, overlap: int, min_iou: float):
+    """Plan, segment on local worker processes and stitch, reseeding until every overlap agrees."""
+    job = plan(spec, queue_dir, chunk_frames, overlap)
+    print(f"{len(job['indices'])} frames in {job['chunks']} chunks, queue {queue_dir}")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for _ in range(job["chunks"]):
+            start = time.perf_counter()
+            list(pool.map(work, [queue_dir] * workers, [f"local-{i}" for i in range(workers)]))
+            print(f"segmented in {time.perf_counter() - start:.1f} s")
+            try:
+                return stitch(queue_dir, output, min_iou)
+            except InconsistentChunks as e:
+                print(e)
+    return stitch(queue_dir, output, min_iou, force=True)
+
+
+def print_summary(summary: dict):
+    for check in summary["overlaps"]:
+        print(
+            f"chunk {check['chunk']}: {check['frames']} shared frames, mean IoU {check['mean_iou']:.3f}, "
+            f"hand-over IoU {check['handover_iou']:.3f}"
+        )
+    print(f"{summary['frames']} frames from {summary['chunks']} chunks -> {summary['output']}")
+
+
+def main():
+    from code.service_client import job_from_fixture, parse_settings
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    plan_command = commands.add_parser("plan")
+    plan_command.add_argument("fixture")
+    plan_command.add_argument("queue_dir")
+    run_command = commands.add_parser("run")
+    run_command.add_argument("fixture")
+    run_command.add_argument("output")
+    run_command.add_argument("--workers", type=int, default=os.cpu_count())
+    run_command.add_argument("--queue-dir", help="kept after the run; a temporary directory otherwise")
+    for command in (plan_command, run_command):
+        command.add_argument("--chunk-frames", type=int, default=CHUNK_FRAMES)
+        command.add_argument("--overlap", type=int, default=OVERLAP)
+        command.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="job param")
+    work_command = commands.add_parser("work")
+    work_command.add_argument("queue_dir")
+    work_command.add_argument("--worker-id")
+    work_command.add_argument("--stale-after", type=float, default=STALE_AFTER)
+    commands.add_parser("status").add_argument("queue_dir")
+    stitch_command = commands.add_parser("stitch")
+    stitch_command.add_argument("queue_dir")
+    stitch_command.add_argument("output")
+    stitch_command.add_argument("--force", action="store_true", help="write the output even if overlaps disagree")
+    for command in (run_command, stitch_command):
+        command.add_argument("--min-iou", type=float, default=MIN_IOU, help="hand-over IoU a chunk must reach")
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        job = plan(job_from_fixture(args.fixture, parse_settings(args.set)), args.queue_dir, args.chunk_frames, args.overlap)
+        print(f"{len(job['indices'])} frames in {job['chunks']} chunks")
+    elif args.command == "work":
+        work(args.queue_dir, args.worker_id, args.stale_after)
+    elif args.command == "status":
+        print(json.dumps(status(args.queue_dir), indent=2))
+    elif args.command == "stitch":
+        try:
+            print_summary(stitch(args.queue_dir, args.output, args.min_iou, args.force))
+        except InconsistentChunks as e:
+            raise SystemExit(f"{e}; run the workers again, then stitch")
+    else:
+        spec = job_from_fixture(args.fixture, parse_settings(args.set))
+        if args.queue_dir:
+            summary = run_local(spec, args.output, args.workers, args.queue_dir, args.chunk_frames, args.overlap, args.min_iou)
+        else:
+            with tempfile.TemporaryDirectory(prefix="chunked-") as queue_dir:
+                summary = run_local(spec, args.output, args.workers, queue_dir, args.chunk_frames, args.overlap, args.min_iou)
+        print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
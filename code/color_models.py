@@ -0,0 +1,164 @@
+import copy
+import time
+from typing import Optional
+
+import numpy as np
+
+# GraphCut(color_model=...) choices; "gmm" is a GaussianMixture per label (code/gmm.py)
+COLOR_MODELS = ("gmm", "histogram")
+
+
+class ColorHistogram:
+    """Smoothed 3D colour histogram of labelled pixels, scored by table lookup.
+
+    Stands in for a fitted GaussianMixture wherever only score_samples() is needed. Counts are
+    kept unsmoothed, so adding or removing pixels (e.g. new strokes) is a bincount; the log
+    density table is rebuilt from them with a separable Gaussian blur over neighbouring bins and
+    mixed with a uniform density, so unseen colours get the same finite, low likelihood under
+    the fg and the bg model however many pixels each has. Densities are per unit of RGB volume,
+    which keeps the data terms on the same scale as the GMMs'.
+    """
+
+    def __init__(self, bins: int = 32, smoothing: float = 1.0, uniform: float = 1e-3):
+        self.bins = bins
+        self.smoothing = smoothing  # standard deviation of the blur, in bins
+        self.uniform = uniform  # weight of the uniform density in the mixture
+        self.counts = np.zeros((bins, bins, bins), dtype=np.float64)
+        self.labelled = None  # (h x w) bool, the pixels counted by fit_histogram
+        self.table = None  # (bins^3,) float32 log density, replaced (not updated in place) on every change
+        # per channel: value -> its bin's contribution to the flat index
+        quantised = (np.arange(256) * bins) >> 8
+        self.luts = (quantised * bins * bins, quantised * bins, quantised)
+
+    def index(self, pixels: np.ndarray) -> np.ndarray:
+        """Flat bin index of (N x 3) RGB pixels."""
+        pixels = pixels.reshape(-1, 3)
+        if pixels.dtype != np.uint8:
+            pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+        r, g, b = self.luts
+        return r[pixels[:, 0]] + g[pixels[:, 1]] + b[pixels[:, 2]]
+
+    def add(self, pixels: np.ndarray, weight: float = 1.0):
+        """Count pixels (a negative weight removes them); call update_table() afterwards."""
+        if len(pixels):
+            self.counts.reshape(-1)[:] += weight * np.bincount(self.index(pixels), minlength=self.bins**3)
+
+    def smoothed(self) -> np.ndarray:
+        counts = np.maximum(self.counts, 0)
+        if self.smoothing <= 0:
+            return counts
+        radius = max(int(np.ceil(3 * self.smoothing)), 1)
+        taps = np.exp(-0.5 * (np.arange(-radius, radius + 1) / self.smoothing) ** 2)
+        taps /= taps.sum()
+        for axis in range(3):
+            padded = np.moveaxis(np.pad(np.moveaxis(counts, axis, 0), [(radius, radius), (0, 0), (0, 0)]), 0, axis)
+            blurred = np.zeros_like(counts)
+            for offset, tap in enumerate(taps):
+                blurred += tap * np.take(padded, range(offset, offset + self.bins), axis=axis)
+            counts = blurred
+        return counts
+
+    def update_table(self):
+        n_bins = self.bins**3
+        bin_volume = (256 / self.bins) ** 3
+        smoothed = self.smoothed().reshape(-1)
+        total = smoothed.sum()
+        density = (1 - self.uniform) * smoothed / total if total > 0 else np.zeros(n_bins)
+        density = (density + self.uniform / n_bins) / bin_volume
+        self.table = np.log(density).astype(np.float32)
+
+    def score_samples(self, pixels: np.ndarray) -> np.ndarray:
+        """Log density of each (N x 3) pixel, like GaussianMixture.score_samples."""
+        return self.table[self.index(pixels)]
+
+
+class HistogramScorer:
+    """Same interface as GMMScorer for ColorHistograms: one index computation, one lookup per model."""
+
+    def __init__(self, models: list[ColorHistogram]):
+        self.models = models
+
+    def score(self, pixels: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """Log-likelihood of (N x 3) pixels under each model -> (n_models x N) float32."""
+        pixels = pixels.reshape(-1, 3)
+        if out is None:
+            out = np.empty((len(self.models), len(pixels)), dtype=np.float32)
+        indices = {}
+        for i, model in enumerate(self.models):
+            if model.bins not in indices:
+                indices[model.bins] = model.index(pixels)
+            np.take(model.table, indices[model.bins], out=out[i])
+        return out
+
+
+class RunningHistogram:
+    """Blends the colours of new pixels into a ColorHistogram, for online adaptation (code/gmm_adaptation.py)."""
+
+    def __init__(self, model: ColorHistogram, learning_rate: float = 0.3):
+        self.model = model
+        self.learning_rate = learning_rate
+
+    def partial_fit(self, pixels: np.ndarray):
+        if len(pixels) == 0:
+            return
+        total = self.model.counts.sum()
+        self.model.counts *= 1 - self.learning_rate
+        # the new pixels get the weight the old counts lost
+        self.model.add(pixels, self.learning_rate * total / len(pixels.reshape(-1, 3)))
+        self.model.update_table()
+
+
+def fit_histogram(
+    image: np.ndarray,
+    labelled: np.ndarray,
+    bins: int = 32,
+    smoothing: float = 1.0,
+    previous: Optional[ColorHistogram] = None,
+    name: str = "histogram",
+    verbose: bool = True,
+) -> tuple[ColorHistogram, dict]:
+    """Colour histogram of image[labelled], with stats like fit_gmm's.
+
+    If a previous fit on the same image is given (e.g. the user added strokes and processed
+    again), only the pixels that were labelled or unlabelled since are counted or removed.
+    """
+    start = time.perf_counter()
+    warm_start = (
+        previous is not None
+        and previous.bins == bins
+        and previous.smoothing == smoothing
+        and previous.labelled is not None
+        and previous.labelled.shape == labelled.shape
+    )
+    if warm_start:
+        model = copy.copy(previous)
+        model.counts = previous.counts.copy()
+        added = labelled & ~previous.labelled
+        removed = previous.labelled & ~labelled
+        model.add(image[added])
+        model.add(image[removed], -1.0)
+        n_added, n_removed = int(added.sum()), int(removed.sum())
+    else:
+        model = ColorHistogram(bins, smoothing)
+        model.add(image[labelled])
+        n_added, n_removed = int(labelled.sum()), 0
+    model.labelled = labelled.copy()
+    model.update_table()
+    fit_time = time.perf_counter() - start
+
+    stats = {
+        "name": name,
+        "n_pixels": int(labelled.sum()),
+        "added": n_added,
+        "removed": n_removed,
+        "warm_start": warm_start,
+        "fit_time": fit_time,
+        "log_likelihood": float(np.mean(model.score_samples(image[labelled]))) if labelled.any() else 0.0,
+    }
+    if verbose:
+        print(
+            f"histogram ({name}): {stats['n_pixels']} px (+{n_added} / -{n_removed}"
+            f"{', warm start' if warm_start else ''}), {fit_time * 1000:.1f} ms, "
+            f"log-likelihood {stats['log_likelihood']:.3f}"
+        )
+    return model, stats
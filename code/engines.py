@@ -0,0 +1,30 @@
+import importlib
+
+# Segmentation engines by name -> (module, class). Modules are imported on first use, so
+# e.g. networkx (GrabCut) or scipy (SimulatedAnnealing) are only loaded when that engine is picked.
+ENGINES = {
+    "graph_cut": ("code.graph_cut", "GraphCut"),
+    "grab_cut": ("code.grab_cut", "GrabCut"),
+    "grab_cut_opencv": ("code.grab_cut_opencv", "GrabCutOpenCV"),
+    "simulated_annealing": ("code.simulated_annealing", "SimulatedAnnealing"),
+}
+
+
+def get_engine(name: str) -> type:
+    if name not in ENGINES:
+        raise ValueError(f"Unknown engine '{name}', choose from {sorted(ENGINES)}")
+    module, cls = ENGINES[name]
+    return getattr(importlib.import_module(module), cls)
+
+
+# engines that can segment a video from a fitted GraphCut snapshot (code.propagation)
+VIDEO_ENGINES = ("graph_cut", "grab_cut_opencv")
+
+
+def video_engine(name: str, graph_cut, mask):
+    """The engine `name` set up from a fitted GraphCut and the snapshot's mask."""
+    if name not in VIDEO_ENGINES:
+        raise ValueError(f"Unknown video engine '{name}', choose from {list(VIDEO_ENGINES)}")
+    if name == "graph_cut":
+        return graph_cut
+    return get_engine(name).from_graph_cut(graph_cut, mask)
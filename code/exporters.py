@@ -0,0 +1,362 @@
+import collections
+import io
+import os
+import queue
+import struct
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union
+
+import numpy as np
+from PIL import Image
+
+Frame = Union[np.ndarray, Image.Image]
+
+
+def to_rgba_image(frame: Frame) -> Image.Image:
+    if isinstance(frame, np.ndarray):
+        frame = Image.fromarray(frame)
+    return frame if frame.mode == "RGBA" else frame.convert("RGBA")
+
+
+class Exporter:
+    """Writes an animation one (RGBA frame, duration in ms) at a time.
+
+        with get_exporter("webp", path, quality=90) as exporter:
+            for img, duration in frames:
+                exporter.write(img, duration)
+    """
+
+    extension = None
+
+    def __init__(self, path: str, loop: int = 0):
+        self.path = path
+        self.loop = loop
+        self.num_frames = 0
+
+    def write(self, frame: Frame, duration: int):
+        self.add_frame(to_rgba_image(frame), int(duration))
+        self.num_frames += 1
+
+    def add_frame(self, image: Image.Image, duration: int):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def _gif_sub_blocks(data: bytes, offset: int) -> int:
+    """Offset just past the data sub-blocks starting at offset (after the 0 terminator)."""
+    while data[offset]:
+        offset += data[offset] + 1
+    return offset + 1
+
+
+def encode_gif_frame(frame: Frame, delay: int) -> bytes:
+    """One GIF frame (graphic control extension, image descriptor, local colour table, LZW data).
+
+    Pillow quantizes and compresses the frame, cropped to its opaque pixels, as a single-image
+    GIF, and the blocks are taken out of that file. Every frame gets its own palette, so frames
+    can be encoded independently and in any order. delay is in 1/100 s. Runs in the worker processes.
+    """
+    image = to_rgba_image(frame)
+    # the rest of the frame stays transparent after the previous frame is disposed
+    left, top, right, bottom = image.getchannel("A").getbbox() or (0, 0, 1, 1)
+    buffer = io.BytesIO()
+    image.crop((left, top, right, bottom)).save(buffer, format="GIF")
+    data = buffer.getvalue()
+
+    # logical screen descriptor and global colour table, which holds the palette
+    flags = data[10]
+    offset = 13
+    palette = b""
+    if flags & 0x80:
+        palette = data[offset : offset + 3 * (2 << (flags & 7))]
+        offset += len(palette)
+    transparency = None
+    while data[offset] == 0x21:  # extensions
+        if data[offset + 1] == 0xF9 and data[offset + 3] & 1:
+            transparency = data[offset + 6]
+        offset = _gif_sub_blocks(data, offset + 2)
+    assert data[offset] == 0x2C, "expected an image descriptor"
+    descriptor = bytearray(data[offset : offset + 10])
+    descriptor[1:5] = struct.pack("<HH", left, top)
+    offset += 10
+    if descriptor[9] & 0x80:  # Pillow chose a local colour table
+        palette = data[offset : offset + 3 * (2 << (descriptor[9] & 7))]
+        offset += len(palette)
+    image_data = data[offset : _gif_sub_blocks(data, offset + 1)]
+
+    size_bits = max((len(palette) // 3 - 1).bit_length() - 1, 0)
+    palette = palette.ljust(3 * (2 << size_bits), b"\0")
+    descriptor[9] = 0x80 | (descriptor[9] & 0x40) | size_bits  # local colour table, keep interlacing
+    # disposal 2 (restore to background) so transparent pixels do not show the previous frame
+    packed = (2 << 2) | (transparency is not None)
+    control = struct.pack("<4BHBB", 0x21, 0xF9, 4, packed, delay, transparency or 0, 0)
+    return control + bytes(descriptor) + palette + image_data
+
+
+class GifExporter(Exporter):
+    """GIF with 1-bit transparency, quantized and LZW-compressed in a process pool.
+
+    Frames are submitted to the pool as they arrive and written in order as soon as they are
+    encoded; at most 2 * workers frames are in flight. As every frame is encoded on its own, the
+    file is byte-for-byte the same for any number of workers. workers=1 encodes in this process.
+    """
+
+    extension = "gif"
+
+    def __init__(self, path: str, loop: int = 0, workers: int = None):
+        super().__init__(path, loop)
+        self.workers = workers or os.cpu_count()
+        self.pool = None
+        self.pending = collections.deque()
+        self.file = None
+        self.elapsed = 0  # ms
+
+    def add_frame(self, image, duration):
+        if self.file is None:
+            self.file = open(self.path, "wb")
+            # header, logical screen descriptor without a global colour table, loop extension
+            self.file.write(b"GIF89a" + struct.pack("<HHBBB", *image.size, 0, 0, 0))
+            self.file.write(b"\x21\xff\x0bNETSCAPE2.0" + struct.pack("<BBHB", 3, 1, self.loop, 0))
+        # delays are in 1/100 s, rounded cumulatively so the animation does not drift
+        delay = round((self.elapsed + duration) / 10) - round(self.elapsed / 10)
+        self.elapsed += duration
+        if self.workers == 1:
+            self.file.write(encode_gif_frame(image, delay))
+            return
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.pending.append(self.pool.submit(encode_gif_frame, np.asarray(image), delay))
+        while len(self.pending) > 2 * self.workers:
+            self.file.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.file is None:
+            return
+        try:
+            while self.pending:
+                self.file.write(self.pending.popleft().result())
+            self.file.write(b"\x3b")
+        finally:
+            self.file.close()
+            self.file = None
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+
+# Pillow releases whose private WebP animation encoder (PIL._webp.WebPAnimEncoder) WebPExporter calls
+# directly, verified against Image.save's output. Its positional signature is not public API and
+# changed in 11.2 (width and height became one size tuple); any other version takes the public path.
+WEBP_ENCODER_PILLOW = ((11, 2), (13, 0))  # [first, last) major.minor
+
+
+def _pillow_version() -> tuple:
+    import PIL
+
+    return tuple(int(part) for part in PIL.__version__.split(".")[:2] if part.isdigit())
+
+
+class WebPExporter(Exporter):
+    """Animated WebP with 8-bit alpha, encoded frame by frame.
+
+    On the Pillow versions in WEBP_ENCODER_PILLOW, frames go straight into Pillow's WebP animation
+    encoder (the one Image.save uses internally), so only compressed data is kept. Elsewhere the
+    frames are kept and saved through the public Image.save(save_all=True, append_images=...) on
+    close(), which holds the whole clip in memory.
+    """
+
+    extension = "webp"
+
+    def __init__(self, path: str, loop: int = 0, quality: int = 80, lossless: bool = False, method: int = 4):
+        super().__init__(path, loop)
+        self.quality = quality
+        self.lossless = lossless
+        self.method = method
+        self.timestamp = 0
+        self.encoder = None
+        self.frames = None  # fallback
+        self.durations = []
+
+    def add_frame(self, image, duration):
+        if self.encoder is None and self.frames is None:
+            first, last = WEBP_ENCODER_PILLOW
+            if first <= _pillow_version() < last:
+                from PIL import _webp
+
+                # (size, background, loop, minimize_size, kmin, kmax, allow_mixed, verbose): transparent
+                # background, no size minimisation, keyframe spacing as in gif2webp
+                kmin, kmax = (9, 17) if self.lossless else (3, 5)
+                self.encoder = _webp.WebPAnimEncoder(image.size, 0, self.loop, False, kmin, kmax, False, False)
+            else:
+                self.frames = []
+        if self.encoder is not None:
+            # (frame, timestamp, lossless, quality, alpha_quality, method)
+            self.encoder.add(image.getim(), self.timestamp, self.lossless, self.quality, 100, self.method)
+        else:
+            self.frames.append(image)
+        self.timestamp += duration
+        self.durations.append(duration)
+
+    def close(self):
+        if self.encoder is not None:
+            self.encoder.add(None, self.timestamp, self.lossless, self.quality, 100, 0)
+            data = self.encoder.assemble("", "", "")
+            with open(self.path, "wb") as f:
+                f.write(data)
+            self.encoder = None
+        elif self.frames:
+            self.frames[0].save(
+                self.path,
+                format="WEBP",
+                save_all=True,
+                append_images=self.frames[1:],
+                loop=self.loop,
+                duration=self.durations,
+                quality=self.quality,
+                lossless=self.lossless,
+                method=self.method,
+            )
+            self.frames = None
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def _png_chunks(png: bytes):
+    """(type, data) of every chunk of a PNG file."""
+    offset = 8  # signature
+    while offset < len(png):
+        (length,) = struct.unpack(">I", png[offset : offset + 4])
+        yield png[offset + 4 : offset + 8], png[offset + 8 : offset + 8 + length]
+        offset += 12 + length
+
+
+class APNGExporter(Exporter):
+    """Animated PNG with 8-bit alpha, written to the file as frames arrive.
+
+    Every frame is compressed by Pillow's PNG encoder; its IDAT chunks are copied into the
+    animation (as fdAT after the first frame). The frame count in acTL is not known up front and
+    is patched in on close().
+    """
+
+    extension = "png"
+
+    def __init__(self, path: str, loop: int = 0, compress_level: int = 6):
+        super().__init__(path, loop)
+        self.compress_level = compress_level
+        self.file = None
+        self.actl_offset = None
+        self.sequence = 0
+
+    def add_frame(self, image, duration):
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", compress_level=self.compress_level)
+        chunks = list(_png_chunks(buffer.getvalue()))
+
+        if self.file is None:
+            self.file = open(self.path, "wb")
+            self.file.write(b"\x89PNG\r\n\x1a\n")
+            self.file.write(_png_chunk(b"IHDR", dict(chunks)[b"IHDR"]))
+            self.actl_offset = self.file.tell()
+            self.file.write(_png_chunk(b"acTL", struct.pack(">II", 0, self.loop)))
+
+        # delays are 16-bit fractions of a second
+        numerator, denominator = (duration, 1000) if duration < 65536 else (duration // 10, 100)
+        width, height = image.size
+        fctl = struct.pack(">IIIIIHHBB", self.sequence, width, height, 0, 0, numerator, denominator, 0, 0)
+        self.file.write(_png_chunk(b"fcTL", fctl))
+        self.sequence += 1
+        for chunk_type, data in chunks:
+            if chunk_type != b"IDAT":
+                continue
+            if self.num_frames == 0:
+                self.file.write(_png_chunk(b"IDAT", data))
+            else:
+                self.file.write(_png_chunk(b"fdAT", struct.pack(">I", self.sequence) + data))
+                self.sequence += 1
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.write(_png_chunk(b"IEND", b""))
+        self.file.seek(self.actl_offset)
+        self.file.write(_png_chunk(b"acTL", struct.pack(">II", self.num_frames, self.loop)))
+        self.file.close()
+        self.file = None
+
+
+class BackgroundExporter:
+    """Runs another exporter on a worker thread, fed through a bounded queue.
+
+    write() only blocks when max_pending frames are waiting, so encoding overlaps with
+    segmentation while memory stays bounded. Errors of the worker are raised by close().
+    """
+
+    def __init__(self, exporter: Exporter, max_pending: int = 8):
+        self.exporter = exporter
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    @property
+    def path(self):
+        return self.exporter.path
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is None:
+                try:
+                    self.exporter.write(*item)
+                except Exception as e:
+                    self.error = e
+        if self.error is None:
+            try:
+                self.exporter.close()
+            except Exception as e:
+                self.error = e
+
+    def write(self, frame: Frame, duration: int):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((frame, duration))
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+EXPORTERS = {"gif": GifExporter, "webp": WebPExporter, "apng": APNGExporter}
+
+
+def get_exporter(name: str, path: str, background: bool = True, **options):
+    """Exporter for a format name; options go to its constructor (quality, lossless, compress_level, workers, loop)."""
+    if name not in EXPORTERS:
+        raise ValueError(f"Unknown export format '{name}', choose from {sorted(EXPORTERS)}")
+    exporter = EXPORTERS[name](path, **options)
+    return BackgroundExporter(exporter) if background else exporter
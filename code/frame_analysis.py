@@ -0,0 +1,100 @@
+from typing import Optional
+
+import numpy as np
+import cv2 as cv
+
+
+class FrameChangeDetector:
+    """Cheap per-frame change analysis on a small thumbnail of each decoded frame.
+
+    - "duplicate": no thumbnail pixel near the previous mask's foreground changed by more than
+      duplicate_threshold (grey levels, largest channel) since the last fully segmented frame,
+      so its mask can be reused. Only the region around the object matters: a frame-wide mean
+      would let a small moving object hide below the threshold and freeze its mask. Comparing
+      with the last solved frame rather than the previous one keeps slow motion from drifting
+      through unsolved. Without a mask (or with an empty one) the whole frame is the region.
+    - "cut": the colour histogram distance (Hellinger, 0..1) to the previous frame exceeds
+      cut_threshold, so the temporal prior and colour statistics of the old shot no longer apply.
+    - "normal": anything else.
+
+    Reusing masks is an approximation of the exact result, so it is opt-in everywhere;
+    benchmarks/golden_masks.py --preset skip-static checks it against the golden masks.
+    """
+
+    def __init__(
+        self,
+        duplicate_threshold: float = 3.0,
+        cut_threshold: float = 0.5,
+        size: int = 128,
+        bins: int = 8,
+        margin: int = 3,
+    ):
+        self.duplicate_threshold = duplicate_threshold
+        self.cut_threshold = cut_threshold
+        self.size = size
+        self.bins = bins
+        self.margin = margin  # thumbnail pixels around the mask that count as near the object
+        self.reference = None  # thumbnail of the last solved frame
+        self.prev_histogram = None
+        self.stats = {"frames": 0, "duplicates": 0, "cuts": 0}
+
+    def thumbnail(self, frame: np.ndarray) -> np.ndarray:
+        h, w = frame.shape[:2]
+        return cv.resize(frame, (self.size, max(1, self.size * h // w)), interpolation=cv.INTER_AREA)
+
+    def histogram(self, thumbnail: np.ndarray) -> np.ndarray:
+        quantized = (thumbnail.astype(np.int32) * self.bins) >> 8
+        codes = (quantized[:, :, 0] * self.bins + quantized[:, :, 1]) * self.bins + quantized[:, :, 2]
+        counts = np.bincount(codes.ravel(), minlength=self.bins**3)
+        return counts / counts.sum()
+
+    def prime(self, frame: np.ndarray):
+        """Start from an already segmented frame (e.g. the annotated snapshot)."""
+        self.reference = self.thumbnail(frame).astype(np.float32)
+        self.prev_histogram = self.histogram(self.reference.astype(np.uint8))
+
+    def region(self, mask: Optional[np.ndarray], shape: tuple) -> Optional[np.ndarray]:
+        """Thumbnail pixels within margin of the mask's foreground; None for the whole frame."""
+        if mask is None or not mask.any():
+            return None
+        small = cv.resize(mask.astype(np.uint8), (shape[1], shape[0]), interpolation=cv.INTER_AREA) > 0
+        if not small.any():  # thinner than a thumbnail pixel everywhere
+            small = cv.resize(mask.astype(np.uint8), (shape[1], shape[0]), interpolation=cv.INTER_NEAREST) > 0
+        kernel = np.ones((2 * self.margin + 1, 2 * self.margin + 1), np.uint8)
+        return cv.dilate(small.astype(np.uint8), kernel) > 0
+
+    def change(self, thumbnail: np.ndarray, mask: Optional[np.ndarray] = None) -> float:
+        """Largest per-pixel change (grey levels) since the reference, within the region of mask."""
+        difference = np.max(np.abs(thumbnail.astype(np.float32) - self.reference), axis=2)
+        region = self.region(mask, difference.shape)
+        return float(difference.max() if region is None else difference[region].max())
+
+    def classify(self, frame: np.ndarray, mask: Optional[np.ndarray] = None) -> str:
+        """Kind of frame; mask is the mask of the previous frame, whose neighbourhood decides "duplicate"."""
+        thumbnail = self.thumbnail(frame)
+        histogram = self.histogram(thumbnail)
+        self.stats["frames"] += 1
+
+        kind = "normal"
+        if self.prev_histogram is not None:
+            distance = np.sqrt(max(0.0, 1.0 - np.sum(np.sqrt(histogram * self.prev_histogram))))
+            if distance > self.cut_threshold:
+                kind = "cut"
+            elif self.change(thumbnail, mask) < self.duplicate_threshold:
+                kind = "duplicate"
+        self.prev_histogram = histogram
+
+        if kind == "duplicate":
+            self.stats["duplicates"] += 1
+        else:
+            if kind == "cut":
+                self.stats["cuts"] += 1
+            self.reference = thumbnail.astype(np.float32)
+        return kind
+
+    def summary(self) -> str:
+        frames = max(self.stats["frames"], 1)
+        return (
+            f"{self.stats['frames']} frames analysed: {self.stats['duplicates']} near-duplicates reused "
+            f"({100 * self.stats['duplicates'] / frames:.1f}%), {self.stats['cuts']} scene cuts"
+        )
@@ -0,0 +1,66 @@
+"""Work arrays reused from one frame to the next while a clip is segmented (see GraphCut.frame_context).
+
+Segmenting a frame used to allocate every intermediate afresh: data terms, the stacked unary,
+the smoothness terms and their float64 temporaries, the terminal capacities, a new max-flow graph
+and the RGBA image. A FrameBuffers owns one array per intermediate, allocated at the first frame
+of a resolution, and the steps write into it with numpy's out= arguments; the max-flow graph is
+reset instead of rebuilt, which keeps its node and edge blocks.
+
+What a frame returns in these buffers is only valid until the next frame is segmented: the RGBA
+image, the data terms (GraphCut.last_data_terms) and the smoothness terms. Masks are always new
+arrays, since propagate() keeps the previous one and callers collect them.
+"""
+
+from typing import Optional
+
+import numpy as np
+import cv2 as cv
+
+
+class FrameBuffers:
+    """Named work arrays of fixed shape and dtype, plus the max-flow graph of the last frame."""
+
+    def __init__(self):
+        self.arrays = {}
+        self.graph = None
+        self.allocations = 0  # arrays (re)allocated so far; stays put once the shapes are known
+
+    def __getstate__(self):
+        # copies (deepcopy, pickling to workers) start empty; the graph cannot be pickled anyway
+        return {"arrays": {}, "graph": None, "allocations": 0}
+
+    def get(self, name: str, shape: tuple, dtype, fill: Optional[float] = None) -> np.ndarray:
+        """The array called name; reallocated (and filled with fill) only when shape or dtype change.
+
+        Only the first allocation is filled, so with fill the caller must never write the parts
+        meant to keep that value (e.g. the unused last column of the horizontal smoothness terms).
+        """
+        dtype = np.dtype(dtype)
+        array = self.arrays.get(name)
+        if array is None or array.shape != shape or array.dtype != dtype:
+            array = np.empty(shape, dtype) if fill is None else np.full(shape, fill, dtype)
+            self.arrays[name] = array
+            self.allocations += 1
+        return array
+
+    def graph_for(self, graph_type):
+        """A max-flow graph with no nodes left, reused when the capacity type has not changed."""
+        import maxflow
+
+        if self.graph is None or not isinstance(self.graph, maxflow.Graph[graph_type]):
+            self.graph = maxflow.Graph[graph_type]()
+            self.allocations += 1
+        else:
+            self.graph.reset()
+        return self.graph
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays.values())
+
+
+def compose_rgba(frame: np.ndarray, mask: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """RGB frame with the binary mask as alpha (0 / 255), written into out when given."""
+    img = cv.cvtColor(frame, cv.COLOR_RGB2RGBA, dst=out)
+    np.multiply(mask, 255, out=img[:, :, 3], casting="unsafe")
+    return img
@@ -0,0 +1,279 @@
+"""Frames, masks and data terms handed between pipeline workers by slot number instead of by pickle.
+
+A SharedRing is a fixed number of slots, each a set of fixed-shape arrays (a frame, its mask, its
+data and smoothness terms), in one multiprocessing.shared_memory block. The process that creates
+it fills a slot and passes the slot's number to a worker, which reads and writes the same memory;
+no array is copied through a pipe. FramePipeline uses it to compute the terms of upcoming frames on
+worker processes while the caller segments the current one, or does the same on threads, which is
+enough for work that releases the GIL (OpenCV and most of numpy) and costs no transport at all.
+"""
+
+import collections
+import copy
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from code.instrumentation import tracer
+
+ALIGNMENT = 64  # every array starts on a cache line
+
+
+def term_fields(width: int, height: int) -> dict:
+    """Slot layout of FramePipeline: name -> (shape, dtype)."""
+    return {
+        "frame": ((height, width, 3), np.uint8),
+        "mask": ((height, width), np.uint8),
+        "fg": ((height, width), np.float32),
+        "bg": ((height, width), np.float32),
+        "horizontal": ((height, width), np.float32),
+        "vertical": ((height, width), np.float32),
+    }
+
+
+class SharedRing:
+    """`slots` sets of fixed-shape arrays in one block of memory, shared between processes when `shared`.
+
+    The creating process owns the free list: acquire() a slot, fill it, hand its number to a worker
+    and release() it once the results are used. Pickling sends only the block's name and layout, so
+    a worker process attaches to the same memory; only the creator unlinks it.
+    """
+
+    def __init__(self, slots: int, fields: dict, shared: bool = True):
+        self.slots = slots
+        self.fields = {name: (tuple(shape), np.dtype(dtype)) for name, (shape, dtype) in fields.items()}
+        self.offsets = {}
+        size = 0
+        for name, (shape, dtype) in self.fields.items():
+            self.offsets[name] = size
+            size += -(-int(np.prod(shape)) * dtype.itemsize // ALIGNMENT) * ALIGNMENT
+        self.slot_bytes = size
+        self.owner = True
+        self.free = queue.SimpleQueue()
+        for slot in range(slots):
+            self.free.put(slot)
+        if shared:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * self.slot_bytes)
+            self.attach(self.shm.buf)
+        else:
+            self.shm = None
+            self.attach(bytearray(slots * self.slot_bytes))
+
+    def attach(self, buffer):
+        self.views = [
+            {
+                name: np.ndarray(shape, dtype, buffer=buffer, offset=slot * self.slot_bytes + self.offsets[name])
+                for name, (shape, dtype) in self.fields.items()
+            }
+            for slot in range(self.slots)
+        ]
+
+    def __getstate__(self):
+        if self.shm is None:
+            raise TypeError("a ring in process memory cannot be sent to another process")
+        return {
+            "slots": self.slots,
+            "fields": self.fields,
+            "offsets": self.offsets,
+            "slot_bytes": self.slot_bytes,
+            "name": self.shm.name,
+        }
+
+    def __setstate__(self, state):
+        name = state.pop("name")
+        self.__dict__.update(state)
+        self.owner = False
+        self.free = None
+        self.shm = shared_memory.SharedMemory(name=name)
+        self.attach(self.shm.buf)
+
+    @property
+    def nbytes(self) -> int:
+        return self.slots * self.slot_bytes
+
+    def view(self, slot: int, name: str) -> np.ndarray:
+        return self.views[slot][name]
+
+    def acquire(self, block: bool = True):
+        """A free slot number; None when none is free and block is False."""
+        try:
+            return self.free.get(block)
+        except queue.Empty:
+            return None
+
+    def release(self, slot: int):
+        self.free.put(slot)
+
+    def close(self):
+        self.views = []
+        if self.shm is None:
+            return
+        try:
+            self.shm.close()
+        except BufferError:  # arrays handed out are still alive; the mapping goes with the last one
+            pass
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
+
+
+# ---------------------------------------------------------------- worker side
+
+_ring = None
+_graph_cut = None
+
+
+def init_worker(ring: SharedRing, graph_cut=None):
+    """Pool initializer: attach to the ring (and keep a model) once per worker process."""
+    global _ring, _graph_cut
+    _ring, _graph_cut = ring, graph_cut
+
+
+def worker_ring() -> SharedRing:
+    return _ring
+
+
+def prepare_slot(ring: SharedRing, graph_cut, slot: int, solve_2d: bool) -> int:
+    """Data and smoothness terms (and the 2D mask) of the frame in a slot, written to the same slot."""
+    views = ring.views[slot]
+    graph_cut.image = views["frame"]
+    fg_D, bg_D = graph_cut.compute_data_terms()
+    views["fg"][...] = fg_D
+    views["bg"][...] = bg_D
+    horizontal, vertical = graph_cut.compute_smoothness_terms()
+    views["horizontal"][...] = horizontal
+    views["vertical"][...] = vertical
+    if solve_2d:
+        graph_cut.use_prepared(views["frame"], (views["fg"], views["bg"]), (views["horizontal"], views["vertical"]))
+        views["mask"][...] = graph_cut.segment_2d()
+        graph_cut.prepared = None
+    return slot
+
+
+def _prepare_in_process(slot: int, solve_2d: bool) -> int:
+    return prepare_slot(_ring, _graph_cut, slot, solve_2d)
+
+
+class FramePipeline:
+    """Computes the terms of upcoming frames on workers while the caller segments the current one.
+
+        pipeline = FramePipeline(graph_cut, width, height, backend="process", workers=4)
+        try:
+            for index, img, mask in propagate(graph_cut, pipeline.frames(read_frames(...)), ...):
+                ...
+        finally:
+            pipeline.close()
+
+    backend "process" runs the workers in a ProcessPoolExecutor attached to a SharedRing: per frame
+    only slot numbers cross the process boundary. backend "thread" uses a ThreadPoolExecutor on a
+    ring in ordinary memory. With solve_2d the workers also solve the 2D cut, which is then all that
+    is left to do in 2D mode; in 3D mode the cut needs the previous mask and stays with the caller.
+
+    A frame yielded by frames() lives in its slot and stays valid until `hold` more frames have been
+    yielded. propagate keeps the previous frame, which the default hold=2 covers; when it keeps one
+    across a run of duplicate frames (change detection with mask interpolation) it copies it.
+    The workers use copies of the model made when the pipeline starts, so the model must not
+    change meanwhile (no online colour model adaptation).
+    """
+
+    def __init__(
+        self,
+        graph_cut,
+        width: int,
+        height: int,
+        backend: str = "process",
+        workers: int = None,
+        depth: int = None,
+        solve_2d: bool = False,
+        hold: int = 2,
+    ):
+        if backend not in ("process", "thread"):
+            raise ValueError(f"unknown backend {backend}")
+        self.graph_cut = graph_cut
+        self.backend = backend
+        self.workers = workers or os.cpu_count()
+        self.depth = depth or 2 * self.workers  # frames in flight
+        self.solve_2d = solve_2d
+        self.hold = hold
+        self.ring = SharedRing(self.depth + hold, term_fields(width, height), shared=backend == "process")
+        model = copy.deepcopy(graph_cut)
+        model.prepared = None
+        if backend == "process":
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=(self.ring, model))
+        else:
+            # compute_data_terms keeps per-instance buffers, so every thread takes a model of its own
+            self.models = queue.SimpleQueue()
+            for _ in range(self.workers):
+                self.models.put(copy.deepcopy(model))
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    def submit(self, slot: int):
+        if self.backend == "process":
+            return self.pool.submit(_prepare_in_process, slot, self.solve_2d)
+        return self.pool.submit(self._prepare_in_thread, slot)
+
+    def _prepare_in_thread(self, slot: int) -> int:
+        model = self.models.get()
+        try:
+            return prepare_slot(self.ring, model, slot, self.solve_2d)
+        finally:
+            self.models.put(model)
+
+    def frames(self, decoded):
+        """Yield (index, frame) of decoded, with the frame's prepared terms handed to the GraphCut."""
+        decoded = iter(decoded)
+        pending = collections.deque()  # (index, slot, future) in frame order
+        held = collections.deque()
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < self.depth:
+                    item = next(decoded, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    index, frame = item
+                    slot = self.ring.acquire()
+                    with tracer.span("transport_write"):
+                        self.ring.view(slot, "frame")[...] = frame
+                    pending.append((index, slot, self.submit(slot)))
+                if not pending:
+                    return
+                index, slot, future = pending.popleft()
+                with tracer.span("transport_wait"):
+                    future.result()
+                views = self.ring.views[slot]
+                self.graph_cut.use_prepared(
+                    views["frame"],
+                    (views["fg"], views["bg"]),
+                    (views["horizontal"], views["vertical"]),
+                    views["mask"] if self.solve_2d else None,
+                )
+                held.append(slot)
+                if len(held) > self.hold:
+                    self.ring.release(held.popleft())
+                yield index, views["frame"]
+        finally:
+            self.graph_cut.prepared = None
+            for _, slot, future in pending:
+                future.cancel()
+            for _, slot, future in pending:
+                if not future.cancelled():
+                    future.exception()  # the slot may still be written to until the worker is done
+                self.ring.release(slot)
+            for slot in held:
+                self.ring.release(slot)
+
+    def close(self):
+        self.pool.shutdown()
+        self.ring.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,116 @@
+import time
+import numpy as np
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from sklearn.mixture import GaussianMixture
+
+
+def stratified_subsample(strata: list[np.ndarray], max_samples: int, rng: np.random.Generator) -> np.ndarray:
+    """Draw at most max_samples pixels from the given groups (e.g. strokes vs. rectangle).
+
+    Every group keeps a fair share of the budget so small groups such as user strokes
+    are not drowned out by a large rectangle region; leftover budget goes to the larger groups.
+    """
+    strata = [s.reshape(-1, 3) for s in strata if len(s) > 0]
+    total = sum(len(s) for s in strata)
+    if total <= max_samples:
+        return np.concatenate(strata, axis=0) if strata else np.empty((0, 3))
+
+    # water-filling: small groups are kept whole, the rest split what is left evenly
+    quotas = [0] * len(strata)
+    remaining_budget = max_samples
+    remaining = sorted(range(len(strata)), key=lambda i: len(strata[i]))
+    while remaining:
+        share = remaining_budget // len(remaining)
+        i = remaining.pop(0)
+        quotas[i] = min(len(strata[i]), share)
+        remaining_budget -= quotas[i]
+
+    samples = []
+    for stratum, quota in zip(strata, quotas):
+        if quota < len(stratum):
+            stratum = stratum[rng.choice(len(stratum), size=quota, replace=False)]
+        samples.append(stratum)
+    return np.concatenate(samples, axis=0)
+
+
+def uniform_subsample(strata: list[np.ndarray], max_samples: int, rng: np.random.Generator) -> np.ndarray:
+    """Draw at most max_samples pixels uniformly from all groups together, without concatenating them."""
+    sizes = [len(s) for s in strata]
+    total = sum(sizes)
+    if total <= max_samples:
+        return np.concatenate(strata, axis=0) if strata else np.empty((0, 3))
+    picks = np.sort(rng.choice(total, size=max_samples, replace=False))
+    offsets = np.cumsum([0] + sizes)
+    groups = np.searchsorted(offsets, picks, side="right") - 1
+    return np.concatenate([strata[g][picks[groups == g] - offsets[g]] for g in range(len(strata))], axis=0)
+
+
+def fit_gmm(
+    strata: list[np.ndarray],
+    n_components: int = 5,
+    covariance_type: str = "full",
+    max_samples: int = 20000,
+    score_samples: int = 5000,
+    random_state: int = 0,
+    previous: Optional["GaussianMixture"] = None,
+    name: str = "gmm",
+    verbose: bool = True,
+) -> tuple["GaussianMixture", dict]:
+    """Fit a GMM on a subsample of the labelled pixels.
+
+    If a previous fit with the same shape is given (e.g. the user added strokes and
+    processed again), EM starts from its parameters instead of k-means.
+    Returns the model and a dict with timing and the average log-likelihood of the labelled pixels,
+    estimated on a uniform sample of at most score_samples of them (scoring them all would cost more
+    than the fit on large regions).
+    """
+    # sklearn (and scipy with it) takes most of the start-up time, load it on the first fit
+    from sklearn.mixture import GaussianMixture
+
+    rng = np.random.default_rng(random_state)
+    strata = [s.reshape(-1, 3) for s in strata]
+    n_pixels = sum(len(s) for s in strata)
+    # sklearn's scoring does not upcast uint8 input and overflows, so the samples go to float64
+    samples = stratified_subsample(strata, max_samples, rng).astype(np.float64)
+    scored = uniform_subsample(strata, score_samples, rng).astype(np.float64)
+
+    warm_start = (
+        previous is not None
+        and previous.n_components == n_components
+        and previous.covariance_type == covariance_type
+    )
+    if warm_start:
+        gmm = GaussianMixture(
+            n_components=n_components,
+            covariance_type=covariance_type,
+            weights_init=previous.weights_,
+            means_init=previous.means_,
+            precisions_init=previous.precisions_,
+            random_state=random_state,
+        )
+    else:
+        gmm = GaussianMixture(n_components=n_components, covariance_type=covariance_type, random_state=random_state)
+
+    start = time.perf_counter()
+    gmm.fit(samples)
+    fit_time = time.perf_counter() - start
+
+    stats = {
+        "name": name,
+        "n_pixels": n_pixels,
+        "n_samples": len(samples),
+        "n_scored": len(scored),
+        "warm_start": warm_start,
+        "n_iter": gmm.n_iter_,
+        "fit_time": fit_time,
+        "log_likelihood": float(gmm.score(scored)),
+    }
+    if verbose:
+        print(
+            f"GMM fit ({name}): {stats['n_samples']}/{stats['n_pixels']} px, "
+            f"{stats['n_iter']} iters{' (warm start)' if warm_start else ''}, "
+            f"{fit_time * 1000:.0f} ms, log-likelihood {stats['log_likelihood']:.3f}"
+        )
+    return gmm, stats
@@ -0,0 +1,168 @@
+from collections import deque
+from typing import TYPE_CHECKING
+
+import numpy as np
+import cv2 as cv
+
+from code.color_models import ColorHistogram, RunningHistogram
+
+if TYPE_CHECKING:
+    from sklearn.mixture import GaussianMixture
+
+
+def set_gmm_parameters(gmm: "GaussianMixture", weights, means, covariances):
+    """Overwrite the parameters of a fitted GaussianMixture ("full" or "diag") and its cached precisions."""
+    gmm.weights_ = weights
+    gmm.means_ = means
+    gmm.covariances_ = covariances
+    if gmm.covariance_type == "full":
+        cov_chol = np.linalg.cholesky(covariances)
+        eye = np.eye(means.shape[1])
+        gmm.precisions_cholesky_ = np.stack([np.linalg.solve(c, eye).T for c in cov_chol])
+        gmm.precisions_ = gmm.precisions_cholesky_ @ np.transpose(gmm.precisions_cholesky_, (0, 2, 1))
+    elif gmm.covariance_type == "diag":
+        gmm.precisions_cholesky_ = 1.0 / np.sqrt(covariances)
+        gmm.precisions_ = 1.0 / covariances
+    else:
+        raise ValueError(f"Online adaptation does not support covariance_type='{gmm.covariance_type}'")
+
+
+class RunningGMM:
+    """Exponentially-weighted sufficient statistics of a GMM, updated by mini-batch EM steps."""
+
+    def __init__(self, gmm: "GaussianMixture", learning_rate=0.3, reg_covar=1e-3):
+        self.gmm = gmm
+        self.learning_rate = learning_rate
+        self.reg_covar = reg_covar
+        self.full = gmm.covariance_type == "full"
+
+        # normalised statistics: S0 = E[r_k], S1 = E[r_k x], S2 = E[r_k x x^T] (or E[r_k x^2] for diag)
+        w, mu, cov = gmm.weights_, gmm.means_, gmm.covariances_
+        self.s0 = w.copy()
+        self.s1 = w[:, None] * mu
+        if self.full:
+            self.s2 = w[:, None, None] * (cov + mu[:, :, None] * mu[:, None, :])
+        else:
+            self.s2 = w[:, None] * (cov + mu**2)
+
+    def partial_fit(self, pixels: np.ndarray):
+        """One E step on the batch, blended into the running statistics, then an M step."""
+        x = pixels.reshape(-1, pixels.shape[-1]).astype(np.float64)
+        if len(x) == 0:
+            return
+        resp = self.gmm.predict_proba(x)  # (N x K)
+        n = len(x)
+        b0 = resp.sum(axis=0) / n
+        b1 = resp.T @ x / n
+        if self.full:
+            b2 = np.einsum("nk,ni,nj->kij", resp, x, x) / n
+        else:
+            b2 = resp.T @ (x**2) / n
+
+        a = self.learning_rate
+        self.s0 = (1 - a) * self.s0 + a * b0
+        self.s1 = (1 - a) * self.s1 + a * b1
+        self.s2 = (1 - a) * self.s2 + a * b2
+
+        s0 = np.maximum(self.s0, 1e-10)
+        weights = s0 / s0.sum()
+        means = self.s1 / s0[:, None]
+        if self.full:
+            covariances = self.s2 / s0[:, None, None] - means[:, :, None] * means[:, None, :]
+            covariances += self.reg_covar * np.eye(x.shape[1])
+        else:
+            covariances = np.maximum(self.s2 / s0[:, None] - means**2, 0) + self.reg_covar
+        set_gmm_parameters(self.gmm, weights, means, covariances)
+
+
+class OnlineGMMAdapter:
+    """Keeps the fg / bg colour models of a GraphCut up to date while a video is segmented.
+
+    Every frame, confidently labelled pixels (inside the eroded mask and with a clear data-term
+    margin) are kept in a short history. The models are only refreshed when the mean data-term
+    energy of the chosen labels drifts above the reference energy by more than drift_threshold.
+    The reference is the energy of the first frame of a shot, and of the first frame after each
+    refresh, so a lasting change (e.g. lighting) is adapted to once rather than every cooldown frames.
+    """
+
+    def __init__(
+        self,
+        graph_cut,
+        drift_threshold: float = 0.1,
+        learning_rate: float = 0.3,
+        confidence_margin: float = 2.0,
+        history: int = 5,
+        samples_per_frame: int = 2000,
+        cooldown: int = 3,
+        random_state: int = 0,
+    ):
+        self.graph_cut = graph_cut
+        self.drift_threshold = drift_threshold
+        self.confidence_margin = confidence_margin
+        self.samples_per_frame = samples_per_frame
+        self.cooldown = cooldown
+        self.rng = np.random.default_rng(random_state)
+
+        running = RunningHistogram if isinstance(graph_cut.fg_gmm, ColorHistogram) else RunningGMM
+        self.fg_model = running(graph_cut.fg_gmm, learning_rate)
+        self.bg_model = running(graph_cut.bg_gmm, learning_rate)
+        self.fg_history = deque(maxlen=history)
+        self.bg_history = deque(maxlen=history)
+        self.kernel = np.ones((5, 5), np.uint8)
+
+        self.reference_energy = None
+        self.frames_since_refresh = cooldown
+        self.num_frames = 0
+        self.num_refreshes = 0
+
+    def drift_statistic(self, mask, fg_D, bg_D) -> float:
+        """Mean unscaled data-term energy of the labels that were chosen."""
+        scale = self.graph_cut.data_term_scale or 1.0
+        return float(np.mean(np.where(mask == 1, fg_D, bg_D)) / scale)
+
+    def confident_pixels(self, frame, mask, fg_D, bg_D):
+        margin = self.confidence_margin * (self.graph_cut.data_term_scale or 1.0)
+        fg_core = cv.erode(mask, self.kernel) == 1
+        bg_core = cv.erode(1 - mask, self.kernel) == 1
+        fg_pixels = frame[fg_core & (bg_D - fg_D > margin)]
+        bg_pixels = frame[bg_core & (fg_D - bg_D > margin)]
+        return self.subsample(fg_pixels), self.subsample(bg_pixels)
+
+    def subsample(self, pixels):
+        if len(pixels) > self.samples_per_frame:
+            pixels = pixels[self.rng.choice(len(pixels), size=self.samples_per_frame, replace=False)]
+        return pixels
+
+    def on_scene_cut(self):
+        """Start over in a new shot: old pixels and the old reference energy no longer apply."""
+        self.fg_history.clear()
+        self.bg_history.clear()
+        self.reference_energy = None
+        self.frames_since_refresh = self.cooldown
+
+    def observe(self, frame: np.ndarray, mask: np.ndarray) -> bool:
+        """Record the result for one frame; returns True if the models were refreshed."""
+        fg_D, bg_D = self.graph_cut.last_data_terms
+        self.num_frames += 1
+        self.frames_since_refresh += 1
+
+        fg_pixels, bg_pixels = self.confident_pixels(frame, mask, fg_D, bg_D)
+        self.fg_history.append(fg_pixels)
+        self.bg_history.append(bg_pixels)
+
+        statistic = self.drift_statistic(mask, fg_D, bg_D)
+        if self.reference_energy is None:
+            self.reference_energy = statistic
+            return False
+
+        drifted = statistic > self.reference_energy + self.drift_threshold * abs(self.reference_energy)
+        if not drifted or self.frames_since_refresh < self.cooldown:
+            return False
+
+        self.fg_model.partial_fit(np.concatenate(self.fg_history, axis=0))
+        self.bg_model.partial_fit(np.concatenate(self.bg_history, axis=0))
+        self.frames_since_refresh = 0
+        self.num_refreshes += 1
+        # the next frame is scored with the refreshed models and becomes the new reference
+        self.reference_energy = None
+        return True
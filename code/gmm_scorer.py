@@ -0,0 +1,95 @@
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from sklearn.mixture import GaussianMixture
+
+
+class GMMScorer:
+    """float32 log-likelihood of pixels under several fitted GMMs, evaluated in one fused pass.
+
+    Equivalent to calling gmm.score_samples(pixels) for each model, but all components of all
+    models are evaluated with a single matrix product against precomputed Cholesky factors of
+    the precisions, into buffers that are reused as long as the number of pixels stays the same.
+    Supports the "full", "tied", "diag" and "spherical" covariance types.
+    """
+
+    def __init__(self, gmms: list["GaussianMixture"]):
+        self.gmms = gmms
+        n_features = gmms[0].means_.shape[1]
+
+        prec_chols, offsets, consts = [], [], []
+        self.slices = []
+        start = 0
+        for gmm in gmms:
+            prec_chol = self.precision_cholesky(gmm)  # (K x d x d), triangular
+            log_det = np.sum(np.log(np.abs(np.diagonal(prec_chol, axis1=1, axis2=2))), axis=1)
+            prec_chols.append(prec_chol)
+            offsets.append(np.einsum("ki,kij->kj", gmm.means_, prec_chol))
+            consts.append(np.log(gmm.weights_) + log_det - 0.5 * n_features * np.log(2 * np.pi))
+            self.slices.append(slice(start, start + gmm.n_components))
+            start += gmm.n_components
+
+        self.n_features = n_features
+        self.n_components = start
+        # x @ projection gives (x @ P_k) for every component k side by side
+        self.projection = np.concatenate(
+            [np.transpose(p, (1, 0, 2)).reshape(n_features, -1) for p in prec_chols], axis=1
+        ).astype(np.float32)
+        self.offset = np.concatenate(offsets, axis=0).reshape(-1).astype(np.float32)
+        self.const = np.concatenate(consts).astype(np.float32)
+        self.buffers = None
+
+    @staticmethod
+    def precision_cholesky(gmm: "GaussianMixture") -> np.ndarray:
+        prec_chol = gmm.precisions_cholesky_
+        n_components, n_features = gmm.means_.shape
+        if gmm.covariance_type == "full":
+            return prec_chol
+        if gmm.covariance_type == "tied":
+            return np.repeat(prec_chol[None], n_components, axis=0)
+        if gmm.covariance_type == "diag":
+            return np.stack([np.diag(p) for p in prec_chol])
+        if gmm.covariance_type == "spherical":
+            return prec_chol[:, None, None] * np.eye(n_features)[None]
+        raise ValueError(f"Unknown covariance_type '{gmm.covariance_type}'")
+
+    def allocate(self, n_pixels: int):
+        if self.buffers is not None and self.buffers["x"].shape[0] == n_pixels:
+            return self.buffers
+        self.buffers = {
+            "x": np.empty((n_pixels, self.n_features), dtype=np.float32),
+            "projected": np.empty((n_pixels, self.n_components * self.n_features), dtype=np.float32),
+            "log_prob": np.empty((n_pixels, self.n_components), dtype=np.float32),
+            "max": np.empty((n_pixels, 1), dtype=np.float32),
+        }
+        return self.buffers
+
+    def score(self, pixels: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """Log-likelihood of (N x d) pixels under each model -> (n_models x N) float32."""
+        pixels = pixels.reshape(-1, self.n_features)
+        n_pixels = pixels.shape[0]
+        buffers = self.allocate(n_pixels)
+        if out is None:
+            out = np.empty((len(self.gmms), n_pixels), dtype=np.float32)
+
+        x, projected, log_prob, row_max = buffers["x"], buffers["projected"], buffers["log_prob"], buffers["max"]
+        x[...] = pixels
+        np.matmul(x, self.projection, out=projected)
+        projected -= self.offset
+        np.square(projected, out=projected)
+        np.sum(projected.reshape(n_pixels, self.n_components, self.n_features), axis=2, out=log_prob)
+        log_prob *= -0.5
+        log_prob += self.const
+
+        for i, components in enumerate(self.slices):
+            # log-sum-exp over the components of this model
+            part = log_prob[:, components]
+            np.max(part, axis=1, keepdims=True, out=row_max)
+            part -= row_max
+            np.exp(part, out=part)
+            np.sum(part, axis=1, out=out[i])
+            np.log(out[i], out=out[i])
+            out[i] += row_max[:, 0]
+        return out
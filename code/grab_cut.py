@@ -1,11 +1,9 @@
 import numpy as np
-from sklearn.mixture import GaussianMixture
 import networkx as nx
 import cv2
 
-
-import cProfile
-import pstats
+from code.gmm import fit_gmm
+from code.instrumentation import tracer
 
 
 class GrabCut:
@@ -109,9 +107,8 @@ class GrabCut:
         mask[self.t_b == 1] = 0
         return mask
 
-    def learn_GMM_parameters(self, pixels):
-        gmm = GaussianMixture(n_components=self.GMM_components)
-        gmm.fit(pixels)
+    def learn_GMM_parameters(self, pixels, previous=None):
+        gmm, _ = fit_gmm([pixels], self.GMM_components, previous=previous)
         return gmm
 
     def assign_GMM_components(self, pixels):
@@ -138,9 +135,9 @@ class GrabCut:
 
             # Step 2
             if len(bgd_pixels) > 0:
-                self.background_gmm = self.learn_GMM_parameters(bgd_pixels)
+                self.background_gmm = self.learn_GMM_parameters(bgd_pixels, previous=self.background_gmm)
             if len(fgd_pixels) > 0:
-                self.foreground_gmm = self.learn_GMM_parameters(fgd_pixels)
+                self.foreground_gmm = self.learn_GMM_parameters(fgd_pixels, previous=self.foreground_gmm)
 
             # Step 3
             print("Step 3 begin")
@@ -152,12 +149,8 @@ class GrabCut:
             break
 
     def segment(self):
-        profiler = cProfile.Profile()
-        profiler.enable()
-        self.iterate()
-        profiler.disable()
-        stats = pstats.Stats(profiler)
-        stats.strip_dirs().sort_stats("cumulative").print_stats(10)
+        with tracer.span("grabcut_iterate"):
+            self.iterate()
 
         output_image = self.image.copy()
         output_image = np.dstack(
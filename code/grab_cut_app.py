@@ -4,8 +4,8 @@ import cv2 as cv
 from typing import Literal
 import numpy as np
 
-from code.grab_cut import GrabCut
-from code.grab_cut_opencv import GrabCutOpenCV
+from code.brush import StrokeOverlay, paint_segment
+from code.engines import get_engine
 
 
 class GrabCutApp:
@@ -90,7 +90,9 @@ class GrabCutApp:
             "bg": np.zeros((self.height, self.width), dtype=np.uint8),
         }
         self.mode: Literal["fg", "bg"] = "fg"
-        self.brush_size: int = 1
+        self.brush_size: int = 1  # radius in pixels
+        self.last_point = None  # previous position of the brush in the current stroke
+        self.stroke_overlay = None
         self.color: Literal["red", "lime"] = "lime"
         self.grab_cut = None
 
@@ -105,10 +107,11 @@ class GrabCutApp:
             self.toggle_button.config(text="Background Brush")
 
     def update_mask(self, x, y):
-        x0, y0, x1, y1 = x - self.brush_size, y - self.brush_size, x + self.brush_size, y + self.brush_size
-        for i in range(max(0, y0), min(self.height, y1 + 1)):
-            for j in range(max(0, x0), min(self.width, x1 + 1)):
-                self.line_masks[self.mode][i][j] = 1
+        """Paint the stroke from the previous brush position to (x, y)."""
+        start = self.last_point or (x, y)
+        box = paint_segment(self.line_masks[self.mode], start, (x, y), self.brush_size)
+        self.last_point = (x, y)
+        self.stroke_overlay.refresh(box)
 
     def on_mouse_down(self, event):
         self.start_x = event.x
@@ -123,7 +126,9 @@ class GrabCutApp:
             # self.current_item = self.canvas_input.create_line(
             #     self.start_x, self.start_y, event.x, event.y, fill="black"
             # )
-            pass
+            self.last_point = None
+            if self.current_item:
+                self.update_mask(event.x, event.y)
 
     def on_mouse_drag(self, event):
         if self.current_item:
@@ -131,14 +136,6 @@ class GrabCutApp:
                 self.canvas_input.coords(self.current_item, self.start_x, self.start_y, event.x, event.y)
             elif self.current_phase == "user-edit":
                 # self.canvas_input.coords(self.current_item, self.start_x, self.start_y, event.x, event.y)
-                self.canvas_input.create_oval(
-                    event.x - self.brush_size,
-                    event.y - self.brush_size,
-                    event.x + self.brush_size,
-                    event.y + self.brush_size,
-                    fill=self.color,
-                    outline=self.color,
-                )
                 self.update_mask(event.x, event.y)
 
     def on_mouse_up(self, event):
@@ -149,7 +146,7 @@ class GrabCutApp:
                 print(self.canvas_input.coords(self.current_item))
             elif self.current_phase == "user-edit":
                 # self.line_masks[self.mode].append(self.canvas_input.coords(self.current_item))
-                pass
+                self.last_point = None
             # self.current_item = None
 
     def take_snapshot(self):
@@ -162,7 +159,6 @@ class GrabCutApp:
             # if self.canvas_image_id is not None:
             #     self.canvas.delete(self.canvas_image_id)
             # self.canvas_image_id = self.canvas.create_image(0, 0, anchor=tk.NW, image=photo)
-            self.canvas_input.create_image(0, 0, anchor=tk.NW, image=photo)
             # self.canvas.create_image(0, 0, image=photo)
 
             ## Reset
@@ -173,15 +169,19 @@ class GrabCutApp:
                 "fg": np.zeros((self.height, self.width), dtype=np.uint8),
                 "bg": np.zeros((self.height, self.width), dtype=np.uint8),
             }
+            # the snapshot and the strokes painted over it are one image item
+            if self.stroke_overlay:
+                self.canvas_input.delete(self.stroke_overlay.item)
+            self.stroke_overlay = StrokeOverlay(self.canvas_input, np_photo, self.line_masks)
             self.canvas_output.delete("all")
         else:
             print("Error. Failed to take snapshot from video.")
 
     def process_image(self):
         if self.current_phase == "draw-rect":
-            # self.grab_cut = GrabCut(self.canvas_image_np, self.rectangle)
+            # self.grab_cut = get_engine("grab_cut")(self.canvas_image_np, self.rectangle)
             # image_np, mask = self.grab_cut.segment()
-            self.grab_cut = GrabCutOpenCV(self.canvas_image_np)
+            self.grab_cut = get_engine("grab_cut_opencv")(self.canvas_image_np)
             image_np, mask = self.grab_cut.segment(rect=self.rectangle)
 
             photo = ImageTk.PhotoImage(Image.fromarray(image_np))
@@ -2,14 +2,46 @@ import numpy as np
 import cv2 as cv
 from typing import Optional
 
+from code.frame_buffers import compose_rgba
+from code.instrumentation import tracer
+
 
 class GrabCutOpenCV:
-    def __init__(self, image: np.ndarray):
+    """OpenCV's grabCut, interactively on a snapshot and as a video engine for code.propagation.
+
+    As a video engine the colour models learnt on the snapshot are frozen (GC_EVAL_FREEZE_MODEL),
+    so every frame costs one graph cut in C++ and no model fitting. In 3D mode the previous mask
+    seeds the frame: probable foreground / background within `band` pixels of its edge, definite
+    labels further away, and the cut only runs in the rectangle around that band. OpenCV's energy
+    has no temporal term, so the band is what keeps the result near the previous mask.
+    """
+
+    def __init__(self, image: np.ndarray, band: int = 12):
         self.image = image  # (h x w x c)
         self.height, self.width = image.shape[:2]
         self.bg_model = np.zeros((1, 65), np.float64)
         self.fg_model = np.zeros((1, 65), np.float64)
         self.mask = None
+        # in 3D mode only pixels within band of the previous mask's edge can change label
+        self.band = band
+        self.last_roi = None  # (x0, y0, x1, y1) of the last frame
+
+    @classmethod
+    def from_graph_cut(cls, graph_cut, mask: np.ndarray, iterations: int = 3, **kwargs) -> "GrabCutOpenCV":
+        """Engine with colour models learnt from a GraphCut snapshot and its segmentation."""
+        engine = cls(graph_cut.image, **kwargs)
+        engine.learn(mask, graph_cut.mask, iterations)
+        return engine
+
+    def learn(self, mask: np.ndarray, hard: Optional[np.ndarray] = None, iterations: int = 3):
+        """Fit the models to a binary mask of self.image; hard uses GraphCut's labels (1 = bg, 2 = fg)."""
+        self.mask = np.where(mask == 1, cv.GC_PR_FGD, cv.GC_PR_BGD).astype(np.uint8)
+        if hard is not None:
+            self.mask[hard == 1] = cv.GC_BGD
+            self.mask[hard == 2] = cv.GC_FGD
+        if not (self.mask % 2).any() or (self.mask % 2).all():
+            raise ValueError("the mask needs both foreground and background pixels")
+        cv.grabCut(self.image, self.mask, None, self.bg_model, self.fg_model, iterations, cv.GC_INIT_WITH_MASK)
 
     def segment(self, rect: Optional[list[int]] = None, lines: Optional[dict] = None):
         if rect:
@@ -31,19 +63,58 @@ class GrabCutOpenCV:
             img = self.image * mask2[:, :, np.newaxis]
             return img, mask2
 
-    def segment_frame_from_learnt_gmm(self, image: np.ndarray):
-        # mask = np.zeros(image.shape[:2], np.uint8)
-        # mask, _, _ = cv.grabCut(
-        #     image, mask, [0, 0, self.width, self.height], self.bg_model, self.fg_model, 5, cv.GC_EVAL_FREEZE_MODEL
-        # )
-        mask = self.mask.copy()
-        bg_model = np.zeros((1, 65), np.float64)
-        fg_model = np.zeros((1, 65), np.float64)
-        cv.grabCut(image, mask, None, bg_model, fg_model, 2, cv.GC_INIT_WITH_MASK)
-        # mask2 = np.where((self.mask == 2) | (self.mask == 0), 0, 1).astype("uint8")
-        mask2 = np.where((mask == 2) | (mask == 0), 0, 1).astype("uint8")
-
-        print(np.any(mask != 0))
-        img = cv.cvtColor(image, cv.COLOR_RGB2RGBA)
-        img[:, :, 3] = mask2 * 255
-        return img, mask2
+    def roi(self, prev_mask: np.ndarray) -> tuple[int, int, int, int]:
+        """Rectangle around the previous foreground plus the band -> (x0, y0, x1, y1); the whole frame if there is none."""
+        ys, xs = np.nonzero(prev_mask)
+        if len(ys) == 0:
+            return 0, 0, self.width, self.height
+        return (
+            max(int(xs.min()) - self.band, 0),
+            max(int(ys.min()) - self.band, 0),
+            min(int(xs.max()) + 1 + self.band, self.width),
+            min(int(ys.max()) + 1 + self.band, self.height),
+        )
+
+    def seed(self, prev_mask: np.ndarray) -> np.ndarray:
+        """grabCut labels from the previous mask: probable within band pixels of its edge, definite elsewhere.
+
+        An empty previous mask seeds probable background everywhere, as in 2D, so the object can be found again.
+        """
+        if not prev_mask.any():
+            return np.full(prev_mask.shape, cv.GC_PR_BGD, np.uint8)
+        kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (2 * self.band + 1, 2 * self.band + 1))
+        seed = np.where(prev_mask == 1, cv.GC_PR_FGD, cv.GC_PR_BGD).astype(np.uint8)
+        seed[cv.dilate(prev_mask, kernel) == 0] = cv.GC_BGD
+        seed[cv.erode(prev_mask, kernel) == 1] = cv.GC_FGD
+        return seed
+
+    def cut(self, frame: np.ndarray, seed: np.ndarray, roi: tuple[int, int, int, int]) -> np.ndarray:
+        """One frozen-model grabCut of the rectangle from grabCut labels -> binary mask of the frame."""
+        x0, y0, x1, y1 = roi
+        crop = np.ascontiguousarray(seed[y0:y1, x0:x1])
+        with tracer.span("grabcut"):
+            cv.grabCut(
+                np.ascontiguousarray(frame[y0:y1, x0:x1]), crop, None, self.bg_model, self.fg_model, 1, cv.GC_EVAL_FREEZE_MODEL
+            )
+        mask = np.zeros((self.height, self.width), np.uint8)
+        mask[y0:y1, x0:x1] = crop % 2  # GC_FGD and GC_PR_FGD are odd
+        self.last_roi = roi
+        return mask
+
+    def rgba(self, frame: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        with tracer.span("rgba"):
+            return compose_rgba(frame, mask)
+
+    def segment_frame_from_learnt_gmm_2d(self, frame: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        self.image = frame
+        seed = np.full((self.height, self.width), cv.GC_PR_BGD, np.uint8)
+        mask = self.cut(frame, seed, (0, 0, self.width, self.height))
+        return self.rgba(frame, mask), mask
+
+    def segment_frame_from_learnt_gmm_3d(
+        self, frame: np.ndarray, prev_mask: np.ndarray, energy_term_3d=None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """energy_term_3d is accepted for the engine interface; the temporal prior is the band."""
+        self.image = frame
+        mask = self.cut(frame, self.seed(prev_mask), self.roi(prev_mask))
+        return self.rgba(frame, mask), mask
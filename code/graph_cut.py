@@ -1,9 +1,17 @@
-import numpy as np
-import cv2 as cv
-from sklearn.mixture import GaussianMixture
-import maxflow
+import contextlib
 from typing import Optional
 
+import numpy as np
+
+from code.color_models import COLOR_MODELS, ColorHistogram, HistogramScorer, fit_histogram
+from code.gmm import fit_gmm
+from code.gmm_scorer import GMMScorer
+from code.capacity import CapacityEncoder
+from code.frame_buffers import FrameBuffers, compose_rgba
+from code.instrumentation import tracer
+from code.mrf_solver import MaxflowSolver, get_solver
+from code.superpixels import slic, superpixel_graph, refine_boundary
+
 
 class GraphCut:
     def __init__(
@@ -14,23 +22,59 @@ class GraphCut:
         data_term_scale: float = 1.0,
         smoothness_term_scale: float = 1.0,
         apply_explicit_mask: bool = False,
+        solver: str = "maxflow",
+        max_gmm_samples: int = 20000,
+        random_state: int = 0,
+        warm_start_gmms: Optional[tuple] = None,
+        covariance_type: str = "full",
+        superpixels: bool = False,
+        n_superpixels: int = 2000,
+        refine_band: int = 3,
+        capacity_mode: str = "float",
+        capacity_scale: float = 1000.0,
+        tile_size: int = 256,
+        tile_overlap: int = 32,
+        color_model: str = "gmm",
+        histogram_bins: int = 32,
     ):
         self.image = image  # (h x w x c)
         self.rect = rect
         self.line_masks = line_masks
         self.height, self.width = image.shape[:2]
 
+        if color_model not in COLOR_MODELS:
+            raise ValueError(f"Unknown color_model '{color_model}', choose from {list(COLOR_MODELS)}")
+        self.color_model = color_model
+        self.histogram_bins = histogram_bins
         self.n_components = 5
+        self.covariance_type = covariance_type
         self.mask = None
+        # fg / bg colour models: GaussianMixtures, or ColorHistograms with color_model="histogram"
         self.fg_gmm = None
         self.bg_gmm = None
+        self.max_gmm_samples = max_gmm_samples
+        self.random_state = random_state
+        self.gmm_stats = {}
+        self.last_data_terms = None  # (fg_D, bg_D) of the last segmented frame
+        self.scorer = None
+        self.scores = None  # (2 x h*w) float32 buffer for the fused fg / bg log-likelihoods
+        self.prepared = None  # (frame, data terms, smoothness terms, 2D mask) computed elsewhere, see use_prepared
+        self.buffers = None  # FrameBuffers while in frame_context()
 
         self.data_term_scale = data_term_scale
         self.smoothness_term_scale = smoothness_term_scale
         self.apply_explicit_mask = apply_explicit_mask
+        self.solver = solver
+        self.superpixels = superpixels
+        self.n_superpixels = n_superpixels
+        self.refine_band = refine_band  # pixel-level re-solve around the superpixel boundary (0 = off)
+        self.capacity = CapacityEncoder(capacity_mode, capacity_scale)
+        self.tile_size = tile_size  # used by the "maxflow-tiled" solver
+        self.tile_overlap = tile_overlap
+        self.solver_instance = None
 
         self.init_mask()
-        self.init_gmms()
+        self.init_gmms(warm_start_gmms)
 
     def init_mask(self):
         self.mask = np.zeros((self.height, self.width), dtype=np.uint8)
@@ -43,58 +87,227 @@ class GraphCut:
         # cv.imshow("initial mask", self.mask * 255)
         # cv.waitKey(0)
 
-    def init_gmms(self):
-        """Fit GMMs to the initial mask."""
-        bg_pixels = self.image[self.mask == 1].reshape(-1, 3)
-        fg_pixels = self.image[self.mask == 2].reshape(-1, 3)
-
-        # self.fg_gmm = GaussianMixture(n_components=self.n_components, covariance_type="full").fit(fg_pixels)
-        # self.bg_gmm = GaussianMixture(n_components=self.n_components, covariance_type="full").fit(bg_pixels)
-        self.fg_gmm = GaussianMixture(n_components=self.n_components).fit(fg_pixels)
-        self.bg_gmm = GaussianMixture(n_components=self.n_components).fit(bg_pixels)
+    def init_gmms(self, warm_start_gmms: Optional[tuple] = None):
+        """Fit GMMs to the initial mask. warm_start_gmms: (fg_gmm, bg_gmm) from a previous fit on this snapshot."""
+        bg_strokes = np.zeros((self.height, self.width), dtype=bool)
+        if self.line_masks:
+            bg_strokes = self.line_masks["bg"] == 1
+        # strokes and the outside of the rectangle are sampled as separate groups
+        bg_strata = [self.image[(self.mask == 1) & bg_strokes], self.image[(self.mask == 1) & ~bg_strokes]]
+        fg_strata = [self.image[self.mask == 2]]
+        if warm_start_gmms and isinstance(warm_start_gmms[0], ColorHistogram) != (self.color_model == "histogram"):
+            warm_start_gmms = None  # fitted with the other colour model
+        prev_fg, prev_bg = warm_start_gmms if warm_start_gmms else (None, None)
+
+        if self.color_model == "histogram":
+            # every labelled pixel is counted, so there is nothing to subsample
+            with tracer.span("histogram_fit"):
+                self.fg_gmm, self.gmm_stats["fg"] = fit_histogram(
+                    self.image, self.mask == 2, self.histogram_bins, previous=prev_fg, name="fg"
+                )
+                self.bg_gmm, self.gmm_stats["bg"] = fit_histogram(
+                    self.image, self.mask == 1, self.histogram_bins, previous=prev_bg, name="bg"
+                )
+            return
+
+        with tracer.span("gmm_fit"):
+            self.fg_gmm, self.gmm_stats["fg"] = fit_gmm(
+                fg_strata,
+                n_components=self.n_components,
+                covariance_type=self.covariance_type,
+                max_samples=self.max_gmm_samples,
+                random_state=self.random_state,
+                previous=prev_fg,
+                name="fg",
+            )
+            self.bg_gmm, self.gmm_stats["bg"] = fit_gmm(
+                bg_strata,
+                n_components=self.n_components,
+                covariance_type=self.covariance_type,
+                max_samples=self.max_gmm_samples,
+                random_state=self.random_state,
+                previous=prev_bg,
+                name="bg",
+            )
 
     def calculate_edge_weight(self, pixel1, pixel2, gamma=0.01):
-        return np.exp(-gamma * np.sum((pixel1 - pixel2) ** 2)) * self.smoothness_term_scale
-
-    # ========================2D segmentation========================
-    def build_graph_2d(self):
-        # g = maxflow.Graph[int](self.height * self.width, self.height * self.width * 4)
-        g = maxflow.Graph[float](self.height * self.width, self.height * self.width * 4)
-        node_ids = g.add_nodes(self.height * self.width)
-
-        fg_D = -self.fg_gmm.score_samples(self.image.reshape(-1, 3)) * self.data_term_scale
-        bg_D = -self.bg_gmm.score_samples(self.image.reshape(-1, 3)) * self.data_term_scale
+        diff = pixel1.astype(np.float64) - pixel2.astype(np.float64)
+        return np.exp(-gamma * np.sum(diff**2)) * self.smoothness_term_scale
+
+    # ========================Frame buffers========================
+    @contextlib.contextmanager
+    def frame_context(self):
+        """Reuse work buffers (and the max-flow graph) from frame to frame while segmenting a clip.
+
+            with graph_cut.frame_context():
+                for index, img, mask in propagate(graph_cut, frames, ...):
+                    ...
+
+        Inside, the RGBA image, the data terms and the smoothness terms a frame returns are
+        overwritten by the next frame; copy them to keep them. Masks are new arrays either way.
+        """
+        previous = self.buffers
+        self.buffers = previous or FrameBuffers()
+        try:
+            yield self.buffers
+        finally:
+            self.buffers = previous
+
+    def work_array(self, name: str, shape: tuple, dtype, fill: Optional[float] = None) -> np.ndarray:
+        """The frame context's buffer called name, or a new array outside a frame context."""
+        if self.buffers is not None:
+            return self.buffers.get(name, shape, dtype, fill)
+        return np.empty(shape, dtype) if fill is None else np.full(shape, fill, dtype)
+
+    def rgba(self, frame: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        with tracer.span("rgba"):
+            return compose_rgba(frame, mask, self.work_array("rgba", (*mask.shape, 4), np.uint8))
+
+    # ========================MRF terms========================
+    def use_prepared(self, frame, data_terms, smoothness_terms, mask_2d=None):
+        """Terms (and optionally the 2D mask) of frame computed by another worker (code.frame_transport).
+
+        They replace the computation while self.image is that very array; any other image is
+        computed as usual.
+        """
+        self.prepared = (frame, data_terms, smoothness_terms, mask_2d)
+
+    def get_prepared(self, part: int):
+        if self.prepared is not None and self.prepared[0] is self.image:
+            return self.prepared[part]
+        return None
+
+    def get_scorer(self):
+        # rebuild when the models were refitted or their parameters were replaced (online adaptation)
+        if self.color_model == "histogram":
+            params = (self.fg_gmm, self.bg_gmm, self.fg_gmm.table, self.bg_gmm.table)
+        else:
+            params = (self.fg_gmm, self.bg_gmm, self.fg_gmm.means_, self.bg_gmm.means_)
+        if self.scorer is None or any(a is not b for a, b in zip(params, self.scorer_params)):
+            scorer = HistogramScorer if self.color_model == "histogram" else GMMScorer
+            self.scorer = scorer([self.fg_gmm, self.bg_gmm])
+            self.scorer_params = params
+        return self.scorer
+
+    def compute_data_terms(self) -> tuple[np.ndarray, np.ndarray]:
+        """Negative log-likelihood of every pixel under the fg / bg GMMs, each (h x w) float32."""
+        prepared = self.get_prepared(1)
+        if prepared is not None:
+            self.last_data_terms = prepared
+            return prepared
+        with tracer.span("data_term"):
+            pixels = self.image.reshape(-1, 3)
+            if self.scores is None or self.scores.shape[1] != len(pixels):
+                self.scores = np.empty((2, len(pixels)), dtype=np.float32)
+            self.get_scorer().score(pixels, out=self.scores)
+            shape = (self.height, self.width)
+            fg_D, bg_D = (
+                np.multiply(scores.reshape(shape), -self.data_term_scale, out=self.work_array(name, shape, np.float32))
+                for scores, name in zip(self.scores, ("fg_D", "bg_D"))
+            )
+        self.last_data_terms = (fg_D, bg_D)
+        return fg_D, bg_D
+
+    def compute_smoothness_terms(self, gamma=0.01) -> tuple[np.ndarray, np.ndarray]:
+        """Edge weights to the right and lower neighbour of every pixel (see code/mrf_solver.py)."""
+        prepared = self.get_prepared(2)
+        if prepared is not None and gamma == 0.01:
+            return prepared
+        with tracer.span("smoothness_term"):
+            shape, image = (self.height, self.width), self.image
+            # float32 throughout: the capacities are float32 anyway
+            diff = self.work_array("pixel_diff", (*shape, 3), np.float32)
+            horizontal = self.work_array("horizontal", shape, np.float32, fill=0)
+            vertical = self.work_array("vertical", shape, np.float32, fill=0)
+            for weights, first, second, d in (
+                (horizontal[:, :-1], image[:, :-1], image[:, 1:], diff[:, :-1]),
+                (vertical[:-1, :], image[:-1, :], image[1:, :], diff[:-1, :]),
+            ):
+                np.subtract(first, second, out=d, dtype=np.float32)
+                np.square(d, out=d)
+                np.sum(d, axis=2, out=weights)
+                weights *= -gamma
+                np.exp(weights, out=weights)
+            horizontal *= self.smoothness_term_scale
+            vertical *= self.smoothness_term_scale
+        return horizontal, vertical
+
+    def unary_2d(self) -> np.ndarray:
+        fg_D, bg_D = self.compute_data_terms()
         # fg_D = np.where(fg_D < 0, 0, fg_D)
         # bg_D = np.where(bg_D < 0, 0, bg_D)
+        return np.stack([bg_D, fg_D], axis=-1, out=self.work_array("unary", (self.height, self.width, 2), np.float32))
+
+    def unary_3d(self, prev_mask, energy_term_3d) -> np.ndarray:
+        unary = self.unary_2d()
+        # penalise disagreeing with the previous frame's label
+        disagrees = self.work_array("disagrees", prev_mask.shape, bool)
+        np.not_equal(prev_mask, 0, out=disagrees)
+        np.add(unary[:, :, 0], energy_term_3d, out=unary[:, :, 0], where=disagrees)
+        np.not_equal(prev_mask, 1, out=disagrees)
+        np.add(unary[:, :, 1], energy_term_3d, out=unary[:, :, 1], where=disagrees)
+        return unary
+
+    def get_mrf_solver(self):
+        # kept between frames so e.g. the tiled solver's process pool is reused, and replaced
+        # (closing the old one) when any of its settings changes
+        key, kwargs = (self.solver,), {}
+        if self.solver == "maxflow-tiled":
+            key += (self.tile_size, self.tile_overlap, self.capacity.mode, self.capacity.scale)
+            kwargs = {"tile_size": self.tile_size, "overlap": self.tile_overlap, "capacity": self.capacity}
+        if self.solver_instance is None or self.solver_instance[0] != key:
+            self.close()
+            self.solver_instance = (key, get_solver(self.solver, **kwargs))
+        return self.solver_instance[1]
+
+    def close(self):
+        """Release what the solver holds (the tiled solver's process pool); the next frame starts anew."""
+        if self.solver_instance is not None:
+            close = getattr(self.solver_instance[1], "close", None)
+            if close:
+                close()
+            self.solver_instance = None
+
+    def solve(self, unary, pairwise) -> np.ndarray:
+        with tracer.span("solve"):
+            return self.get_mrf_solver().solve(unary, pairwise)
+
+    def segment_superpixels(self, unary) -> np.ndarray:
+        """Max-flow over SLIC superpixels instead of pixels, optionally refined in a boundary band.
+
+        Superpixel unaries are sums of the pixel unaries, so in 3D mode each superpixel is tied to
+        the previous mask in proportion to how much of it overlapped the previous foreground.
+        """
+        labels = slic(self.image, self.n_superpixels)
+        n = int(labels.max()) + 1
+        flat = labels.ravel()
+        sp_unary = np.stack(
+            [np.bincount(flat, weights=unary[:, :, k].ravel(), minlength=n) for k in range(2)], axis=1
+        )
+        edges, weights = superpixel_graph(self.image, labels)
+        solver = MaxflowSolver(self.capacity)
+        sp_labels = solver.solve_graph(sp_unary, edges, weights * self.smoothness_term_scale)
+        mask = sp_labels[labels].astype(np.uint8)
+
+        if self.refine_band > 0:
+            mask = refine_boundary(mask, unary, self.compute_smoothness_terms(), self.refine_band, solver)
+        return mask
 
-        cnt = 0
-        for y in range(self.height):
-            for x in range(self.width):
-                index = y * self.width + x
-
-                g.add_tedge(node_ids[index], bg_D[index], fg_D[index])
-
-                if x < self.width - 1:
-                    weight = self.calculate_edge_weight(self.image[y, x], self.image[y, x + 1])
-                    g.add_edge(node_ids[index], node_ids[index + 1], weight, weight)
-                    # g.add_edge(node_ids[index], node_ids[index + 1], 1, 1)
-                if y < self.height - 1:
-                    weight = self.calculate_edge_weight(self.image[y, x], self.image[y + 1, x])
-                    g.add_edge(node_ids[index], node_ids[index + self.width], weight, weight)
-                    # g.add_edge(node_ids[index], node_ids[index + self.width], 1, 1)
-
-        return g, node_ids
+    # ========================2D segmentation========================
+    def build_graph_2d(self):
+        return MaxflowSolver(self.capacity).build_graph(self.unary_2d(), self.compute_smoothness_terms(), self.buffers)
 
     def segment_2d(self):
-        g, node_ids = self.build_graph_2d()
-        g.maxflow()
-        segmentation = np.zeros((self.height, self.width), dtype=np.uint8)
-
-        for y in range(self.height):
-            for x in range(self.width):
-                index = y * self.width + x
-                if g.get_segment(node_ids[index]) == 0:
-                    segmentation[y, x] = 1
+        if self.get_prepared(3) is not None:
+            segmentation = self.get_prepared(3).copy()
+        elif self.superpixels:
+            segmentation = self.segment_superpixels(self.unary_2d())
+        elif self.solver == "maxflow":
+            g, node_ids = self.build_graph_2d()
+            MaxflowSolver.cut(g)
+            segmentation = MaxflowSolver.read_labels(g, node_ids)
+        else:
+            segmentation = self.solve(self.unary_2d(), self.compute_smoothness_terms())
 
         if self.apply_explicit_mask:
             segmentation[self.mask == 1] = 0
@@ -104,51 +317,22 @@ class GraphCut:
     def segment_frame_from_learnt_gmm_2d(self, frame: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
         self.image = frame
         mask = self.segment_2d()
-
-        img = cv.cvtColor(frame, cv.COLOR_RGB2RGBA)
-        img[:, :, 3] = mask * 255
-        return img, mask
+        return self.rgba(frame, mask), mask
 
     # ========================3D segmentation========================
     def build_graph_3d(self, prev_mask, energy_term_3d):
-        g = maxflow.Graph[int](self.height * self.width, self.height * self.width * 4)
-        # g = maxflow.Graph[float](self.height * self.width, self.height * self.width * 4)
-        node_ids = g.add_nodes(self.height * self.width)
-
-        fg_D = -self.fg_gmm.score_samples(self.image.reshape(-1, 3)) * self.data_term_scale
-        bg_D = -self.bg_gmm.score_samples(self.image.reshape(-1, 3)) * self.data_term_scale
-
-        for y in range(self.height):
-            for x in range(self.width):
-                index = y * self.width + x
-
-                prev_bg_term = 0 if prev_mask[y, x] == 0 else energy_term_3d
-                prev_fg_term = 0 if prev_mask[y, x] == 1 else energy_term_3d
-                g.add_tedge(node_ids[index], bg_D[index] + prev_bg_term, fg_D[index] + prev_fg_term)
-
-                if x < self.width - 1:
-                    weight = self.calculate_edge_weight(self.image[y, x], self.image[y, x + 1])
-                    g.add_edge(node_ids[index], node_ids[index + 1], weight, weight)
-                    # g.add_edge(node_ids[index], node_ids[index + 1], 1, 1)
-                if y < self.height - 1:
-                    weight = self.calculate_edge_weight(self.image[y, x], self.image[y + 1, x])
-                    g.add_edge(node_ids[index], node_ids[index + self.width], weight, weight)
-                    # g.add_edge(node_ids[index], node_ids[index + self.width], 1, 1)
-
-        return g, node_ids
+        return MaxflowSolver(self.capacity).build_graph(
+            self.unary_3d(prev_mask, energy_term_3d), self.compute_smoothness_terms(), self.buffers
+        )
 
     def segment_3d(self, prev_mask, energy_term_3d):
-        g, node_ids = self.build_graph_3d(prev_mask, energy_term_3d)
-        g.maxflow()
-        segmentation = np.zeros((self.height, self.width), dtype=np.uint8)
-
-        for y in range(self.height):
-            for x in range(self.width):
-                index = y * self.width + x
-                if g.get_segment(node_ids[index]) == 0:
-                    segmentation[y, x] = 1
-
-        return segmentation
+        if self.superpixels:
+            return self.segment_superpixels(self.unary_3d(prev_mask, energy_term_3d))
+        if self.solver == "maxflow":
+            g, node_ids = self.build_graph_3d(prev_mask, energy_term_3d)
+            MaxflowSolver.cut(g)
+            return MaxflowSolver.read_labels(g, node_ids)
+        return self.solve(self.unary_3d(prev_mask, energy_term_3d), self.compute_smoothness_terms())
 
     def segment_frame_from_learnt_gmm_3d(
         self, frame: np.ndarray, prev_mask: np.ndarray, energy_term_3d
@@ -156,7 +340,4 @@ class GraphCut:
 
         self.image = frame
         mask = self.segment_3d(prev_mask, energy_term_3d)
-
-        img = cv.cvtColor(frame, cv.COLOR_RGB2RGBA)
-        img[:, :, 3] = mask * 255
-        return img, mask
+        return self.rgba(frame, mask), mask
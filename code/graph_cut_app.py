@@ -4,10 +4,10 @@ import cv2 as cv
 from typing import Literal
 import numpy as np
 
-from code.grab_cut import GrabCut
-from code.grab_cut_opencv import GrabCutOpenCV
-from code.simulated_annealing import SimulatedAnnealing
-from code.graph_cut import GraphCut
+from code.brush import StrokeOverlay, paint_segment
+from code.color_models import COLOR_MODELS
+from code.engines import get_engine
+from code.mrf_solver import SOLVERS
 
 
 class GraphCutApp:
@@ -85,6 +85,37 @@ class GraphCutApp:
             state=tk.NORMAL,
         )
         self.toggle_apply_explicit_mask.grid(row=0, column=6)
+
+        # MRF solver
+        solver_frame = tk.Frame(button_frame)
+        solver_frame.grid(row=0, column=7)
+        self.solver_var = tk.StringVar(value="maxflow")
+        solver_menu = tk.OptionMenu(solver_frame, self.solver_var, *SOLVERS, command=self.on_solver_change)
+        solver_menu.pack()
+        solver_label = tk.Label(solver_frame, text="Solver")
+        solver_label.pack(side=tk.BOTTOM)
+
+        self.superpixels_var = tk.BooleanVar(value=False)
+        self.toggle_superpixels = tk.Checkbutton(
+            button_frame, text="Superpixels", variable=self.superpixels_var, command=self.on_superpixels_change
+        )
+        self.toggle_superpixels.grid(row=0, column=8)
+
+        # Brush radius
+        brush_frame = tk.Frame(button_frame)
+        brush_frame.grid(row=0, column=9)
+        self.brush_scale = tk.Scale(brush_frame, from_=1, to=20, orient="horizontal", command=self.on_brush_change)
+        self.brush_scale.set(2)
+        self.brush_scale.pack()
+        brush_label = tk.Label(brush_frame, text="Brush Radius")
+        brush_label.pack(side=tk.BOTTOM)
+
+        # Colour model: GMMs, or histograms that fit and score much faster
+        color_model_frame = tk.Frame(button_frame)
+        color_model_frame.grid(row=0, column=10)
+        self.color_model_var = tk.StringVar(value="gmm")
+        tk.OptionMenu(color_model_frame, self.color_model_var, *COLOR_MODELS).pack()
+        tk.Label(color_model_frame, text="Colour model").pack(side=tk.BOTTOM)
         # ==================================================
 
         # ===================== CANVAS =====================
@@ -140,9 +171,16 @@ class GraphCutApp:
             "bg": np.zeros((self.height, self.width), dtype=np.uint8),
         }
         self.mode: Literal["fg", "bg"] = "fg"
-        self.brush_size: int = 2
+        self.brush_size: int = 2  # radius in pixels
+        self.last_point = None  # previous position of the brush in the current stroke
+        self.stroke_overlay = None
         self.color: Literal["red", "lime"] = "lime"
         self.graph_cut = None
+        self.warm_start_gmms = None  # (fg_gmm, bg_gmm) of the last fit on the current snapshot
+
+    def close(self):
+        if self.graph_cut:
+            self.graph_cut.close()
 
     def on_smoothness_slider_change(self, value):
         if self.graph_cut:
@@ -152,6 +190,17 @@ class GraphCutApp:
         if self.graph_cut:
             self.graph_cut.data_term_scale = float(value)
 
+    def on_solver_change(self, value):
+        if self.graph_cut:
+            self.graph_cut.solver = value
+
+    def on_brush_change(self, value):
+        self.brush_size = int(value)
+
+    def on_superpixels_change(self):
+        if self.graph_cut:
+            self.graph_cut.superpixels = self.superpixels_var.get()
+
     def toggle_draw_mode(self):
         if self.draw_mode_var.get():
             self.draw_mode = "lines"
@@ -183,10 +232,11 @@ class GraphCutApp:
             self.toggle_button_fg_bg_brush.config(text="Background Brush")
 
     def update_mask(self, x, y):
-        x0, y0, x1, y1 = x - self.brush_size, y - self.brush_size, x + self.brush_size, y + self.brush_size
-        for i in range(max(0, y0), min(self.height, y1 + 1)):
-            for j in range(max(0, x0), min(self.width, x1 + 1)):
-                self.line_masks[self.mode][i][j] = 1
+        """Paint the stroke from the previous brush position to (x, y)."""
+        start = self.last_point or (x, y)
+        box = paint_segment(self.line_masks[self.mode], start, (x, y), self.brush_size)
+        self.last_point = (x, y)
+        self.stroke_overlay.refresh(box)
 
     def on_mouse_down(self, event):
         self.start_x = event.x
@@ -199,39 +249,28 @@ class GraphCutApp:
             self.current_item = self.canvas_input.create_rectangle(
                 self.start_x, self.start_y, event.x, event.y, outline="cyan"
             )
-        elif self.draw_mode == "lines":
-            self.current_item = self.canvas_input.create_rectangle(
-                self.start_x, self.start_y, event.x, event.y, outline="black"
-            )
-            pass
+        elif self.draw_mode == "lines" and self.stroke_overlay:
+            self.last_point = None
+            self.update_mask(event.x, event.y)
 
     def on_mouse_drag(self, event):
-        if self.current_item:
-            if self.current_phase != "draw":
-                return
-            if self.draw_mode == "rectangle":
-                self.canvas_input.coords(self.current_item, self.start_x, self.start_y, event.x, event.y)
-            elif self.draw_mode == "lines":
-                self.canvas_input.create_oval(
-                    event.x - self.brush_size,
-                    event.y - self.brush_size,
-                    event.x + self.brush_size,
-                    event.y + self.brush_size,
-                    fill=self.color,
-                    outline=self.color,
-                )
-                self.update_mask(event.x, event.y)
+        if self.current_phase != "draw":
+            return
+        if self.draw_mode == "rectangle" and self.current_item:
+            self.canvas_input.coords(self.current_item, self.start_x, self.start_y, event.x, event.y)
+        elif self.draw_mode == "lines" and self.last_point:
+            self.update_mask(event.x, event.y)
 
     def on_mouse_up(self, event):
-        if self.current_item:
-            if self.current_phase != "draw":
-                return
-            if self.draw_mode == "rectangle":
-                self.rectangle = [int(val) for val in self.canvas_input.coords(self.current_item)]
-                # self.current_phase = "process-image"
-                print(self.canvas_input.coords(self.current_item))
-            elif self.draw_mode == "lines":
-                self.process_button.config(state=tk.NORMAL)
+        if self.current_phase != "draw":
+            return
+        if self.draw_mode == "rectangle" and self.current_item:
+            self.rectangle = [int(val) for val in self.canvas_input.coords(self.current_item)]
+            # self.current_phase = "process-image"
+            print(self.canvas_input.coords(self.current_item))
+        elif self.draw_mode == "lines" and self.last_point:
+            self.last_point = None
+            self.process_button.config(state=tk.NORMAL)
 
     def take_snapshot(self):
         photo, np_photo = self.video_player.capture_current_frame()
@@ -243,7 +282,6 @@ class GraphCutApp:
             # if self.canvas_image_id is not None:
             #     self.canvas.delete(self.canvas_image_id)
             # self.canvas_image_id = self.canvas.create_image(0, 0, anchor=tk.NW, image=photo)
-            self.canvas_input.create_image(0, 0, anchor=tk.NW, image=photo)
             # self.canvas.create_image(0, 0, image=photo)
 
             ## Reset
@@ -253,7 +291,12 @@ class GraphCutApp:
                 "fg": np.zeros((self.height, self.width), dtype=np.uint8),
                 "bg": np.zeros((self.height, self.width), dtype=np.uint8),
             }
+            # the snapshot and the strokes painted over it are one image item
+            if self.stroke_overlay:
+                self.canvas_input.delete(self.stroke_overlay.item)
+            self.stroke_overlay = StrokeOverlay(self.canvas_input, np_photo, self.line_masks)
             self.canvas_output.delete("all")
+            self.warm_start_gmms = None
         else:
             print("Error. Failed to take snapshot from video.")
 
@@ -274,14 +317,22 @@ class GraphCutApp:
         #         data_term_scale=self.data_scale.get(),
         #         smoothness_term_scale=self.smoothness_scale.get(),
         #     )
-        self.graph_cut = GraphCut(
+        if self.graph_cut:
+            # a keyframe may still use the old model, closing only stops its solver's pool
+            self.graph_cut.close()
+        self.graph_cut = get_engine("graph_cut")(
             self.canvas_image_np,
             rect=self.rectangle,
             line_masks=self.line_masks,
             data_term_scale=self.data_scale.get(),
             smoothness_term_scale=self.smoothness_scale.get(),
             apply_explicit_mask=self.apply_explicit_mask_var.get(),
+            solver=self.solver_var.get(),
+            warm_start_gmms=self.warm_start_gmms,
+            superpixels=self.superpixels_var.get(),
+            color_model=self.color_model_var.get(),
         )
+        self.warm_start_gmms = (self.graph_cut.fg_gmm, self.graph_cut.bg_gmm)
         self.mask = self.graph_cut.segment_2d()
         self.graph_cut.apply_explicit_mask = False
 
@@ -291,9 +342,9 @@ class GraphCutApp:
         self.canvas_output_image = photo
         self.canvas_output.create_image(0, 0, anchor=tk.NW, image=photo)
 
-        # self.grab_cut = GrabCut(self.canvas_image_np, self.rectangle)
+        # self.grab_cut = get_engine("grab_cut")(self.canvas_image_np, self.rectangle)
         # image_np, mask = self.grab_cut.segment()
-        # self.grab_cut = GrabCutOpenCV(self.canvas_image_np)
+        # self.grab_cut = get_engine("grab_cut_opencv")(self.canvas_image_np)
         # image_np, mask = self.grab_cut.segment(rect=self.rectangle)
 
         # photo = ImageTk.PhotoImage(Image.fromarray(image_np))
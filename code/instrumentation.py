@@ -0,0 +1,204 @@
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB (0 where the platform does not report it)."""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb() -> float:
+    """Current resident set size in MB; the peak where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return peak_rss_mb()
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer._record(self.name, self.start, time.perf_counter_ns() - self.start, self.args)
+        return False
+
+
+class Tracer:
+    """Span timers, counters and peak RSS for the segmentation pipeline.
+
+        with tracer.span("maxflow"):
+            g.maxflow()
+        tracer.count("frames_skipped")
+
+    Disabled by default: span() then returns a shared no-op context manager and count() returns
+    immediately, so the instrumented code pays one attribute lookup per call.
+    When enabled, events are kept in memory and can be written as JSONL (one event per line) or
+    as a Chrome trace (chrome://tracing, Perfetto). Spans inside `with tracer.frame(i):` are also
+    summed per frame and handed to the frame listeners, e.g. for a live breakdown in the GUI.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.frame_listeners = []
+        self.reset()
+
+    def reset(self):
+        self.events = []
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter_ns()
+        self.current_frame = None
+        self.frame_breakdown = {}
+
+    def enable(self):
+        self.reset()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name: str, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def count(self, name: str, value: float = 1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            self.events.append(
+                {"type": "counter", "name": name, "ts": self._now_us(), "value": self.counters[name], "pid": os.getpid()}
+            )
+
+    def gauge(self, name: str, value: float):
+        """Like count(), but the counter is set to value (e.g. the flow of the last cut)."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = value
+            self.events.append({"type": "counter", "name": name, "ts": self._now_us(), "value": value, "pid": os.getpid()})
+
+    def frame(self, index: int):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Frame(self, index)
+
+    def _now_us(self) -> float:
+        return (time.perf_counter_ns() - self.origin) / 1000
+
+    def _record(self, name, start_ns, duration_ns, args):
+        event = {
+            "type": "span",
+            "name": name,
+            "ts": (start_ns - self.origin) / 1000,
+            "dur": duration_ns / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "frame": self.current_frame,
+            "args": args,
+        }
+        with self.lock:
+            self.events.append(event)
+            if self.current_frame is not None:
+                self.frame_breakdown[name] = self.frame_breakdown.get(name, 0) + duration_ns / 1e6
+
+    def summary(self) -> dict:
+        """Total ms and call count per span name, the counters and the peak RSS."""
+        spans = {}
+        for event in self.events:
+            if event["type"] == "span":
+                total = spans.setdefault(event["name"], {"total_ms": 0.0, "calls": 0})
+                total["total_ms"] += event["dur"] / 1000
+                total["calls"] += 1
+        return {"spans": spans, "counters": dict(self.counters), "peak_rss_mb": peak_rss_mb()}
+
+    def export_jsonl(self, path: str):
+        with open(path, "w") as f:
+            for event in self.events:
+                f.write(json.dumps(event) + "\n")
+            f.write(json.dumps({"type": "summary", **self.summary()}) + "\n")
+
+    def export_chrome_trace(self, path: str):
+        trace = []
+        for event in self.events:
+            if event["type"] == "span":
+                args = dict(event["args"], frame=event["frame"]) if event["frame"] is not None else event["args"]
+                trace.append(
+                    {
+                        "name": event["name"],
+                        "ph": "X",
+                        "ts": event["ts"],
+                        "dur": event["dur"],
+                        "pid": event["pid"],
+                        "tid": event["tid"],
+                        "args": args,
+                    }
+                )
+            else:
+                trace.append(
+                    {"name": event["name"], "ph": "C", "ts": event["ts"], "pid": event["pid"], "args": {"value": event["value"]}}
+                )
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms", "otherData": self.summary()}, f)
+
+
+class _Frame:
+    def __init__(self, tracer: Tracer, index: int):
+        self.tracer = tracer
+        self.index = index
+        self.span = _Span(tracer, "frame", {"index": index})
+
+    def __enter__(self):
+        self.tracer.current_frame = self.index
+        self.tracer.frame_breakdown = {}
+        self.span.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.current_frame = None
+        self.span.__exit__(*exc)
+        breakdown = self.tracer.frame_breakdown
+        breakdown["total"] = (time.perf_counter_ns() - self.span.start) / 1e6
+        self.tracer.frame_breakdown = {}
+        for listener in self.tracer.frame_listeners:
+            listener(self.index, breakdown)
+        return False
+
+
+# the pipeline reports to this one tracer
+tracer = Tracer()
@@ -0,0 +1,277 @@
+"""Segmentation jobs as run by the job service (code.service), one per worker process call.
+
+A job is a JSON object:
+
+    {
+      "video": "mp4/beaver.mp4",          # path on the service's machine
+      "frame": 0,                          # annotated frame
+      "annotation": {...},                 # rect and strokes, see code.annotation
+      "params": {"mode": "3d", "format": "webp", ...},
+      "limits": {"max_frames": 300, ...},
+      "priority": 0,                       # higher runs first
+      "output": "beaver.webp"              # optional file name in the service's output directory
+    }
+
+Missing params and limits take the defaults below; limits are capped by the service's own.
+The export is written under a temporary name and renamed to the output path once it is complete,
+so a failed or cancelled job leaves no partial file and never removes one it did not write.
+"""
+
+import collections
+import copy
+import hashlib
+import json
+import os
+import time
+
+from code.annotation import rasterise_annotation
+from code.engines import VIDEO_ENGINES, video_engine
+from code.exporters import EXPORTERS, get_exporter
+from code.instrumentation import current_rss_mb
+from code.mrf_solver import SOLVERS
+
+DEFAULT_PARAMS = {
+    "width": 426,
+    "height": 240,
+    "mode": "3d",  # or "2d"
+    "energy_term_3d": 3.0,
+    "solver": "maxflow",
+    "engine": "graph_cut",  # or "grab_cut_opencv", see code.engines
+    "format": "webp",
+    "quality": 80,
+    "lossless": False,
+    "fps": 0,  # output frame rate, 0 keeps the source rate
+    "frames": 0,  # output frames, 0 runs to the end of the video
+    "solve_every": 1,  # flow-warp the frames between solves; experimental, costs accuracy
+    "skip_static_frames": False,  # reuse masks of near-duplicate frames; an approximation, opt in
+    "feather_radius": 0,
+}
+DEFAULT_LIMITS = {
+    "max_frames": 1000,
+    "max_seconds": 600,
+    "max_pixels": 1280 * 720,  # working resolution
+    "max_memory_mb": 2048,  # resident size of the worker process
+}
+# fitted models kept per worker process, keyed by everything the fit depends on
+MODEL_CACHE_SIZE = 8
+
+
+class JobLimitExceeded(RuntimeError):
+    pass
+
+
+class JobCancelled(RuntimeError):
+    pass
+
+
+def validate_job(spec: dict, max_limits: dict = None) -> dict:
+    """Checked job with defaults filled in; raises ValueError with a message for the client."""
+    if not isinstance(spec, dict):
+        raise ValueError("job must be a JSON object")
+    unknown = set(spec) - {"video", "frame", "annotation", "params", "limits", "priority", "output"}
+    if unknown:
+        raise ValueError(f"unknown job fields {sorted(unknown)}")
+    video = spec.get("video")
+    if not isinstance(video, str) or not os.path.isfile(video):
+        raise ValueError(f"video '{video}' does not exist")
+    annotation = spec.get("annotation")
+    if not isinstance(annotation, dict) or not {"width", "height", "rect"} <= set(annotation):
+        raise ValueError("annotation needs width, height and rect")
+
+    params = {**DEFAULT_PARAMS, **spec.get("params", {})}
+    unknown = set(params) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError(f"unknown params {sorted(unknown)}")
+    if params["mode"] not in ("2d", "3d"):
+        raise ValueError("mode must be 2d or 3d")
+    if params["solver"] not in SOLVERS:
+        raise ValueError(f"solver must be one of {sorted(SOLVERS)}")
+    if params["engine"] not in VIDEO_ENGINES:
+        raise ValueError(f"engine must be one of {list(VIDEO_ENGINES)}")
+    if params["format"] not in EXPORTERS:
+        raise ValueError(f"format must be one of {sorted(EXPORTERS)}")
+
+    max_limits = max_limits or DEFAULT_LIMITS
+    limits = {**max_limits, **spec.get("limits", {})}
+    if set(limits) != set(max_limits):
+        raise ValueError(f"unknown limits {sorted(set(limits) - set(max_limits))}")
+    # a job may ask for less than the service allows, never more
+    limits = {key: min(value, max_limits[key]) for key, value in limits.items()}
+    if params["width"] * params["height"] > limits["max_pixels"]:
+        raise ValueError(f"{params['width']}x{params['height']} is over the limit of {limits['max_pixels']} pixels")
+
+    return {
+        "video": video,
+        "frame": int(spec.get("frame", 0)),
+        "annotation": annotation,
+        "params": params,
+        "limits": limits,
+        "priority": int(spec.get("priority", 0)),
+        "output": spec.get("output"),
+    }
+
+
+# ---------------------------------------------------------------- worker process side
+
+_progress = None  # queue of (job id, event) read by the service
+_cancelled = None  # shared dict, job id -> True once cancelled
+_models = collections.OrderedDict()
+
+
+def init_worker(progress, cancelled):
+    """Pool initializer: keep the queues and load the heavy dependencies before the first job."""
+    global _progress, _cancelled
+    _progress, _cancelled = progress, cancelled
+    import maxflow  # noqa: F401
+    import sklearn.mixture  # noqa: F401
+
+    from code.graph_cut import GraphCut  # noqa: F401
+
+
+def warm_up(barrier) -> int:
+    # submitted once per worker when the service starts, so no job pays for the process start;
+    # the barrier keeps one process from taking every call
+    barrier.wait(timeout=120)
+    return os.getpid()
+
+
+def report(job_id: str, event: dict):
+    if _progress is not None:
+        _progress.put((job_id, {"time": time.time(), **event}))
+
+
+def model_key(job: dict) -> str:
+    """Everything the fitted colour models and the first mask depend on."""
+    params = job["params"]
+    stat = os.stat(job["video"])
+    key = [
+        os.path.abspath(job["video"]),
+        stat.st_mtime,
+        stat.st_size,
+        job["frame"],
+        job["annotation"],
+        params["width"],
+        params["height"],
+        params["solver"],
+    ]
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def fitted_model(job: dict):
+    """(GraphCut, mask of the annotated frame, cache hit) for a job, fitting the models on a miss."""
+    from code.graph_cut import GraphCut
+    from code.video_io import read_frames
+
+    key = model_key(job)
+    if key in _models:
+        _models.move_to_end(key)
+        graph_cut, mask = _models[key]
+        # propagation changes the current image and adapts models, jobs work on a copy
+        return copy.deepcopy(graph_cut), mask, True
+
+    params = job["params"]
+    decoded = list(read_frames(job["video"], params["width"], params["height"], job["frame"], job["frame"] + 1))
+    if not decoded:
+        raise ValueError(f"frame {job['frame']} is past the end of the video")
+    annotation = rasterise_annotation(job["annotation"], params["width"], params["height"])
+    graph_cut = GraphCut(decoded[0][1], solver=params["solver"], **annotation)
+    mask = graph_cut.segment_2d()
+    _models[key] = (copy.deepcopy(graph_cut), mask)
+    while len(_models) > MODEL_CACHE_SIZE:
+        _models.popitem(last=False)
+    return graph_cut, mask, False
+
+
+def check_limits(job_id: str, limits: dict, frames: int, start: float):
+    if _cancelled is not None and _cancelled.get(job_id):
+        raise JobCancelled("cancelled")
+    if frames > limits["max_frames"]:
+        raise JobLimitExceeded(f"more than {limits['max_frames']} frames")
+    if time.perf_counter() - start > limits["max_seconds"]:
+        raise JobLimitExceeded(f"ran longer than {limits['max_seconds']} s")
+    if current_rss_mb() > limits["max_memory_mb"]:
+        raise JobLimitExceeded(f"worker memory above {limits['max_memory_mb']} MB")
+
+
+def run_job(job_id: str, job: dict) -> dict:
+    """Segment and export one job in this worker process -> result summary. Progress goes to the queue."""
+    import cv2 as cv
+
+    from code.frame_analysis import FrameChangeDetector
+    from code.mask_interpolation import MaskInterpolator
+    from code.matting import EdgeFeathering
+    from code.propagation import propagate
+    from code.video_io import FrameRateSampler, read_frames
+
+    start = time.perf_counter()
+    params, limits = job["params"], job["limits"]
+    report(job_id, {"event": "started", "pid": os.getpid()})
+    graph_cut, mask, cache_hit = fitted_model(job)
+    report(job_id, {"event": "model", "cache_hit": cache_hit, "seconds": time.perf_counter() - start})
+
+    change_detector = None
+    if params["skip_static_frames"]:
+        change_detector = FrameChangeDetector()
+        change_detector.prime(graph_cut.image)
+    interpolator = MaskInterpolator(interval=params["solve_every"]) if params["solve_every"] > 1 else None
+    feathering = EdgeFeathering(radius=params["feather_radius"]) if params["feather_radius"] else None
+
+    first_img = cv.cvtColor(graph_cut.image, cv.COLOR_RGB2RGBA)
+    first_img[:, :, 3] = feathering.alpha(graph_cut.image, mask) if feathering else mask * 255
+    cap = cv.VideoCapture(job["video"])
+    sampler = FrameRateSampler(cap.get(cv.CAP_PROP_FPS), params["fps"])
+    cap.release()
+    sampler.keep(job["frame"])
+
+    options = {"quality": params["quality"], "lossless": params["lossless"]} if params["format"] == "webp" else {}
+    partial = f"{job['output']}.{job_id}.partial"
+    exporter = get_exporter(params["format"], partial, **options)
+    frames = 1
+    try:
+        exporter.write(first_img, sampler.durations[0])
+        decoded = read_frames(job["video"], params["width"], params["height"], job["frame"] + 1, sampler=sampler)
+        segmented = propagate(
+            video_engine(params["engine"], graph_cut, mask),
+            decoded,
+            mask,
+            params["mode"] == "3d",
+            params["energy_term_3d"],
+            change_detector=change_detector,
+            interpolator=interpolator,
+            feathering=feathering,
+        )
+        last_report = 0.0
+        for index, img, _ in segmented:
+            if frames == params["frames"]:
+                break
+            check_limits(job_id, limits, frames + 1, start)
+            exporter.write(img, sampler.durations[frames])
+            frames += 1
+            if time.perf_counter() - last_report > 0.25:
+                last_report = time.perf_counter()
+                elapsed = last_report - start
+                report(job_id, {"event": "progress", "frames": frames, "frame_index": index, "fps": frames / elapsed})
+        exporter.close()
+        os.replace(partial, job["output"])
+    except BaseException:
+        try:
+            exporter.close()
+        except Exception:
+            pass
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        if feathering:
+            feathering.close()
+        graph_cut.close()
+
+    seconds = time.perf_counter() - start
+    return {
+        "output": job["output"],
+        "bytes": os.path.getsize(job["output"]),
+        "frames": frames,
+        "seconds": seconds,
+        "fps": frames / seconds,
+        "model_cache_hit": cache_hit,
+    }
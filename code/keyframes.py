@@ -0,0 +1,187 @@
+import copy
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from code.mrf_solver import resolve_region
+from code.propagation import propagate
+from code.frame_analysis import FrameChangeDetector
+from code.mask_interpolation import MaskInterpolator
+from code.video_io import read_frames
+
+
+class Keyframe:
+    def __init__(self, frame_index: int, graph_cut, mask: np.ndarray, img: np.ndarray, version: int):
+        self.frame_index = frame_index
+        self.graph_cut = graph_cut  # model learnt on this frame
+        self.mask = mask
+        self.img = img
+        self.version = version
+
+
+def _propagate_segment(
+    video_path,
+    width,
+    height,
+    graph_cut,
+    keyframe_img,
+    init_mask,
+    first,
+    last,
+    is_3d,
+    energy_term_3d,
+    skip_static,
+    solve_every,
+):
+    """Worker: segment frames first..last (inclusive, either direction) starting from a keyframe mask."""
+    lo, hi = min(first, last), max(first, last)
+    frames = list(read_frames(video_path, width, height, start=lo, stop=hi + 1))
+    if first > last:
+        frames.reverse()
+    change_detector = None
+    if skip_static:
+        change_detector = FrameChangeDetector()
+        change_detector.prime(keyframe_img[:, :, :3])
+    interpolator = MaskInterpolator(interval=solve_every) if solve_every > 1 else None
+    results = propagate(
+        graph_cut, frames, init_mask, is_3d, energy_term_3d, change_detector=change_detector, interpolator=interpolator
+    )
+    try:
+        return [(index, img, mask) for index, img, mask in results]
+    finally:
+        graph_cut.close()
+
+
+class KeyframePropagator:
+    """Video segmentation from several annotated keyframes.
+
+    Between two keyframes a < b, a's model propagates forward to the midpoint m and b's model
+    propagates backward to m, so both halves run in parallel. At m the two masks are merged:
+    where they disagree the frame is re-solved without temporal prior. After the last keyframe,
+    propagation runs forward to the end of the clip.
+    Results are cached per half-segment and keyed on the keyframe version and frame range, so
+    changing or adding one keyframe only recomputes the segments next to it.
+    """
+
+    def __init__(self, video_path: str, width: int, height: int, workers: int = None):
+        self.video_path = video_path
+        self.width = width
+        self.height = height
+        self.workers = workers or os.cpu_count()
+        self.keyframes: dict[int, Keyframe] = {}
+        self.cache = {}
+        self.version = 0
+        self.last_recomputed = 0
+
+    def set_keyframe(self, frame_index: int, graph_cut, mask: np.ndarray, img: np.ndarray):
+        self.version += 1
+        # the GraphCut keeps being used by the GUI, propagate from a frozen copy
+        self.keyframes[frame_index] = Keyframe(frame_index, copy.deepcopy(graph_cut), mask, img, self.version)
+
+    def remove_keyframe(self, frame_index: int):
+        self.keyframes.pop(frame_index, None)
+
+    def clear(self):
+        self.keyframes = {}
+        self.cache = {}
+
+    def plan(self, end_frame: int) -> list[tuple]:
+        """Half-segments as (keyframe index, first, last) with first..last walked away from the keyframe."""
+        indices = sorted(self.keyframes)
+        jobs = []
+        for a, b in zip(indices, indices[1:]):
+            if b - a < 2:
+                continue
+            middle = (a + b) // 2
+            jobs.append((a, a + 1, middle))  # forward half, includes the meeting frame
+            jobs.append((b, b - 1, middle))  # backward half, includes the meeting frame
+        if indices and indices[-1] + 1 < end_frame:
+            jobs.append((indices[-1], indices[-1] + 1, end_frame - 1))
+        return jobs
+
+    def run(
+        self, end_frame: int, is_3d: bool, energy_term_3d: float, skip_static: bool = False, solve_every: int = 1
+    ) -> list[tuple[int, np.ndarray, np.ndarray]]:
+        """(frame index, RGBA image, mask) for every frame from the first keyframe to end_frame - 1.
+
+        skip_static reuses masks of near-duplicate frames and resets at scene cuts (FrameChangeDetector);
+        with solve_every > 1 only every solve_every-th frame is solved, the others are flow-warped
+        (MaskInterpolator).
+        """
+        if not self.keyframes:
+            return []
+        jobs = self.plan(end_frame)
+        settings = (is_3d, energy_term_3d, skip_static, solve_every)
+        keys = {job: (job, self.keyframes[job[0]].version, *settings) for job in jobs}
+        todo = [job for job in jobs if keys[job] not in self.cache]
+        self.last_recomputed = len(todo)
+
+        if todo:
+            # run() is called from the GUI's worker thread while other threads (decoder, preview
+            # cache) are alive, and forking a multi-threaded process can leave locks held in the child
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            context = multiprocessing.get_context(method)
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(todo)), mp_context=context) as pool:
+                futures = {
+                    job: pool.submit(
+                        _propagate_segment,
+                        self.video_path,
+                        self.width,
+                        self.height,
+                        self.keyframes[job[0]].graph_cut,
+                        self.keyframes[job[0]].img,
+                        self.keyframes[job[0]].mask,
+                        job[1],
+                        job[2],
+                        is_3d,
+                        energy_term_3d,
+                        skip_static,
+                        solve_every,
+                    )
+                    for job in todo
+                }
+                for job, future in futures.items():
+                    self.cache[keys[job]] = future.result()
+        # forget segments that no longer exist
+        self.cache = {key: value for key, value in self.cache.items() if key in keys.values()}
+
+        results = {k.frame_index: (k.frame_index, k.img, k.mask) for k in self.keyframes.values()}
+        for job in jobs:
+            for index, img, mask in self.cache[keys[job]]:
+                results[index] = (index, img, mask)
+
+        # the forward and backward halves both end on the middle frame between two keyframes
+        indices = sorted(self.keyframes)
+        for a, b in zip(indices, indices[1:]):
+            if b - a < 2:
+                continue
+            middle = (a + b) // 2
+            _, img, forward_mask = self.cache[keys[(a, a + 1, middle)]][-1]
+            _, _, backward_mask = self.cache[keys[(b, b - 1, middle)]][-1]
+            results[middle] = self.merge(middle, img, forward_mask, backward_mask, self.keyframes[a].graph_cut)
+
+        return [results[i] for i in range(indices[0], end_frame) if i in results]
+
+    def merge(self, index, img, forward_mask, backward_mask, graph_cut):
+        """Re-solve the pixels where the forward and backward masks disagree, without temporal prior."""
+        disagree = forward_mask != backward_mask
+        if not disagree.any():
+            return index, img, forward_mask
+        # the keyframe's model stays on its own frame
+        graph_cut = copy.deepcopy(graph_cut)
+        graph_cut.image = img[:, :, :3]
+        try:
+            mask = resolve_region(
+                forward_mask,
+                disagree,
+                graph_cut.unary_2d(),
+                graph_cut.compute_smoothness_terms(),
+                graph_cut.get_mrf_solver(),
+            )
+        finally:
+            graph_cut.close()
+        img = img.copy()
+        img[:, :, 3] = mask * 255
+        return index, img, mask
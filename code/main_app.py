@@ -35,8 +35,14 @@ class VideoToGIF:
         # self.grab_cut_app = SimulatedAnnealingApp(root, self.video_player)
         self.graph_cut_app = GraphCutApp(root, self.video_player)
         self.video_segmentation_app = VideoSegmentationApp(root, self.graph_cut_app, self.video_player)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # Set focus to the main window and update
         self.root.update_idletasks()
         self.root.focus_force()
         # self.root.update()
+
+    def on_close(self):
+        # the tiled solver runs a process pool, stop it with the window
+        self.graph_cut_app.close()
+        self.root.destroy()
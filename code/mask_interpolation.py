@@ -0,0 +1,86 @@
+import numpy as np
+import cv2 as cv
+
+
+class MaskInterpolator:
+    """Fills frames between full solves by warping the previous mask with dense optical flow.
+
+    Only every `interval`-th frame is segmented fully. For the others, Farneback flow from the
+    frame back to the previous one pulls the previous mask (and frame) forward. The warp is
+    checked in a band around the mask boundary, where a wrong warp shows up first: the warped
+    frame must match the frame (photometric error below max_error) and the backward flow must be
+    undone by the forward flow (within max_flow_error pixels), on at least min_confidence of the
+    band. The mask area may change by at most max_area_change. Otherwise the frame is solved after all.
+
+    Experimental: graph cut masks change more from one frame to the next than a warp can follow,
+    so even accepted warps cost accuracy; solve every 3rd frame still fails the golden-mask check
+    (`python -m benchmarks.golden_masks check --preset solve-every-3`).
+    """
+
+    def __init__(
+        self,
+        interval: int = 3,
+        max_error: float = 12.0,
+        min_confidence: float = 0.9,
+        band: int = 3,
+        max_flow_error: float = 1.0,
+        max_area_change: float = 0.05,
+    ):
+        self.interval = interval
+        self.max_error = max_error
+        self.min_confidence = min_confidence
+        self.max_flow_error = max_flow_error
+        self.max_area_change = max_area_change
+        self.kernel = np.ones((2 * band + 1, 2 * band + 1), np.uint8)
+        self.since_solve = 0
+        self.stats = {"warped": 0, "solved": 0, "rejected": 0}
+
+    def wants_solve(self) -> bool:
+        return self.interval <= 1 or self.since_solve + 1 >= self.interval
+
+    def solved(self):
+        self.since_solve = 0
+        self.stats["solved"] += 1
+
+    def warp(self, prev_frame: np.ndarray, frame: np.ndarray, prev_mask: np.ndarray):
+        """Warped mask for frame, or None if the warp is not trustworthy."""
+        prev_gray = cv.cvtColor(prev_frame, cv.COLOR_RGB2GRAY)
+        gray = cv.cvtColor(frame, cv.COLOR_RGB2GRAY)
+        # flow from the current frame to the previous one: where each current pixel came from
+        flow = cv.calcOpticalFlowFarneback(gray, prev_gray, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+        h, w = gray.shape
+        grid_x, grid_y = np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32))
+        map_x, map_y = grid_x + flow[:, :, 0], grid_y + flow[:, :, 1]
+
+        mask = cv.remap(prev_mask, map_x, map_y, cv.INTER_NEAREST, borderMode=cv.BORDER_REPLICATE)
+        if not self.trusted(prev_gray, gray, flow, map_x, map_y, prev_mask, mask):
+            self.stats["rejected"] += 1
+            return None
+
+        self.since_solve += 1
+        self.stats["warped"] += 1
+        return mask
+
+    def trusted(self, prev_gray, gray, flow, map_x, map_y, prev_mask, mask) -> bool:
+        """Whether the warped mask may stand in for a solve (area, photometric and flow consistency)."""
+        prev_area, area = int(np.count_nonzero(prev_mask)), int(np.count_nonzero(mask))
+        if abs(area - prev_area) > self.max_area_change * max(prev_area, 1):
+            return False
+        boundary = cv.dilate(mask, self.kernel) != cv.erode(mask, self.kernel)
+        if not boundary.any():
+            return True
+        warped_gray = cv.remap(prev_gray, map_x, map_y, cv.INTER_LINEAR, borderMode=cv.BORDER_REPLICATE)
+        error = np.abs(warped_gray.astype(np.int16) - gray.astype(np.int16))[boundary]
+        if np.mean(error < self.max_error) < self.min_confidence:
+            return False
+        # forward flow at the source of each pixel should bring it back where it started
+        forward = cv.calcOpticalFlowFarneback(prev_gray, gray, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+        returned = cv.remap(forward, map_x, map_y, cv.INTER_LINEAR, borderMode=cv.BORDER_REPLICATE)
+        drift = np.linalg.norm((flow + returned)[boundary], axis=1)
+        return np.mean(drift < self.max_flow_error) >= self.min_confidence
+
+    def summary(self) -> str:
+        return (
+            f"{self.stats['solved']} frames solved, {self.stats['warped']} filled by flow warping, "
+            f"{self.stats['rejected']} warps rejected for low confidence"
+        )
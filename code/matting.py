@@ -0,0 +1,152 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def box_filter(x: np.ndarray, radius: int) -> np.ndarray:
+    """Mean over the (2r+1) x (2r+1) window around every pixel of x (h x w or h x w x c), clipped at the borders.
+
+    Window sums come from running sums (an integral image, one axis at a time), so the cost does
+    not depend on the radius.
+    """
+    h, w = x.shape[:2]
+    # running sums along each axis with a leading zero; a window sum is the difference of two
+    sums = np.zeros((h + 1,) + x.shape[1:])
+    np.cumsum(x, axis=0, out=sums[1:])
+    y0, y1 = np.clip(np.arange(h) - radius, 0, h), np.clip(np.arange(h) + radius + 1, 0, h)
+    rows = sums[y1] - sums[y0]
+
+    sums = np.zeros((h, w + 1) + x.shape[2:])
+    np.cumsum(rows, axis=1, out=sums[:, 1:])
+    x0, x1 = np.clip(np.arange(w) - radius, 0, w), np.clip(np.arange(w) + radius + 1, 0, w)
+    window = sums[:, x1] - sums[:, x0]
+
+    counts = np.outer(y1 - y0, x1 - x0)
+    return window / (counts if x.ndim == 2 else counts[:, :, None])
+
+
+def guided_filter(guide: np.ndarray, src: np.ndarray, radius: int, eps: float) -> np.ndarray:
+    """Edge-preserving smoothing of src (h x w) guided by a colour image (h x w x 3, 0..1).
+
+    The guided filter (He et al.): in every window src is fitted as a linear function a . I + b of
+    the guide colour, and the fits of all windows covering a pixel are averaged. Applied to a binary
+    mask, this gives a soft alpha that follows the colour edges of the frame. eps regularises the
+    fit; larger values give smoother transitions.
+    """
+    r, g, b = guide[:, :, 0], guide[:, :, 1], guide[:, :, 2]
+    # all first and second moments in one pass
+    stats = box_filter(
+        np.dstack([r, g, b, src, r * src, g * src, b * src, r * r, r * g, r * b, g * g, g * b, b * b]), radius
+    )
+    mean_i, mean_p = stats[:, :, :3], stats[:, :, 3]
+    cov_ip = stats[:, :, 4:7] - mean_i * mean_p[:, :, None]
+    mr, mg, mb = mean_i[:, :, 0], mean_i[:, :, 1], mean_i[:, :, 2]
+    rr = stats[:, :, 7] - mr * mr + eps
+    rg = stats[:, :, 8] - mr * mg
+    rb = stats[:, :, 9] - mr * mb
+    gg = stats[:, :, 10] - mg * mg + eps
+    gb = stats[:, :, 11] - mg * mb
+    bb = stats[:, :, 12] - mb * mb + eps
+
+    # a = inverse(covariance of the guide) @ cov_ip, with the symmetric 3x3 inverse written out
+    inv_rr = gg * bb - gb * gb
+    inv_rg = gb * rb - rg * bb
+    inv_rb = rg * gb - gg * rb
+    inv_gg = rr * bb - rb * rb
+    inv_gb = rb * rg - rr * gb
+    inv_bb = rr * gg - rg * rg
+    det = rr * inv_rr + rg * inv_rg + rb * inv_rb
+    cr, cg, cb = cov_ip[:, :, 0], cov_ip[:, :, 1], cov_ip[:, :, 2]
+    a_r = (inv_rr * cr + inv_rg * cg + inv_rb * cb) / det
+    a_g = (inv_rg * cr + inv_gg * cg + inv_gb * cb) / det
+    a_b = (inv_rb * cr + inv_gb * cg + inv_bb * cb) / det
+    offset = mean_p - a_r * mr - a_g * mg - a_b * mb
+
+    mean_a = box_filter(np.dstack([a_r, a_g, a_b, offset]), radius)
+    return mean_a[:, :, 0] * r + mean_a[:, :, 1] * g + mean_a[:, :, 2] * b + mean_a[:, :, 3]
+
+
+class EdgeFeathering:
+    """Soft alpha from a binary mask and its frame, as a post-process between segmentation and export.
+
+    The mask is run through a colour guided filter, so the hard cut-out edge becomes a transition
+    that follows the frame instead of the pixel grid. With temporal > 0, alpha is blended with the
+    previous frame's where the colour did not change (weight temporal * exp(-diff^2 / sigma^2)),
+    which damps edge shimmer without dragging alpha behind moving objects; reset() drops that state
+    (e.g. at scene cuts).
+    With workers > 1 the frame is split into horizontal bands filtered on a thread pool. Every band
+    carries 2 * radius rows of context, so the result is the same as in one piece.
+    """
+
+    def __init__(
+        self, radius: int = 2, eps: float = 1e-3, temporal: float = 0.0, sigma: float = 0.05, workers: int = 1
+    ):
+        self.radius = radius
+        self.eps = eps
+        self.temporal = temporal
+        self.sigma = sigma
+        self.workers = workers or os.cpu_count()
+        self.pool = None
+        self.prev_guide = None
+        self.prev_alpha = None
+
+    def __getstate__(self):
+        # the pool cannot be pickled / deep-copied; copies start their own
+        state = self.__dict__.copy()
+        state["pool"] = None
+        return state
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def reset(self):
+        self.prev_guide = None
+        self.prev_alpha = None
+
+    def filter(self, guide: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        h = mask.shape[0]
+        halo = 2 * self.radius
+        band = -(-h // self.workers)
+        if self.workers == 1 or band <= halo:
+            return guided_filter(guide, mask, self.radius, self.eps)
+
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        futures = []
+        for y0 in range(0, h, band):
+            y1 = min(y0 + band, h)
+            top, bottom = max(y0 - halo, 0), min(y1 + halo, h)
+            future = self.pool.submit(guided_filter, guide[top:bottom], mask[top:bottom], self.radius, self.eps)
+            futures.append((future, y0 - top, y1 - top))
+        return np.concatenate([future.result()[start:end] for future, start, end in futures])
+
+    def alpha(self, frame: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        """uint8 alpha (h x w) for an RGB frame and its 0/1 mask."""
+        guide = frame / 255.0
+        alpha = mask.astype(np.float64)
+        # pixels further than 2 * radius from the mask boundary only see windows of constant mask,
+        # where the filter returns the mask unchanged, so only the box around the boundary is
+        # filtered, with another 2 * radius of context for the pixels that do change
+        boundary = np.zeros(mask.shape, dtype=bool)
+        horizontal, vertical = mask[:, 1:] != mask[:, :-1], mask[1:, :] != mask[:-1, :]
+        boundary[:, 1:] |= horizontal
+        boundary[:, :-1] |= horizontal
+        boundary[1:, :] |= vertical
+        boundary[:-1, :] |= vertical
+        rows, cols = np.flatnonzero(boundary.any(axis=1)), np.flatnonzero(boundary.any(axis=0))
+        if len(rows):
+            reach = 4 * self.radius
+            y0, y1 = max(rows[0] - reach, 0), rows[-1] + reach + 1
+            x0, x1 = max(cols[0] - reach, 0), cols[-1] + reach + 1
+            alpha[y0:y1, x0:x1] = np.clip(self.filter(guide[y0:y1, x0:x1], alpha[y0:y1, x0:x1]), 0, 1)
+
+        if self.temporal > 0 and self.prev_alpha is not None and self.prev_alpha.shape == alpha.shape:
+            diff = np.sum((guide - self.prev_guide) ** 2, axis=2)
+            weight = self.temporal * np.exp(-diff / self.sigma**2)
+            alpha = weight * self.prev_alpha + (1 - weight) * alpha
+        self.prev_guide = guide
+        self.prev_alpha = alpha
+        return np.round(alpha * 255).astype(np.uint8)
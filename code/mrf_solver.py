@@ -0,0 +1,272 @@
+import numpy as np
+
+from code.capacity import CapacityEncoder
+from code.instrumentation import tracer
+
+# Binary MRF on a 4-connected pixel grid:
+#   unary    (h x w x 2)  cost of labelling each pixel bg (0) or fg (1)
+#   pairwise (horizontal, vertical), each (h x w)
+#            horizontal[y, x] is the Potts weight between (y, x) and (y, x + 1) (last column unused)
+#            vertical[y, x] is the Potts weight between (y, x) and (y + 1, x) (last row unused)
+# Every solver returns a (h x w) uint8 label map with 1 = foreground.
+
+RIGHT = np.array([[0, 0, 0], [0, 0, 1], [0, 0, 0]])
+DOWN = np.array([[0, 0, 0], [0, 0, 0], [0, 1, 0]])
+
+
+def energy(labels: np.ndarray, unary: np.ndarray, pairwise: tuple[np.ndarray, np.ndarray]) -> float:
+    """Energy of a labelling. Used to compare solvers on the same problem."""
+    horizontal, vertical = pairwise
+    data = np.take_along_axis(unary, labels[:, :, None].astype(np.intp), axis=2).sum()
+    smooth = np.sum(horizontal[:, :-1] * (labels[:, :-1] != labels[:, 1:]))
+    smooth += np.sum(vertical[:-1, :] * (labels[:-1, :] != labels[1:, :]))
+    return float(data + smooth)
+
+
+def _neighbour_costs(labels, pairwise):
+    """Potts cost of labelling each pixel 0 or 1 given its current 4 neighbours -> (h x w x 2)."""
+    horizontal, vertical = pairwise
+    fg_neighbours = np.zeros(labels.shape, dtype=np.float64)
+    bg_neighbours = np.zeros(labels.shape, dtype=np.float64)
+    fg = labels.astype(np.float64)
+    bg = 1.0 - fg
+
+    # right and left neighbours
+    fg_neighbours[:, :-1] += horizontal[:, :-1] * fg[:, 1:]
+    bg_neighbours[:, :-1] += horizontal[:, :-1] * bg[:, 1:]
+    fg_neighbours[:, 1:] += horizontal[:, :-1] * fg[:, :-1]
+    bg_neighbours[:, 1:] += horizontal[:, :-1] * bg[:, :-1]
+    # down and up neighbours
+    fg_neighbours[:-1, :] += vertical[:-1, :] * fg[1:, :]
+    bg_neighbours[:-1, :] += vertical[:-1, :] * bg[1:, :]
+    fg_neighbours[1:, :] += vertical[:-1, :] * fg[:-1, :]
+    bg_neighbours[1:, :] += vertical[:-1, :] * bg[:-1, :]
+
+    # labelling a pixel bg costs the weights to its fg neighbours and vice versa
+    return np.stack([fg_neighbours, bg_neighbours], axis=-1)
+
+
+class MaxflowSolver:
+    """Exact minimum cut with PyMaxflow. Capacities are stored as set by the CapacityEncoder."""
+
+    def __init__(self, capacity: CapacityEncoder = None):
+        self.capacity = capacity or CapacityEncoder()
+
+    def build_graph(self, unary, pairwise, buffers=None):
+        """With FrameBuffers (code/frame_buffers.py) the previous graph is reset and reused and the
+        terminal capacities are computed in its arrays; the graph is then only valid until the next call."""
+        import maxflow
+
+        horizontal, vertical = pairwise
+        with tracer.span("graph_build"):
+            if buffers is None:
+                g, terminals = maxflow.Graph[self.capacity.graph_type](), None
+            else:
+                g = buffers.graph_for(self.capacity.graph_type)
+                names = ("terminal_shift", "terminal_source", "terminal_sink")
+                terminals = tuple(buffers.get(name, unary.shape[:2], unary.dtype) for name in names)
+            node_ids = g.add_grid_nodes(unary.shape[:2])
+            g.add_grid_edges(node_ids, weights=self.capacity.encode(horizontal), structure=RIGHT, symmetric=True)
+            g.add_grid_edges(node_ids, weights=self.capacity.encode(vertical), structure=DOWN, symmetric=True)
+            # source capacity = cost of bg, sink capacity = cost of fg
+            g.add_grid_tedges(node_ids, *self.capacity.encode_terminals(unary[:, :, 0], unary[:, :, 1], terminals))
+        if tracer.enabled:
+            tracer.count("graph_nodes", g.get_node_count())
+            tracer.count("graph_edges", g.get_edge_count())
+        return g, node_ids
+
+    @staticmethod
+    def cut(g) -> float:
+        """Run max-flow on a built graph -> flow value."""
+        with tracer.span("maxflow"):
+            flow = g.maxflow()
+        tracer.gauge("flow", flow)
+        return flow
+
+    @staticmethod
+    def read_labels(g, node_ids):
+        # source side (segment 0) is foreground
+        with tracer.span("readout"):
+            segments = g.get_grid_segments(node_ids)
+            return np.logical_not(segments, out=np.empty(segments.shape, np.uint8))
+
+    def solve(self, unary, pairwise, init_labels=None):
+        g, node_ids = self.build_graph(unary, pairwise)
+        self.cut(g)
+        return self.read_labels(g, node_ids)
+
+    def solve_graph(self, unary, edges, weights):
+        """Minimum cut on an arbitrary graph: unary (n x 2), edges (m x 2) node indices, weights (m,)."""
+        import maxflow
+
+        g = maxflow.Graph[self.capacity.graph_type]()
+        node_ids = g.add_nodes(len(unary))
+        weights = self.capacity.encode(weights)
+        g.add_edges(node_ids[edges[:, 0]], node_ids[edges[:, 1]], weights, weights)
+        g.add_grid_tedges(node_ids, *self.capacity.encode_terminals(unary[:, 0], unary[:, 1]))
+        self.cut(g)
+        return self.read_labels(g, node_ids)
+
+
+def resolve_region(labels: np.ndarray, region: np.ndarray, unary, pairwise, solver: MaxflowSolver = None) -> np.ndarray:
+    """Re-solve the pixels where region is True with every other pixel fixed to its current label.
+
+    Only the bounding box of the region (plus a 1 pixel border of fixed neighbours) is put in the graph.
+    """
+    if not region.any():
+        return labels
+    ys, xs = np.nonzero(region)
+    y0, y1 = max(ys.min() - 1, 0), min(ys.max() + 2, labels.shape[0])
+    x0, x1 = max(xs.min() - 1, 0), min(xs.max() + 2, labels.shape[1])
+
+    crop_labels = labels[y0:y1, x0:x1]
+    fixed = ~region[y0:y1, x0:x1]
+    crop_unary = unary[y0:y1, x0:x1].astype(np.float64)
+    crop_pairwise = tuple(p[y0:y1, x0:x1].copy() for p in pairwise)
+    # the crop's last column / row has no right / lower neighbour inside the crop
+    crop_pairwise[0][:, -1] = 0
+    crop_pairwise[1][-1, :] = 0
+
+    # flipping a pixel can gain at most its unary difference plus its four edges,
+    # so this cost is never worth paying
+    hard = np.max(np.abs(crop_unary)) + 4 * max(np.max(p) for p in crop_pairwise) + 1
+    crop_unary[fixed & (crop_labels == 1)] = (hard, 0)
+    crop_unary[fixed & (crop_labels == 0)] = (0, hard)
+
+    resolved = labels.copy()
+    resolved[y0:y1, x0:x1] = (solver or MaxflowSolver()).solve(crop_unary, crop_pairwise)
+    return resolved
+
+
+class ICMSolver:
+    """Iterated conditional modes with checkerboard (red/black) parallel updates."""
+
+    def __init__(self, max_iterations=20):
+        self.max_iterations = max_iterations
+
+    def solve(self, unary, pairwise, init_labels=None):
+        h, w = unary.shape[:2]
+        labels = np.argmin(unary, axis=2).astype(np.uint8) if init_labels is None else init_labels.copy()
+        yy, xx = np.mgrid[0:h, 0:w]
+        parities = [(yy + xx) % 2 == 0, (yy + xx) % 2 == 1]
+
+        for _ in range(self.max_iterations):
+            changed = 0
+            for parity in parities:
+                costs = unary + _neighbour_costs(labels, pairwise)
+                best = np.argmin(costs, axis=2).astype(np.uint8)
+                update = parity & (best != labels)
+                labels[update] = best[update]
+                changed += np.count_nonzero(update)
+            if changed == 0:
+                break
+        return labels
+
+
+class LoopyBPSolver:
+    """Min-sum loopy belief propagation with synchronous message updates."""
+
+    def __init__(self, max_iterations=30, damping=0.5, tolerance=1e-3):
+        self.max_iterations = max_iterations
+        self.damping = damping
+        self.tolerance = tolerance
+
+    def solve(self, unary, pairwise, init_labels=None):
+        horizontal, vertical = pairwise
+        h, w = unary.shape[:2]
+        unary = unary.astype(np.float64)
+        # incoming messages to each pixel, from its left / right / up / down neighbour
+        from_left = np.zeros((h, w, 2))
+        from_right = np.zeros((h, w, 2))
+        from_up = np.zeros((h, w, 2))
+        from_down = np.zeros((h, w, 2))
+
+        def send(h_cost, weight):
+            # m(l_q) = min_{l_p} h(l_p) + weight * [l_p != l_q], normalised so min(m) = 0
+            msg = np.minimum(h_cost, np.min(h_cost, axis=2, keepdims=True) + weight[:, :, None])
+            return msg - np.min(msg, axis=2, keepdims=True)
+
+        for _ in range(self.max_iterations):
+            belief = unary + from_left + from_right + from_up + from_down
+
+            new_from_left = np.zeros_like(from_left)
+            new_from_right = np.zeros_like(from_right)
+            new_from_up = np.zeros_like(from_up)
+            new_from_down = np.zeros_like(from_down)
+            # pixel (y, x) sends to (y, x + 1) everything except what (y, x + 1) sent to it
+            new_from_left[:, 1:] = send((belief - from_right)[:, :-1], horizontal[:, :-1])
+            new_from_right[:, :-1] = send((belief - from_left)[:, 1:], horizontal[:, :-1])
+            new_from_up[1:, :] = send((belief - from_down)[:-1, :], vertical[:-1, :])
+            new_from_down[:-1, :] = send((belief - from_up)[1:, :], vertical[:-1, :])
+
+            delta = max(
+                np.max(np.abs(new_from_left - from_left)),
+                np.max(np.abs(new_from_right - from_right)),
+                np.max(np.abs(new_from_up - from_up)),
+                np.max(np.abs(new_from_down - from_down)),
+            )
+            a = self.damping
+            from_left = a * from_left + (1 - a) * new_from_left
+            from_right = a * from_right + (1 - a) * new_from_right
+            from_up = a * from_up + (1 - a) * new_from_up
+            from_down = a * from_down + (1 - a) * new_from_down
+            if delta < self.tolerance:
+                break
+
+        belief = unary + from_left + from_right + from_up + from_down
+        return np.argmin(belief, axis=2).astype(np.uint8)
+
+
+class AnnealingSolver:
+    """Simulated annealing with checkerboard Metropolis sweeps."""
+
+    def __init__(self, temperature=1.0, cooling_rate=0.9, iterations=30, seed=0):
+        self.temperature = temperature
+        self.cooling_rate = cooling_rate
+        self.iterations = iterations
+        self.seed = seed
+
+    def solve(self, unary, pairwise, init_labels=None):
+        rng = np.random.default_rng(self.seed)
+        h, w = unary.shape[:2]
+        labels = np.argmin(unary, axis=2).astype(np.uint8) if init_labels is None else init_labels.copy()
+        yy, xx = np.mgrid[0:h, 0:w]
+        parities = [(yy + xx) % 2 == 0, (yy + xx) % 2 == 1]
+        rows, cols = np.arange(h)[:, None], np.arange(w)[None, :]
+
+        temperature = self.temperature
+        for _ in range(self.iterations):
+            for parity in parities:
+                costs = unary + _neighbour_costs(labels, pairwise)
+                current = costs[rows, cols, labels]
+                flipped = costs[rows, cols, 1 - labels]
+                delta = flipped - current
+                # accept downhill moves always, uphill moves with probability exp(-delta / T)
+                with np.errstate(over="ignore"):
+                    accept = (delta < 0) | (rng.random((h, w)) < np.exp(-delta / max(temperature, 1e-12)))
+                update = parity & accept
+                labels[update] = 1 - labels[update]
+            temperature *= self.cooling_rate
+        return labels
+
+
+def _tiled_maxflow_solver(**kwargs):
+    # imported here, code/tiled_maxflow.py builds on this module
+    from code.tiled_maxflow import TiledMaxflowSolver
+
+    return TiledMaxflowSolver(**kwargs)
+
+
+SOLVERS = {
+    "maxflow": MaxflowSolver,
+    "maxflow-tiled": _tiled_maxflow_solver,
+    "icm": ICMSolver,
+    "loopy-bp": LoopyBPSolver,
+    "annealing": AnnealingSolver,
+}
+
+
+def get_solver(name: str, **kwargs):
+    if name not in SOLVERS:
+        raise ValueError(f"Unknown solver '{name}'. Available: {', '.join(SOLVERS)}")
+    return SOLVERS[name](**kwargs)
@@ -0,0 +1,205 @@
+import bisect
+import queue
+import threading
+import time
+from typing import Optional
+
+import cv2 as cv
+import numpy as np
+from PIL import Image
+
+from code.instrumentation import tracer
+from code.video_io import prepare_frame
+
+
+def checkerboard(width: int, height: int, cell: int = 8) -> np.ndarray:
+    """Light / dark grey checkerboard (h x w x 3) to show transparent pixels against."""
+    ys, xs = np.indices((height, width))
+    light = ((ys // cell + xs // cell) % 2).astype(bool)
+    board = np.full((height, width, 3), 153, dtype=np.uint8)
+    board[light] = 204
+    return board
+
+
+def composite_preview(rgba: np.ndarray, width: int, height: int, background: np.ndarray) -> Image.Image:
+    """RGBA frame scaled to width x height and blended over background -> RGB image."""
+    if rgba.shape[1] != width or rgba.shape[0] != height:
+        rgba = cv.resize(rgba, (width, height), interpolation=cv.INTER_AREA)
+    alpha = rgba[:, :, 3:].astype(np.uint16)
+    rgb = (rgba[:, :, :3] * alpha + background * (255 - alpha) + 127) // 255
+    return Image.fromarray(rgb.astype(np.uint8))
+
+
+class PlaybackClock:
+    """Which frame should be on screen now, from the wall clock.
+
+    Frames either follow a list of durations (ms) or a fixed fps. A player asks due() on every tick,
+    shows that frame (dropping any it did not get to) and sleeps delay_until() the next one, so
+    playback keeps the real duration however long a tick takes.
+    """
+
+    def __init__(self, durations: list[int] = None, fps: float = None):
+        self.starts = np.cumsum([0] + list(durations)) if durations is not None else None
+        self.frame_ms = 1000 / fps if fps else None
+        self.origin = time.perf_counter()
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.origin) * 1000
+
+    def start_ms(self, k: int) -> float:
+        return self.starts[k] if self.starts is not None else k * self.frame_ms
+
+    def due(self) -> int:
+        """Index of the frame whose display time contains now (past the last frame for a finished list)."""
+        now = self.elapsed_ms()
+        if self.starts is not None:
+            return bisect.bisect_right(self.starts, now) - 1
+        return int(now / self.frame_ms)
+
+    def finished(self) -> bool:
+        return self.starts is not None and self.elapsed_ms() >= self.starts[-1]
+
+    def delay_until(self, k: int) -> int:
+        """Whole ms until frame k is due, at least 1 (for Tk's after())."""
+        return max(1, int(np.ceil(self.start_ms(k) - self.elapsed_ms())))
+
+
+class PreviewCache:
+    """Preview images (scaled, over a checkerboard) of RGBA frames, rendered ahead on a thread.
+
+    The renderer stays up to `capacity` frames ahead of the last frame asked for and evicts frames
+    behind it, so memory is bounded however long the clip is. get() renders on the spot when the
+    renderer has not reached a frame yet. Images are PIL images; the PhotoImage is made (or pasted
+    into) on the Tk thread.
+    """
+
+    def __init__(self, frames: list, width: int, height: int, capacity: int = 48):
+        self.frames = frames
+        self.width = width
+        self.height = height
+        self.capacity = capacity
+        self.background = checkerboard(width, height)
+        self.images = {}
+        self.position = 0
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.render_ahead, daemon=True)
+        self.thread.start()
+
+    def render(self, index: int) -> Image.Image:
+        frame = self.frames[index]
+        return composite_preview(np.asarray(frame), self.width, self.height, self.background)
+
+    def next_missing(self) -> Optional[int]:
+        end = min(self.position + self.capacity, len(self.frames))
+        return next((i for i in range(self.position, end) if i not in self.images), None)
+
+    def render_ahead(self):
+        while True:
+            with self.condition:
+                index = self.next_missing()
+                while index is None and not self.stopped:
+                    self.condition.wait()
+                    index = self.next_missing()
+                if self.stopped:
+                    return
+            image = self.render(index)
+            with self.condition:
+                if self.position <= index < self.position + self.capacity:
+                    self.images[index] = image
+
+    def get(self, index: int) -> Image.Image:
+        with self.condition:
+            self.position = index
+            for i in [i for i in self.images if i < index or i >= index + self.capacity]:
+                del self.images[i]
+            image = self.images.get(index)
+            self.condition.notify()
+        if image is None:
+            tracer.count("preview_cache_misses")
+            image = self.render(index)
+        return image
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+
+# marks the end of the clip in BackgroundDecoder's queue
+_END = None
+
+
+class BackgroundDecoder:
+    """Decodes and prepares frames from start on a thread, into a bounded queue.
+
+    Uses its own VideoCapture, so the GUI's capture (and its position) is left alone. take(k)
+    returns the newest decoded frame up to k and drops the older ones, which is how a player that
+    fell behind catches up.
+    """
+
+    def __init__(self, video_path: str, start: int, width: int, height: int, max_pending: int = 8):
+        self.video_path = video_path
+        self.start = start
+        self.width = width
+        self.height = height
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.ahead = None
+        self.end_reached = False
+        self.dropped = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.decode, daemon=True)
+        self.thread.start()
+
+    def decode(self):
+        cap = cv.VideoCapture(self.video_path)
+        cap.set(cv.CAP_PROP_POS_FRAMES, self.start)
+        index = self.start
+        try:
+            while not self.stop_event.is_set():
+                ret, frame = cap.read()
+                item = (index, prepare_frame(frame, self.width, self.height)) if ret else _END
+                while not self.stop_event.is_set():
+                    try:
+                        self.queue.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if item is _END:
+                    return
+                index += 1
+        finally:
+            cap.release()
+
+    @property
+    def finished(self) -> bool:
+        """The whole clip has been handed out by take()."""
+        return self.end_reached and self.ahead is None
+
+    def take(self, index: int) -> Optional[tuple[int, np.ndarray]]:
+        """Newest decoded (frame index, RGB frame) with frame index <= index, or None if none is ready."""
+        item = None
+        while True:
+            if self.ahead is None:
+                if self.end_reached:
+                    break
+                try:
+                    next_item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if next_item is _END:
+                    self.end_reached = True
+                    break
+                self.ahead = next_item
+            if self.ahead[0] > index:
+                break
+            if item is not None:
+                self.dropped += 1
+                tracer.count("playback_dropped")
+            item, self.ahead = self.ahead, None
+        return item
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
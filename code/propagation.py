@@ -0,0 +1,76 @@
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from code.instrumentation import tracer
+
+
+def propagate(
+    graph_cut,
+    frames: Iterable[tuple[int, np.ndarray]],
+    init_mask: np.ndarray,
+    is_3d: bool,
+    energy_term_3d: float,
+    adapter=None,
+    change_detector=None,
+    interpolator=None,
+    feathering=None,
+) -> Iterator[tuple[int, np.ndarray, np.ndarray]]:
+    """Segment frames one after another with a learnt model -> (frame index, RGBA image, mask).
+
+    In 3D mode every frame uses the previous frame's mask as temporal prior, starting from init_mask.
+    The frames may come in any order (e.g. backwards from a keyframe).
+    With a FrameChangeDetector, near-duplicate frames reuse the previous mask and a scene cut
+    drops the temporal prior (and resets the online colour model adaptation).
+    With a MaskInterpolator, only every Kth frame is solved and the frames in between are
+    filled by flow-warping the previous mask, unless the warp looks unreliable.
+    With an EdgeFeathering, the alpha of the RGBA image is softened around the mask edge (the
+    returned mask stays binary); its temporal state is reset at scene cuts.
+    """
+    prev_mask = init_mask
+    prev_frame, prev_frame_copied = None, False
+    for index, frame in frames:
+        with tracer.frame(index):
+            img, mask, kind = _segment_next(
+                graph_cut, frame, prev_frame, prev_mask, is_3d, energy_term_3d, adapter, change_detector, interpolator
+            )
+            if feathering:
+                if kind == "cut":
+                    feathering.reset()
+                with tracer.span("feathering"):
+                    img[:, :, 3] = feathering.alpha(frame, mask)
+        tracer.count(f"frames_{kind}")
+        prev_mask = mask
+        if kind != "duplicate":
+            prev_frame, prev_frame_copied = frame, False
+        elif interpolator and prev_frame is not None and not prev_frame_copied:
+            # kept across a run of duplicates: a frame from a reused buffer (e.g. a FramePipeline slot,
+            # valid for a few frames only) would be overwritten before the next warp reads it
+            prev_frame, prev_frame_copied = prev_frame.copy(), True
+        yield index, img, mask
+
+
+def _segment_next(graph_cut, frame, prev_frame, prev_mask, is_3d, energy_term_3d, adapter, change_detector, interpolator):
+    """One step of propagate() -> (RGBA image, mask, how the frame was handled)."""
+    kind = change_detector.classify(frame, prev_mask) if change_detector else "normal"
+    if kind == "duplicate":
+        return graph_cut.rgba(frame, prev_mask), prev_mask, "duplicate"
+    if kind == "cut" and adapter:
+        adapter.on_scene_cut()
+
+    if interpolator and kind != "cut" and prev_frame is not None and not interpolator.wants_solve():
+        with tracer.span("flow_warp"):
+            mask = interpolator.warp(prev_frame, frame, prev_mask)
+        if mask is not None:
+            return graph_cut.rgba(frame, mask), mask, "warped"
+
+    if is_3d and kind != "cut":
+        img, mask = graph_cut.segment_frame_from_learnt_gmm_3d(frame, prev_mask, energy_term_3d)
+    else:
+        img, mask = graph_cut.segment_frame_from_learnt_gmm_2d(frame)
+    if interpolator:
+        interpolator.solved()
+    if adapter:
+        with tracer.span("gmm_adaptation"):
+            adapter.observe(frame, mask)
+    return img, mask, "cut" if kind == "cut" else "solved"
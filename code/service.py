@@ -0,0 +1,310 @@
+"""Local job service: segmentation jobs over HTTP, run on a warm process pool.
+
+    python -m code.service --workers 4 --port 8765
+
+Endpoints (JSON unless noted):
+
+    POST   /jobs               submit a job (see code.jobs) -> {"id", "status"}; 503 when the queue is full
+    GET    /jobs               all jobs
+    GET    /jobs/<id>          status, progress and result of one job
+    GET    /jobs/<id>/events   progress events as newline-delimited JSON, streamed until the job ends
+    GET    /jobs/<id>/output   the exported animation
+    DELETE /jobs/<id>          cancel a queued or running job
+    GET    /health             workers, queued and running jobs
+
+Jobs wait in a priority queue (higher priority first, then submission order) and run on a pool
+of worker processes that import sklearn / PyMaxflow once at start-up and cache fitted colour
+models between jobs. The service only binds to localhost by default and makes no outside calls.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+from code.jobs import DEFAULT_LIMITS, JobCancelled, JobLimitExceeded, init_worker, run_job, validate_job, warm_up
+
+MAX_BODY_BYTES = 16 * 1024 * 1024
+TERMINAL = ("done", "failed", "cancelled")
+REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+REASONS.update({409: "Conflict", 413: "Payload Too Large", 503: "Service Unavailable"})
+
+
+class Job:
+    def __init__(self, job_id: str, spec: dict):
+        self.id = job_id
+        self.spec = spec
+        self.status = "queued"
+        self.events = []
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.changed = asyncio.Condition()
+
+    def summary(self) -> dict:
+        progress = next((e for e in reversed(self.events) if e["event"] == "progress"), None)
+        return {
+            "id": self.id,
+            "status": self.status,
+            "priority": self.spec["priority"],
+            "video": self.spec["video"],
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "progress": progress,
+            "result": self.result,
+            "error": self.error,
+        }
+
+    async def add_event(self, event: dict):
+        async with self.changed:
+            self.events.append(event)
+            self.changed.notify_all()
+
+
+class JobService:
+    def __init__(self, workers: int, max_queued: int, output_dir: str, limits: dict):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.output_dir = output_dir
+        self.limits = limits
+        self.jobs = {}
+        self.queue = asyncio.PriorityQueue()
+        self.order = itertools.count()
+        self.running = 0
+
+    async def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.loop = asyncio.get_running_loop()
+        self.manager = multiprocessing.Manager()
+        self.progress = self.manager.Queue()
+        self.cancelled = self.manager.dict()
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=init_worker, initargs=(self.progress, self.cancelled)
+        )
+        # start every worker now rather than on the first jobs
+        barrier = self.manager.Barrier(self.workers)
+        pids = await asyncio.gather(
+            *(self.loop.run_in_executor(self.pool, warm_up, barrier) for _ in range(self.workers))
+        )
+        print(f"{len(set(pids))} warm workers")
+        threading.Thread(target=self.pump_progress, daemon=True).start()
+        self.dispatchers = [asyncio.create_task(self.dispatch()) for _ in range(self.workers)]
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+        self.progress.put(None)
+        self.manager.shutdown()
+
+    def pump_progress(self):
+        # the manager queue blocks, so it is read on a thread and handed to the event loop
+        while True:
+            try:
+                item = self.progress.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            job_id, event = item
+            if job_id in self.jobs:
+                asyncio.run_coroutine_threadsafe(self.on_progress(self.jobs[job_id], event), self.loop)
+
+    async def on_progress(self, job: Job, event: dict):
+        # progress can arrive after the job ended, the final event stays last
+        if job.status not in TERMINAL:
+            await job.add_event(event)
+
+    def submit(self, spec: dict) -> Job:
+        job = Job(uuid.uuid4().hex[:12], validate_job(spec, self.limits))
+        if job.spec["output"]:
+            job.spec["output"] = self.output_path(job.spec["output"])
+        else:
+            extension = job.spec["params"]["format"]
+            extension = "png" if extension == "apng" else extension
+            job.spec["output"] = os.path.join(self.output_dir, f"{job.id}.{extension}")
+        self.jobs[job.id] = job
+        self.queue.put_nowait((-job.spec["priority"], next(self.order), job.id))
+        return job
+
+    def output_path(self, output) -> str:
+        """A client's output name as a path in the output directory; clients never write elsewhere."""
+        if not isinstance(output, str):
+            raise ValueError("output must be a file name")
+        root = os.path.realpath(self.output_dir)
+        path = os.path.realpath(os.path.join(root, output))
+        if os.path.dirname(path) != root:
+            raise ValueError(f"output '{output}' must be a file name in the service's output directory")
+        return path
+
+    def queued(self) -> int:
+        return sum(job.status == "queued" for job in self.jobs.values())
+
+    async def dispatch(self):
+        while True:
+            _, _, job_id = await self.queue.get()
+            job = self.jobs[job_id]
+            if job.status != "queued":  # cancelled while waiting
+                continue
+            job.status = "running"
+            job.started = time.time()
+            self.running += 1
+            try:
+                job.result = await self.loop.run_in_executor(self.pool, run_job, job.id, job.spec)
+                job.status = "done"
+            except JobCancelled:
+                job.status = "cancelled"
+            except (JobLimitExceeded, ValueError) as e:
+                job.status, job.error = "failed", str(e)
+            except Exception as e:
+                job.status, job.error = "failed", f"{type(e).__name__}: {e}"
+            finally:
+                self.running -= 1
+                job.finished = time.time()
+                self.cancelled.pop(job.id, None)
+            await job.add_event({"event": job.status, "time": job.finished, "result": job.result, "error": job.error})
+
+    async def cancel(self, job: Job):
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.finished = time.time()
+            await job.add_event({"event": "cancelled", "time": job.finished})
+        elif job.status == "running":
+            # the worker checks this between frames
+            self.cancelled[job.id] = True
+
+    # ------------------------------------------------------------------------------ HTTP
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            if len(request_line) != 3:
+                return
+            method, target, _ = request_line
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY_BYTES:
+                await self.respond(writer, 413, {"error": f"body over {MAX_BODY_BYTES} bytes"})
+                return
+            body = await reader.readexactly(length) if length else b""
+            await self.route(method, urlsplit(target).path.rstrip("/").split("/")[1:], body, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method: str, parts: list, body: bytes, writer):
+        if parts == ["health"]:
+            health = {"workers": self.workers, "queued": self.queued(), "running": self.running, "jobs": len(self.jobs)}
+            return await self.respond(writer, 200, health)
+        if parts == ["jobs"] and method == "GET":
+            return await self.respond(writer, 200, [job.summary() for job in self.jobs.values()])
+        if parts == ["jobs"] and method == "POST":
+            if self.queued() >= self.max_queued:
+                return await self.respond(writer, 503, {"error": f"{self.max_queued} jobs already queued"})
+            try:
+                job = self.submit(json.loads(body or b"null"))
+            except (ValueError, TypeError, KeyError) as e:  # includes malformed JSON
+                return await self.respond(writer, 400, {"error": str(e)})
+            return await self.respond(writer, 202, {"id": job.id, "status": job.status})
+
+        if len(parts) < 2 or parts[0] != "jobs" or parts[1] not in self.jobs:
+            return await self.respond(writer, 404, {"error": "no such job"})
+        job = self.jobs[parts[1]]
+        action = parts[2] if len(parts) > 2 else None
+        if action is None and method == "GET":
+            return await self.respond(writer, 200, job.summary())
+        if action is None and method == "DELETE":
+            await self.cancel(job)
+            return await self.respond(writer, 200, job.summary())
+        if action == "events" and method == "GET":
+            return await self.stream_events(job, writer)
+        if action == "output" and method == "GET":
+            if job.status != "done":
+                return await self.respond(writer, 409, {"error": f"job is {job.status}"})
+            return await self.send_file(job.result["output"], writer)
+        return await self.respond(writer, 405, {"error": f"{method} not supported here"})
+
+    async def respond(self, writer, status: int, payload):
+        body = json.dumps(payload).encode()
+        writer.write(self.head(status, "application/json", len(body)) + body)
+        await writer.drain()
+
+    @staticmethod
+    def head(status: int, content_type: str, length: int = None) -> bytes:
+        lines = [f"HTTP/1.1 {status} {REASONS[status]}", f"Content-Type: {content_type}", "Connection: close"]
+        if length is not None:
+            lines.append(f"Content-Length: {length}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def stream_events(self, job: Job, writer):
+        # the body ends when the connection closes, after the job's final event
+        writer.write(self.head(200, "application/x-ndjson"))
+        sent = 0
+        while True:
+            async with job.changed:
+                await job.changed.wait_for(lambda: len(job.events) > sent)
+                events = job.events[sent:]
+            for event in events:
+                writer.write(json.dumps(event).encode() + b"\n")
+            sent += len(events)
+            await writer.drain()
+            if events[-1]["event"] in TERMINAL:
+                return
+
+    async def send_file(self, path: str, writer):
+        writer.write(self.head(200, "application/octet-stream", os.path.getsize(path)))
+        with open(path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                writer.write(chunk)
+                await writer.drain()
+
+
+async def serve(args):
+    limits = dict(DEFAULT_LIMITS)
+    for item in args.limit:
+        key, _, value = item.partition("=")
+        if key not in limits:
+            raise SystemExit(f"unknown limit {key}, choose from {sorted(limits)}")
+        limits[key] = float(value)
+    service = JobService(args.workers, args.max_queued, args.output_dir, limits)
+    await service.start()
+    server = await asyncio.start_server(service.handle, args.host, args.port)
+    print(f"serving on http://{args.host}:{args.port}, output in {args.output_dir}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--max-queued", type=int, default=100, help="submissions beyond this get 503")
+    parser.add_argument("--output-dir", default=os.path.join(os.path.expanduser("~"), "Downloads", "segmentation_jobs"))
+    parser.add_argument("--limit", action="append", default=[], metavar="KEY=VALUE", help="cap a per-job limit")
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Client for the local job service (code.service), with a load-test mode.
+
+    python -m code.service_client submit benchmarks/fixtures/beaver.json --set format=gif --watch
+    python -m code.service_client status <id>
+    python -m code.service_client cancel <id>
+    python -m code.service_client load benchmarks/fixtures/*.json --jobs 40 --concurrency 8 --set max_frames=30
+
+Jobs are built from annotation fixtures (clip, frame, rect and strokes, as in benchmarks/fixtures).
+`load` submits --jobs jobs from --concurrency threads, cycling through the fixtures and the
+priorities 0..--priorities-1, follows each job's event stream to the end and reports throughput and
+latency percentiles (submit, queue wait, run, end to end) per status.
+"""
+
+import argparse
+import http.client
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from code.jobs import DEFAULT_LIMITS, DEFAULT_PARAMS
+
+
+class ServiceClient:
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, timeout: float = 600):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, payload=None):
+        """-> (status, decoded JSON body)."""
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            body = json.dumps(payload).encode() if payload is not None else None
+            connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read() or b"null")
+        finally:
+            connection.close()
+
+    def submit(self, job: dict) -> str:
+        status, body = self.request("POST", "/jobs", job)
+        if status != 202:
+            raise RuntimeError(f"submit failed ({status}): {body.get('error')}")
+        return body["id"]
+
+    def status(self, job_id: str) -> dict:
+        return self.request("GET", f"/jobs/{job_id}")[1]
+
+    def cancel(self, job_id: str) -> dict:
+        return self.request("DELETE", f"/jobs/{job_id}")[1]
+
+    def events(self, job_id: str):
+        """Yield the job's progress events as they arrive, up to and including the final one."""
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request("GET", f"/jobs/{job_id}/events")
+            response = connection.getresponse()
+            for line in response:
+                yield json.loads(line)
+        finally:
+            connection.close()
+
+
+def job_from_fixture(path: str, settings: dict, priority: int = 0) -> dict:
+    with open(path) as f:
+        fixture = json.load(f)
+    annotation = {key: value for key, value in fixture.items() if key not in ("clip", "frame")}
+    return {
+        "video": fixture["clip"],
+        "frame": fixture["frame"],
+        "annotation": annotation,
+        "params": {key: value for key, value in settings.items() if key in DEFAULT_PARAMS},
+        "limits": {key: value for key, value in settings.items() if key in DEFAULT_LIMITS},
+        "priority": priority,
+    }
+
+
+def parse_settings(items: list) -> dict:
+    settings = {}
+    for item in items:
+        key, _, value = item.partition("=")
+        if key not in DEFAULT_PARAMS and key not in DEFAULT_LIMITS:
+            raise SystemExit(f"unknown setting {key}")
+        try:
+            settings[key] = json.loads(value)
+        except json.JSONDecodeError:
+            settings[key] = value
+    return settings
+
+
+def run_one(client: ServiceClient, job: dict) -> dict:
+    start = time.perf_counter()
+    job_id = client.submit(job)
+    submitted = time.perf_counter()
+    final = None
+    for event in client.events(job_id):
+        final = event
+    finished = time.perf_counter()
+    summary = client.status(job_id)
+    return {
+        "id": job_id,
+        "priority": job["priority"],
+        "status": final["event"] if final else "lost",
+        "error": summary["error"],
+        "submit_ms": (submitted - start) * 1000,
+        "queue_ms": ((summary["started"] or summary["finished"]) - summary["submitted"]) * 1000,
+        "run_ms": ((summary["finished"] - summary["started"]) * 1000) if summary["started"] else 0.0,
+        "total_ms": (finished - start) * 1000,
+        "frames": (summary["result"] or {}).get("frames", 0),
+        "model_cache_hit": (summary["result"] or {}).get("model_cache_hit"),
+    }
+
+
+def load_test(client: ServiceClient, fixtures: list, settings: dict, jobs: int, concurrency: int, priorities: int):
+    specs = [job_from_fixture(fixtures[i % len(fixtures)], settings, i % priorities) for i in range(jobs)]
+    results = []
+    lock = threading.Lock()
+
+    def worker(spec):
+        try:
+            result = run_one(client, spec)
+        except Exception as e:  # rejected submissions count too
+            result = {"status": "error", "error": str(e), "priority": spec["priority"]}
+        with lock:
+            results.append(result)
+            print(f"{len(results):>4}/{jobs} {result['status']:<9} {result.get('total_ms', 0):>9.0f} ms  {result['error'] or ''}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, specs))
+    elapsed = time.perf_counter() - start
+
+    print(f"\n{jobs} jobs in {elapsed:.1f} s: {jobs / elapsed:.2f} jobs/s")
+    done = [r for r in results if r["status"] == "done"]
+    frames = sum(r["frames"] for r in done)
+    print(f"{frames} frames segmented: {frames / elapsed:.1f} frames/s, model cache hits {sum(bool(r['model_cache_hit']) for r in done)}")
+    for status in sorted({r["status"] for r in results}):
+        print(f"  {status}: {sum(r['status'] == status for r in results)}")
+    if done:
+        print(f"\n{'ms':<12}{'p50':>10}{'p95':>10}{'max':>10}")
+        for key in ("submit_ms", "queue_ms", "run_ms", "total_ms"):
+            values = [r[key] for r in done]
+            print(f"{key[:-3]:<12}{np.percentile(values, 50):>10.0f}{np.percentile(values, 95):>10.0f}{max(values):>10.0f}")
+        for priority in range(priorities):
+            waits = [r["queue_ms"] for r in done if r["priority"] == priority]
+            if waits:
+                print(f"priority {priority}: median queue wait {np.median(waits):.0f} ms")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit = commands.add_parser("submit")
+    submit.add_argument("fixture")
+    submit.add_argument("--priority", type=int, default=0)
+    submit.add_argument("--output", help="file name in the service's output directory")
+    submit.add_argument("--watch", action="store_true", help="stream progress until the job ends")
+    for name in ("status", "cancel", "watch"):
+        commands.add_parser(name).add_argument("id")
+    load = commands.add_parser("load")
+    load.add_argument("fixtures", nargs="+")
+    load.add_argument("--jobs", type=int, default=20)
+    load.add_argument("--concurrency", type=int, default=4)
+    load.add_argument("--priorities", type=int, default=1)
+    load.add_argument("--json", help="write the per-job results to this file")
+    for command in (submit, load):
+        command.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="job param or limit")
+    args = parser.parse_args()
+
+    client = ServiceClient(args.host, args.port)
+    if args.command == "submit":
+        job = job_from_fixture(args.fixture, parse_settings(args.set), args.priority)
+        if args.output:
+            job["output"] = args.output
+        job_id = client.submit(job)
+        print(job_id)
+        if args.watch:
+            for event in client.events(job_id):
+                print(json.dumps(event))
+    elif args.command == "watch":
+        for event in client.events(args.id):
+            print(json.dumps(event))
+    elif args.command == "status":
+        print(json.dumps(client.status(args.id), indent=2))
+    elif args.command == "cancel":
+        print(json.dumps(client.cancel(args.id), indent=2))
+    else:
+        results = load_test(client, args.fixtures, parse_settings(args.set), args.jobs, args.concurrency, args.priorities)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+        if any(r["status"] != "done" for r in results):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,30 @@
 import numpy as np
-import random
-import cv2 as cv
-from sklearn.mixture import GaussianMixture
-from scipy.optimize import dual_annealing
+
+from code.gmm import fit_gmm
+from code.mrf_solver import energy, get_solver
 
 
 class SimulatedAnnealing:
-    def __init__(self, image: np.ndarray, rect: list[int], temperature=1.0, cooling_rate=0.99, iterations=10):
+    def __init__(
+        self,
+        image: np.ndarray,
+        rect: list[int],
+        temperature=1.0,
+        cooling_rate=0.99,
+        iterations=10,
+        solver: str = "annealing",
+        max_gmm_samples: int = 20000,
+        random_state: int = 0,
+    ):
         self.image = image  # (h x w x c)
         self.rect = rect
         self.height, self.width = image.shape[:2]
         self.temperature = temperature
         self.cooling_rate = cooling_rate
         self.iterations = iterations
+        self.solver = solver
+        self.max_gmm_samples = max_gmm_samples
+        self.random_state = random_state
 
         self.n_components = 5
         self.mask = None
@@ -35,71 +47,36 @@ class SimulatedAnnealing:
 
         # self.fg_gmm = GaussianMixture(n_components=self.n_components, covariance_type="full").fit(fg_pixels)
         # self.bg_gmm = GaussianMixture(n_components=self.n_components, covariance_type="full").fit(bg_pixels)
-        self.fg_gmm = GaussianMixture(n_components=self.n_components).fit(fg_pixels)
-        self.bg_gmm = GaussianMixture(n_components=self.n_components).fit(bg_pixels)
+        self.fg_gmm, _ = fit_gmm(
+            [fg_pixels], self.n_components, max_samples=self.max_gmm_samples, random_state=self.random_state, name="fg"
+        )
+        self.bg_gmm, _ = fit_gmm(
+            [bg_pixels], self.n_components, max_samples=self.max_gmm_samples, random_state=self.random_state, name="bg"
+        )
+
+    def mrf_terms(self):
+        """Unary costs (h x w x 2) and uniform Potts weights shared by all solvers in code/mrf_solver.py."""
+        pixels = self.image.reshape(-1, 3).astype(np.float64)
+        fg_D = -self.fg_gmm.score_samples(pixels).reshape(self.height, self.width)
+        bg_D = -self.bg_gmm.score_samples(pixels).reshape(self.height, self.width)
+        unary = np.stack([bg_D, fg_D], axis=-1)
+        pairwise = (np.ones((self.height, self.width)), np.ones((self.height, self.width)))
+        return unary, pairwise
 
     def energy(self, segmentation):
         """Calculate the energy of the current segmentation."""
-        smoothness_term = 0
-        data_term = 0
-
-        for i in range(segmentation.shape[0]):
-            for j in range(segmentation.shape[1]):
-                # Smoothness term
-                if i > 0:
-                    smoothness_term += segmentation[i, j] != segmentation[i - 1, j]
-                if j > 0:
-                    smoothness_term += segmentation[i, j] != segmentation[i, j - 1]
-
-                # Data term
-                pixel_value = self.image[i, j].reshape(1, 3)
-                if segmentation[i, j] == 1:
-                    data_term -= self.fg_gmm.score(pixel_value)  # TODO: precompute?
-                else:
-                    data_term -= self.bg_gmm.score(pixel_value)  # TODO: why minus?
-
-        return smoothness_term + data_term
-
-    def propose_change(self, segmentation):
-        """Propose a change to the current segmentation."""
-        new_segmentation = segmentation.copy()
-        # i = random.randint(0, segmentation.shape[0] - 1)  # TODO: make it inside box
-        # j = random.randint(0, segmentation.shape[1] - 1)
-        i = random.randint(self.rect[1], self.rect[3])
-        j = random.randint(self.rect[0], self.rect[2])
-        new_segmentation[i, j] = 1 - new_segmentation[i, j]  # Flip the label (binary segmentation)
-        return new_segmentation
-
-    def accept_change(self, old_energy, new_energy):
-        """Decide whether to accept the proposed change."""
-        if new_energy < old_energy:
-            return True
-        else:
-            probability = np.exp((old_energy - new_energy) / self.temperature)
-            return random.random() < probability
+        unary, pairwise = self.mrf_terms()
+        return energy(segmentation, unary, pairwise)
 
     def run(self):
-        """Run the simulated annealing algorithm."""
-        current_segmentation = self.mask.copy()
-        current_energy = self.energy(current_segmentation)
-
-        # for _ in range(self.iterations):
-        for _ in range(1):
-            for i in range(self.height):
-                for j in range(self.width):
-                    new_segmentation = current_segmentation.copy()
-                    new_segmentation[i, j] = 1 - new_segmentation[i, j]  # Flip the label (binary segmentation)
-
-                    # new_segmentation = self.propose_change(current_segmentation)
-                    new_energy = self.energy(new_segmentation)
-
-                    if self.accept_change(current_energy, new_energy):
-                        current_segmentation = new_segmentation
-                        # current_energy = self.energy(current_segmentation)
-                        current_energy = new_energy
-
-                    self.temperature *= self.cooling_rate
-                    # print("!")
+        """Run the selected MRF solver, starting from the rectangle mask."""
+        unary, pairwise = self.mrf_terms()
+        if self.solver == "annealing":
+            solver = get_solver(
+                "annealing", temperature=self.temperature, cooling_rate=self.cooling_rate, iterations=self.iterations
+            )
+        else:
+            solver = get_solver(self.solver)
 
-        self.mask = current_segmentation
+        self.mask = solver.solve(unary, pairwise, init_labels=self.mask)
         return self.mask
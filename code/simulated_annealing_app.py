@@ -4,9 +4,8 @@ import cv2 as cv
 from typing import Literal
 import numpy as np
 
-from code.grab_cut import GrabCut
-from code.grab_cut_opencv import GrabCutOpenCV
-from code.simulated_annealing import SimulatedAnnealing
+from code.engines import get_engine
+from code.mrf_solver import SOLVERS
 
 
 class SimulatedAnnealingApp:
@@ -31,6 +30,11 @@ class SimulatedAnnealingApp:
         )
         # self.process_button.pack(side=tk.TOP, fill=tk.X)
         self.process_button.grid(row=0, column=1)
+
+        # MRF solver
+        self.solver_var = tk.StringVar(value="annealing")
+        solver_menu = tk.OptionMenu(button_frame, self.solver_var, *SOLVERS)
+        solver_menu.grid(row=0, column=2)
         # ==================================================
 
         # ===================== CANVAS =====================
@@ -81,12 +85,6 @@ class SimulatedAnnealingApp:
         # Lists to keep track of the drawn shapes
         self.rectangle = None
 
-    def update_mask(self, x, y):
-        x0, y0, x1, y1 = x - self.brush_size, y - self.brush_size, x + self.brush_size, y + self.brush_size
-        for i in range(max(0, y0), min(self.height, y1 + 1)):
-            for j in range(max(0, x0), min(self.width, x1 + 1)):
-                self.line_masks[self.mode][i][j] = 1
-
     def on_mouse_down(self, event):
         self.start_x = event.x
         self.start_y = event.y
@@ -132,7 +130,7 @@ class SimulatedAnnealingApp:
 
     def process_image(self):
         if self.current_phase == "process-image":
-            self.mrf = SimulatedAnnealing(self.canvas_image_np, self.rectangle)
+            self.mrf = get_engine("simulated_annealing")(self.canvas_image_np, self.rectangle, solver=self.solver_var.get())
 
             mask = self.mrf.run()
 
@@ -0,0 +1,119 @@
+import numpy as np
+import cv2 as cv
+
+from code.mrf_solver import MaxflowSolver, resolve_region
+
+
+def slic(
+    image: np.ndarray, n_segments: int = 2000, compactness: float = 10.0, iterations: int = 4, max_step: int = 10
+) -> np.ndarray:
+    """Vectorized SLIC over-segmentation of an RGB image -> (h x w) int32 labels 0..n-1.
+
+    The image is viewed as a grid of (step x step) blocks and each pixel is only compared with
+    the centres of its own block and the 8 blocks around it, so every comparison is a broadcast
+    between the block view of the image and a shifted (ny x nx) array of centres.
+    Large frames are clustered at a reduced resolution where a block is at most max_step pixels wide.
+    """
+    h, w = image.shape[:2]
+    step = max(1, int(round(np.sqrt(h * w / n_segments))))
+    if step > max_step:
+        scale = max_step / step
+        small = cv.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv.INTER_AREA)
+        labels = slic(small, n_segments, compactness, iterations, max_step)
+        labels = cv.resize(labels, (w, h), interpolation=cv.INTER_NEAREST)
+        _, labels = np.unique(labels, return_inverse=True)
+        return labels.reshape(h, w).astype(np.int32)
+
+    ny, nx = -(-h // step), -(-w // step)
+    n = ny * nx
+
+    # pad to whole blocks; padded pixels are excluded from the centre updates
+    pad = ((0, ny * step - h), (0, nx * step - w), (0, 0))
+    lab = cv.cvtColor(image.astype(np.float32) / 255.0, cv.COLOR_RGB2LAB)
+    lab = np.pad(lab, pad, mode="edge").reshape(ny, step, nx, step, 3)
+    yy, xx = np.mgrid[0 : ny * step, 0 : nx * step].astype(np.float32)
+    valid = (yy < h) & (xx < w)
+    # the row / column coordinates only vary along one block axis each
+    yy, xx = yy.reshape(ny, step, nx, step)[:, :, :1, :1], xx.reshape(ny, step, nx, step)[:1, :1, :, :]
+
+    # centres live on a (ny + 2) x (nx + 2) grid whose border is unreachable
+    far = np.float32(1e9)
+    centre_y = np.full((ny + 2, nx + 2), far, dtype=np.float32)
+    centre_x = np.full((ny + 2, nx + 2), far, dtype=np.float32)
+    centre_lab = np.zeros((ny + 2, nx + 2, 3), dtype=np.float32)
+    centre_y[1:-1, 1:-1] = np.minimum((np.arange(ny)[:, None] + 0.5) * step, h - 1)
+    centre_x[1:-1, 1:-1] = np.minimum((np.arange(nx)[None, :] + 0.5) * step, w - 1)
+    centre_lab[1:-1, 1:-1] = lab[:, step // 2, :, step // 2]
+
+    channels = [np.ascontiguousarray(lab[..., c]) for c in range(3)]
+    cell = np.arange(n).reshape(ny, 1, nx, 1)
+    spatial_weight = np.float32((compactness / step) ** 2)
+    labels = np.empty((ny, step, nx, step), dtype=np.int64)
+    best = np.empty((ny, step, nx, step), dtype=np.float32)
+
+    for _ in range(iterations):
+        best.fill(np.inf)
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                window = (slice(1 + dy, 1 + dy + ny), slice(1 + dx, 1 + dx + nx))
+                cy = centre_y[window][:, None, :, None]
+                cx = centre_x[window][:, None, :, None]
+                clab = centre_lab[window][:, None, :, None, :]
+                distance = (channels[0] - clab[..., 0]) ** 2
+                distance += (channels[1] - clab[..., 1]) ** 2
+                distance += (channels[2] - clab[..., 2]) ** 2
+                distance += spatial_weight * (yy - cy) ** 2
+                distance += spatial_weight * (xx - cx) ** 2
+                closer = distance < best
+                np.copyto(best, distance, where=closer)
+                np.copyto(labels, cell + (dy * nx + dx), where=closer)
+
+        # move every centre to the mean of its pixels (empty clusters keep their centre)
+        flat = labels.reshape(-1)
+        weights = valid.reshape(-1).astype(np.float32)
+        counts = np.bincount(flat, weights=weights, minlength=n)
+        occupied = (counts > 0).reshape(ny, nx)
+        inner = (slice(1, -1), slice(1, -1))
+        for target, values in ((centre_y, yy), (centre_x, xx)):
+            values = np.broadcast_to(values, labels.shape)
+            mean = np.bincount(flat, weights=values.reshape(-1) * weights, minlength=n) / np.maximum(counts, 1)
+            target[inner][occupied] = mean.reshape(ny, nx)[occupied]
+        for c in range(3):
+            mean = np.bincount(flat, weights=channels[c].reshape(-1) * weights, minlength=n) / np.maximum(counts, 1)
+            centre_lab[inner + (c,)][occupied] = mean.reshape(ny, nx)[occupied]
+
+    labels = labels.reshape(ny * step, nx * step)[:h, :w]
+    _, labels = np.unique(labels, return_inverse=True)
+    return labels.reshape(h, w).astype(np.int32)
+
+
+def superpixel_graph(image: np.ndarray, labels: np.ndarray, gamma=0.01):
+    """Adjacency of superpixels with boundary-length-weighted colour similarity.
+
+    Returns (edges (m x 2), weights (m,)) where weight = boundary length * exp(-gamma * |mean colour diff|^2),
+    the superpixel counterpart of the per-pixel edges summed along the shared boundary.
+    """
+    n = int(labels.max()) + 1
+    flat = labels.ravel()
+    counts = np.bincount(flat, minlength=n)
+    mean_colour = np.stack(
+        [np.bincount(flat, weights=image[:, :, c].ravel().astype(np.float64), minlength=n) for c in range(3)], axis=1
+    ) / np.maximum(counts, 1)[:, None]
+
+    a = np.concatenate([labels[:, :-1].ravel(), labels[:-1, :].ravel()]).astype(np.int64)
+    b = np.concatenate([labels[:, 1:].ravel(), labels[1:, :].ravel()]).astype(np.int64)
+    different = a != b
+    a, b = np.minimum(a[different], b[different]), np.maximum(a[different], b[different])
+    keys, boundary_length = np.unique(a * n + b, return_counts=True)
+    edges = np.stack([keys // n, keys % n], axis=1)
+
+    colour_diff = np.sum((mean_colour[edges[:, 0]] - mean_colour[edges[:, 1]]) ** 2, axis=1)
+    weights = boundary_length * np.exp(-gamma * colour_diff)
+    return edges, weights
+
+
+def refine_boundary(mask: np.ndarray, unary: np.ndarray, pairwise, band: int, solver: MaxflowSolver = None) -> np.ndarray:
+    """Re-solve at pixel level inside a band of the given width around the mask boundary."""
+    kernel = np.ones((2 * band + 1, 2 * band + 1), np.uint8)
+    in_band = cv.dilate(mask, kernel) != cv.erode(mask, kernel)
+    return resolve_region(mask, in_band, unary, pairwise, solver)
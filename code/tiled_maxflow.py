@@ -0,0 +1,99 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from code.capacity import CapacityEncoder
+from code.mrf_solver import MaxflowSolver, resolve_region
+
+
+def _solve_tile(unary, horizontal, vertical, capacity):
+    # runs in a worker process
+    return MaxflowSolver(capacity).solve(unary, (horizontal, vertical))
+
+
+def tile_ranges(length: int, tile_size: int, overlap: int) -> list[tuple[int, int, int, int]]:
+    """Split [0, length) into cores of tile_size -> (core_start, core_end, start, end) with overlap on each side."""
+    ranges = []
+    for core_start in range(0, length, tile_size):
+        core_end = min(core_start + tile_size, length)
+        ranges.append((core_start, core_end, max(core_start - overlap, 0), min(core_end + overlap, length)))
+    return ranges
+
+
+class TiledMaxflowSolver:
+    """Max-flow on overlapping tiles solved in a process pool, with the seams re-solved afterwards.
+
+    Each tile is solved with `overlap` extra pixels of context on every side and only its core is
+    kept. Pixels within `seam_band` of a boundary between cores are then re-solved on the full
+    problem (one thin strip per seam, everything else fixed), so the result only differs from the
+    global cut where a disagreement reaches further than the band.
+    """
+
+    def __init__(
+        self,
+        tile_size: int = 256,
+        overlap: int = 32,
+        seam_band: int = 8,
+        workers: int = None,
+        capacity: CapacityEncoder = None,
+    ):
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.seam_band = seam_band
+        self.workers = workers or os.cpu_count()
+        self.capacity = capacity or CapacityEncoder()
+        self.pool = None
+        self.last_seams = None  # (h x w) bool, pixels re-solved in the last call
+
+    def __getstate__(self):
+        # the pool cannot be pickled / deep-copied; copies start their own
+        state = self.__dict__.copy()
+        state["pool"] = None
+        return state
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def solve(self, unary, pairwise, init_labels=None):
+        h, w = unary.shape[:2]
+        rows = tile_ranges(h, self.tile_size, self.overlap)
+        cols = tile_ranges(w, self.tile_size, self.overlap)
+        solver = MaxflowSolver(self.capacity)
+        if len(rows) * len(cols) == 1:
+            return solver.solve(unary, pairwise)
+
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        horizontal, vertical = pairwise
+        futures = []
+        for cy0, cy1, y0, y1 in rows:
+            for cx0, cx1, x0, x1 in cols:
+                tile_h = horizontal[y0:y1, x0:x1].copy()
+                tile_v = vertical[y0:y1, x0:x1].copy()
+                # edges leaving the tile are cut
+                tile_h[:, -1] = 0
+                tile_v[-1, :] = 0
+                future = self.pool.submit(_solve_tile, unary[y0:y1, x0:x1], tile_h, tile_v, self.capacity)
+                futures.append((future, cy0, cy1, y0, cx0, cx1, x0))
+
+        labels = np.empty((h, w), dtype=np.uint8)
+        for future, cy0, cy1, y0, cx0, cx1, x0 in futures:
+            tile = future.result()
+            labels[cy0:cy1, cx0:cx1] = tile[cy0 - y0 : cy1 - y0, cx0 - x0 : cx1 - x0]
+
+        # re-solve a strip around every internal seam, vertical seams first
+        self.last_seams = np.zeros((h, w), dtype=bool)
+        for cx0, _, _, _ in cols[1:]:
+            strip = np.zeros((h, w), dtype=bool)
+            strip[:, max(cx0 - self.seam_band, 0) : cx0 + self.seam_band] = True
+            labels = resolve_region(labels, strip, unary, pairwise, solver)
+            self.last_seams |= strip
+        for cy0, _, _, _ in rows[1:]:
+            strip = np.zeros((h, w), dtype=bool)
+            strip[max(cy0 - self.seam_band, 0) : cy0 + self.seam_band, :] = True
+            labels = resolve_region(labels, strip, unary, pairwise, solver)
+            self.last_seams |= strip
+        return labels
@@ -0,0 +1,72 @@
+import cv2 as cv
+import numpy as np
+from typing import Iterator, Optional
+
+from code.instrumentation import tracer
+
+
+def prepare_frame(frame: np.ndarray, width: int, height: int) -> np.ndarray:
+    """Decoded BGR frame -> RGB frame at the working resolution (same as VideoPlayerApp)."""
+    frame = cv.resize(frame, (width, height))
+    return cv.cvtColor(frame, cv.COLOR_BGR2RGB)
+
+
+def read_frames(
+    video_path: str, width: int, height: int, start: int = 0, stop: Optional[int] = None, sampler=None
+) -> Iterator[tuple[int, np.ndarray]]:
+    """Yield (frame index, RGB frame) for frames start..stop-1 without needing the GUI.
+
+    With a FrameRateSampler only the frames it keeps are decoded; the others are only demuxed.
+    """
+    cap = cv.VideoCapture(video_path)
+    cap.set(cv.CAP_PROP_POS_FRAMES, start)
+    index = start
+    try:
+        while stop is None or index < stop:
+            if sampler and not sampler.keep(index):
+                tracer.count("frames_skipped")
+                if not cap.grab():
+                    break
+                index += 1
+                continue
+            with tracer.span("decode"):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            with tracer.span("prepare_frame"):
+                frame = prepare_frame(frame, width, height)
+            yield index, frame
+            index += 1
+    finally:
+        cap.release()
+
+
+class FrameRateSampler:
+    """Picks the source frames needed for an output rate and the display duration of each.
+
+    Output frame k shows at k / target_fps seconds and uses the source frame closest to that time.
+    Each duration runs until the source timestamp of the next kept frame, in whole milliseconds
+    with cumulative rounding, so the clip length does not drift from the source.
+    """
+
+    def __init__(self, source_fps: float, target_fps: float = None):
+        self.source_fps = source_fps if source_fps and source_fps > 0 else 30.0
+        self.target_fps = min(target_fps or self.source_fps, self.source_fps)
+        self.start = None
+        self.num_output = 0
+        self.durations = []
+
+    def keep(self, index: int) -> bool:
+        if self.start is None:
+            self.start = index
+        if index < self.source_index(self.num_output):
+            return False
+        self.num_output += 1
+        self.durations.append(self.timestamp(self.source_index(self.num_output)) - self.timestamp(index))
+        return True
+
+    def source_index(self, k: int) -> int:
+        return self.start + round(k * self.source_fps / self.target_fps)
+
+    def timestamp(self, index: int) -> int:
+        return round((index - self.start) * 1000 / self.source_fps)
@@ -3,6 +3,10 @@ from tkinter import filedialog
 import cv2
 from PIL import Image, ImageTk
 
+from code.instrumentation import tracer
+from code.playback import BackgroundDecoder, PlaybackClock
+from code.video_io import prepare_frame
+
 
 class VideoPlayerApp:
     def __init__(self, root, video_width=640, video_height=480):
@@ -14,6 +18,11 @@ class VideoPlayerApp:
 
         self.cap = None
         self.paused = True
+        # while playing, frames come from a decoder thread and are picked by the wall clock
+        self.decoder = None
+        self.clock = None
+        self.photo = None
+        self.frame = None  # the last frame the decoder delivered, i.e. the one on screen while playing
 
         self.load_button = tk.Button(root, text="Load Video", command=self.load_video)
         self.load_button.pack(pady=5)
@@ -55,7 +64,10 @@ class VideoPlayerApp:
 
             num_frames = self.cap.get(cv2.CAP_PROP_FRAME_COUNT)
             fps = self.cap.get(cv2.CAP_PROP_FPS)
-            print(f"Video loaded: {num_frames} frames, {num_frames/fps} seconds")
+            # some containers report 0 fps, keep the default then
+            if fps > 0:
+                self.fps = fps
+            print(f"Video loaded: {num_frames} frames, {num_frames/self.fps} seconds at {self.fps:.2f} fps")
 
             # show initial frame
             photo, _ = self.capture_current_frame()
@@ -73,28 +85,52 @@ class VideoPlayerApp:
         self.paused = not self.paused
         self.play_pause_button.config(text="Play" if self.paused else "Pause")
 
-        if not self.paused:
-            self.play_video()
+        if self.paused:
+            self.stop_playback()
+        else:
+            self.start_playback()
+
+    def start_playback(self):
+        # the current frame is on screen, playback continues with the next one
+        self.decoder = BackgroundDecoder(self.video_path, self.current_frame + 1, self.video_width, self.video_height)
+        self.clock = PlaybackClock(fps=self.fps)
+        self.photo = ImageTk.PhotoImage("RGB", (self.video_width, self.video_height))
+        self.label.config(image=self.photo)
+        self.label.image = self.photo
+        self.play_video()
+
+    def stop_playback(self):
+        if self.decoder is None:
+            return
+        if self.decoder.dropped:
+            print(f"playback dropped {self.decoder.dropped} frames to keep up")
+        self.decoder.close()
+        self.decoder = None
+        self.frame = None
+        # leave the capture where frame-by-frame reading expects it, after the frame on screen
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame + 1)
 
     def play_video(self):
-        if self.cap is None or self.paused:
+        if self.cap is None or self.paused or self.decoder is None:
             return
 
-        photo, _ = self.capture_current_frame()
-        if photo:
-            self.label.config(image=photo)
-            self.label.image = photo
-
-            self.current_frame += 1
+        start = self.decoder.start
+        item = self.decoder.take(start + self.clock.due())
+        if item:
+            index, frame = item
+            self.frame = frame
+            self.photo.paste(Image.fromarray(frame))
+            self.current_frame = index
             self.slider.set(self.current_frame)
-
-            # Calculate delay based on fps
-            delay = int(1000 / self.fps)
-            self.root.after(delay, self.play_video)
-        else:
+        elif self.decoder.finished:
             self.reset_video()
+            return
+        # wake up for the next frame, or soon again if the decoder has not caught up
+        next_frame = self.current_frame + 1 - start
+        self.root.after(self.clock.delay_until(next_frame) if item else 5, self.play_video)
 
     def reset_video(self):
+        self.stop_playback()
         self.paused = True
         self.play_pause_button.config(text="Play")
         self.slider.set(0)
@@ -103,8 +139,16 @@ class VideoPlayerApp:
     def seek_video(self, value):
         if self.cap is None:
             return
+        if not self.paused:
+            # slider updates from playback itself
+            if int(value) == self.current_frame:
+                return
+            # dragged while playing: continue from there
+            self.stop_playback()
+            self.current_frame = int(value) - 1
+            self.start_playback()
+            return
         self.current_frame = int(value)
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame)
 
         # change frame to new location
         photo, _ = self.capture_current_frame()
@@ -114,11 +158,19 @@ class VideoPlayerApp:
         # self.play_video()
 
     def capture_current_frame(self):
-        ret, frame = self.cap.read()
+        """The frame on screen (current_frame) -> (PhotoImage or None, RGB frame)."""
+        if self.decoder is not None and self.frame is not None:
+            # playing: the capture is not advanced, the decoder's frame is the one shown
+            frame = self.frame.copy()
+            return ImageTk.PhotoImage(Image.fromarray(frame)), frame
+        # reading leaves the capture after the frame, so seek back to the one on screen
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame)
+        with tracer.span("decode"):
+            ret, frame = self.cap.read()
         photo = None
         if ret:
-            frame = cv2.resize(frame, (self.video_width, self.video_height))
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            with tracer.span("prepare_frame"):
+                frame = prepare_frame(frame, self.video_width, self.video_height)
             image = Image.fromarray(frame)
             photo = ImageTk.PhotoImage(image)
         return photo, frame
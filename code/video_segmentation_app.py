@@ -1,9 +1,25 @@
 import tkinter as tk
+from tkinter import filedialog
 from PIL import Image, ImageTk
 import cv2 as cv
 from typing import Literal
 import numpy as np
 import os
+import contextlib
+import copy
+import threading
+
+from code.engines import VIDEO_ENGINES, video_engine
+from code.exporters import EXPORTERS, get_exporter
+from code.gmm_adaptation import OnlineGMMAdapter
+from code.keyframes import KeyframePropagator
+from code.matting import EdgeFeathering
+from code.propagation import propagate
+from code.frame_analysis import FrameChangeDetector
+from code.instrumentation import tracer
+from code.mask_interpolation import MaskInterpolator
+from code.playback import PlaybackClock, PreviewCache
+from code.video_io import FrameRateSampler, read_frames
 
 
 class VideoSegmentationApp:
@@ -37,6 +53,71 @@ class VideoSegmentationApp:
         self.slider_3d_term.pack()
         scale_label = tk.Label(scale_frame, text="3D term")
         scale_label.pack(side=tk.BOTTOM)
+
+        # Online colour model adaptation
+        self.adaptive_var = tk.BooleanVar(value=False)
+        self.toggle_button_adaptive = tk.Checkbutton(button_frame, text="Adaptive GMM", variable=self.adaptive_var)
+        self.toggle_button_adaptive.grid(row=0, column=3)
+
+        # Keyframes
+        self.keyframe_button = tk.Button(button_frame, text="Add Keyframe", command=self.add_keyframe)
+        self.keyframe_button.grid(row=0, column=4)
+        self.clear_keyframes_button = tk.Button(button_frame, text="Clear Keyframes", command=self.clear_keyframes)
+        self.clear_keyframes_button.grid(row=0, column=5)
+        self.keyframe_label = tk.Label(button_frame, text="Keyframes: none")
+        self.keyframe_label.grid(row=0, column=6)
+
+        # Reuse masks of static frames, reset the temporal prior at scene cuts; off by default since
+        # reused masks only approximate the exact result
+        self.detect_changes_var = tk.BooleanVar(value=False)
+        self.toggle_button_detect_changes = tk.Checkbutton(
+            button_frame, text="Skip Static Frames", variable=self.detect_changes_var
+        )
+        self.toggle_button_detect_changes.grid(row=0, column=7)
+
+        # Output frame rate, 0 keeps the source rate
+        fps_frame = tk.Frame(button_frame)
+        fps_frame.grid(row=0, column=8)
+        self.slider_gif_fps = tk.Scale(fps_frame, from_=0, to=30, orient="horizontal")
+        self.slider_gif_fps.set(0)
+        self.slider_gif_fps.pack()
+        tk.Label(fps_frame, text="GIF fps (0 = source)").pack(side=tk.BOTTOM)
+
+        # Solve every Kth frame, flow-warp the masks in between (experimental, costs accuracy)
+        stride_frame = tk.Frame(button_frame)
+        stride_frame.grid(row=0, column=9)
+        self.slider_solve_every = tk.Scale(stride_frame, from_=1, to=8, orient="horizontal")
+        self.slider_solve_every.set(1)
+        self.slider_solve_every.pack()
+        tk.Label(stride_frame, text="Solve every Kth (experimental)").pack(side=tk.BOTTOM)
+
+        # Per-stage timings, shown live per frame and written as traces next to the GIF
+        self.profile_var = tk.BooleanVar(value=False)
+        self.toggle_button_profile = tk.Checkbutton(button_frame, text="Profile", variable=self.profile_var)
+        self.toggle_button_profile.grid(row=0, column=10)
+        self.profile_label = tk.Label(root, text="", font=("Courier", 9))
+        self.profile_label.pack()
+        tracer.frame_listeners.append(self.show_frame_breakdown)
+
+        # Soft alpha along the mask edge, optionally smoothed over time
+        feather_frame = tk.Frame(button_frame)
+        feather_frame.grid(row=0, column=11)
+        self.slider_feather_radius = tk.Scale(feather_frame, from_=0, to=8, orient="horizontal")
+        self.slider_feather_radius.set(0)
+        self.slider_feather_radius.pack()
+        tk.Label(feather_frame, text="Feather radius (0 = off)").pack(side=tk.BOTTOM)
+        self.temporal_alpha_var = tk.BooleanVar(value=False)
+        self.toggle_button_temporal_alpha = tk.Checkbutton(
+            button_frame, text="Temporal Alpha", variable=self.temporal_alpha_var
+        )
+        self.toggle_button_temporal_alpha.grid(row=0, column=12)
+
+        # Engine that propagates the snapshot's segmentation (OpenCV's grabCut is faster, with frozen models)
+        engine_frame = tk.Frame(button_frame)
+        engine_frame.grid(row=0, column=13)
+        self.video_engine_var = tk.StringVar(value="graph_cut")
+        tk.OptionMenu(engine_frame, self.video_engine_var, *VIDEO_ENGINES).pack()
+        tk.Label(engine_frame, text="Video engine").pack(side=tk.BOTTOM)
         # ===================================================
 
         # ===================== LABEL =======================
@@ -57,21 +138,45 @@ class VideoSegmentationApp:
         )
         self.label.pack(fill=tk.BOTH, expand=True)
         self.play_button = tk.Button(
-            root, text="Play GIF", command=lambda: self.show_result_to_canvas(0), state=tk.DISABLED
+            root, text="Play GIF", command=self.play_result, state=tk.DISABLED
         )
         self.play_button.pack(pady=10)
 
         # Download button
-        self.download_button = tk.Button(root, text="Download GIF", command=self.download, state=tk.DISABLED)
+        self.download_button = tk.Button(root, text="Download", command=self.download, state=tk.DISABLED)
         self.download_button.pack()
+
+        # Export format and settings, used by Download and by exporting while segmenting
+        export_frame = tk.Frame(root)
+        export_frame.pack()
+        self.export_format_var = tk.StringVar(value="gif")
+        tk.OptionMenu(export_frame, self.export_format_var, *EXPORTERS).grid(row=0, column=0)
+        quality_frame = tk.Frame(export_frame)
+        quality_frame.grid(row=0, column=1)
+        self.slider_export_quality = tk.Scale(quality_frame, from_=0, to=100, orient="horizontal")
+        self.slider_export_quality.set(80)
+        self.slider_export_quality.pack()
+        tk.Label(quality_frame, text="WebP quality").pack(side=tk.BOTTOM)
+        self.lossless_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(export_frame, text="Lossless", variable=self.lossless_var).grid(row=0, column=2)
+        # Write every frame as soon as it is segmented instead of after the run
+        self.stream_export_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(export_frame, text="Export While Segmenting", variable=self.stream_export_var).grid(
+            row=0, column=3
+        )
+        # While exporting, keep only half-size copies of the frames for the preview, or none at all
+        self.stream_preview_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(export_frame, text="Keep Preview", variable=self.stream_preview_var).grid(row=0, column=4)
         # ===================================================
 
         self.output_frames = []
-        self.fps = 30
-        self.delay = 1000 / self.fps
+        self.durations = []  # display time of every output frame in ms
+        self.preview_cache = None
+        self.breakdown_text = ""
 
         self.is_3d: bool = True
         self.initial_frame_num = None
+        self.keyframe_propagator = None
 
     def toggle_3d(self):
         if self.toggle_var_3d.get():
@@ -81,59 +186,287 @@ class VideoSegmentationApp:
             self.toggle_button_3d.config(text="2D")
             self.is_3d = False
 
+    def add_keyframe(self):
+        """Use the current snapshot, its annotation and model as a keyframe."""
+        if self.graph_cut_app.graph_cut is None:
+            print("run graph cut first")
+            return
+        video_path = self.video_player.video_path
+        if self.keyframe_propagator is None or self.keyframe_propagator.video_path != video_path:
+            self.keyframe_propagator = KeyframePropagator(video_path, self.width, self.height)
+        # the snapshot was taken at current_frame, segmentation continues from the frame after it
+        frame_index = self.video_player.current_frame
+        self.keyframe_propagator.set_keyframe(
+            frame_index, self.graph_cut_app.graph_cut, self.graph_cut_app.mask, self.graph_cut_app.img
+        )
+        self.keyframe_label.config(text=f"Keyframes: {sorted(self.keyframe_propagator.keyframes)}")
+
+    def clear_keyframes(self):
+        if self.keyframe_propagator:
+            self.keyframe_propagator.clear()
+        self.keyframe_label.config(text="Keyframes: none")
+
+    def start_job(self, work, finish):
+        """Run work() on a worker thread and finish(result) on the Tk thread once it returns.
+
+        The main loop keeps running meanwhile, so the player and the result preview stay smooth.
+        work() must not touch Tk; read the widgets before starting the job.
+        """
+        self.run_button.config(state=tk.DISABLED)
+        outcome = {}
+
+        def target():
+            try:
+                outcome["result"] = work()
+            except Exception as e:
+                outcome["error"] = e
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self.poll_job(thread, outcome, finish)
+
+    def poll_job(self, thread, outcome, finish):
+        self.profile_label.config(text=self.breakdown_text)
+        if thread.is_alive():
+            self.root.after(50, self.poll_job, thread, outcome, finish)
+            return
+        self.run_button.config(state=tk.NORMAL)
+        if "error" in outcome:
+            raise outcome["error"]
+        finish(outcome["result"])
+
+    def run_keyframes(self):
+        propagator = self.keyframe_propagator
+        end_frame, is_3d, energy_term_3d = self.video_player.total_frames, self.is_3d, self.slider_3d_term.get()
+        skip_static, solve_every = self.detect_changes_var.get(), self.slider_solve_every.get()
+        feathering = self.make_feathering()
+        # the same output rate and frame durations as the single-snapshot path; the keyframe segments
+        # still segment every source frame so that they meet between keyframes, the sampler picks the output
+        sampler = FrameRateSampler(self.video_player.fps, self.slider_gif_fps.get())
+
+        def work():
+            results = propagator.run(end_frame, is_3d, energy_term_3d, skip_static, solve_every)
+            print(f"recomputed {propagator.last_recomputed} keyframe segments")
+            output_frames = []
+            for index, img, mask in results:
+                if not sampler.keep(index):
+                    continue
+                if feathering:
+                    img = img.copy()  # the propagator caches its results
+                    img[:, :, 3] = feathering.alpha(img[:, :, :3], mask)
+                output_frames.append(Image.fromarray(img))
+            if feathering:
+                feathering.close()
+            return output_frames
+
+        def finish(output_frames):
+            self.output_frames = output_frames
+            self.durations = sampler.durations[: len(self.output_frames)]
+            self.download_button.config(state=tk.NORMAL)
+            self.play_button.config(state=tk.NORMAL)
+            print("num of frames in output GIF:", len(self.output_frames))
+            self.play_result()
+
+        self.start_job(work, finish)
+
     def run(self):
+        if self.keyframe_propagator and self.keyframe_propagator.keyframes:
+            self.run_keyframes()
+            return
         if self.graph_cut_app.graph_cut is None:
             print("run graph cut first")
             return
+        if self.profile_var.get():
+            tracer.enable()
+        else:
+            tracer.disable()
         # if self.initial_frame_num is None:
         #     self.initial_frame_num = self.video_player.current_frame + 1
         initial_frame_num = self.video_player.current_frame + 1
         prev_mask = self.graph_cut_app.mask
-        self.output_frames = []
-        self.output_frames.append(self.graph_cut_app.img)
-
-        self.video_player.cap.set(cv.CAP_PROP_POS_FRAMES, initial_frame_num)
-        while 1:
-            _, np_frame = self.video_player.capture_current_frame()
-            if np_frame is None:
-                break
-            if self.is_3d:
-                img, mask = self.graph_cut_app.graph_cut.segment_frame_from_learnt_gmm_3d(
-                    np_frame, prev_mask, self.slider_3d_term.get()
-                )
-                prev_mask = mask
-            else:
-                img, mask = self.graph_cut_app.graph_cut.segment_frame_from_learnt_gmm_2d(np_frame)
-            self.output_frames.append(img)
-        self.download_button.config(state=tk.NORMAL)
-        self.play_button.config(state=tk.NORMAL)
-        self.output_frames = [Image.fromarray(frame) for frame in self.output_frames]
-        print("num of frames in output GIF:", len(self.output_frames))
-        self.show_result_to_canvas(0)
-        self.video_player.cap.set(cv.CAP_PROP_POS_FRAMES, initial_frame_num)
-
-    def show_result_to_canvas(self, frame_idx: int):
-        frame = self.output_frames[frame_idx]
-        photo = ImageTk.PhotoImage(frame)
-        self.label.config(image=photo)
-        self.label.image = photo
-        # next_idx = (frame_idx + 1) % len(self.output_frames)
-        if frame_idx + 1 < len(self.output_frames):
-            self.root.after(int(self.delay), self.show_result_to_canvas, frame_idx + 1)
+        graph_cut = self.graph_cut_app.graph_cut
+        adapter = None
+        if self.video_engine_var.get() != "graph_cut":
+            # the other engines learn their own models from the snapshot and keep them frozen
+            graph_cut = video_engine(self.video_engine_var.get(), graph_cut, prev_mask)
+        elif self.adaptive_var.get():
+            # adapt a copy so the snapshot models stay as the user left them
+            graph_cut = copy.deepcopy(graph_cut)
+            adapter = OnlineGMMAdapter(graph_cut)
+        change_detector = None
+        if self.detect_changes_var.get():
+            change_detector = FrameChangeDetector()
+            change_detector.prime(self.graph_cut_app.canvas_image_np)
+        interpolator = None
+        if self.slider_solve_every.get() > 1:
+            interpolator = MaskInterpolator(interval=self.slider_solve_every.get())
+        exporter = None
+        if self.stream_export_var.get():
+            path = self.ask_export_path()
+            if not path:
+                return
+            exporter = self.open_exporter(path)
+        feathering = self.make_feathering()
+        first_img = self.graph_cut_app.img
+        if feathering:
+            first_img = first_img.copy()
+            first_img[:, :, 3] = feathering.alpha(self.graph_cut_app.canvas_image_np, prev_mask)
+        export_format = self.export_format_var.get()
+        keep_preview = self.stream_preview_var.get()
+        is_3d, energy_term_3d = self.is_3d, self.slider_3d_term.get()
 
-    def download(self):
-        # Save as a GIF
-        gif_name = "output.gif"
+        # the snapshot is output frame 0, sampling continues from its index
+        sampler = FrameRateSampler(self.video_player.fps, self.slider_gif_fps.get())
+        sampler.keep(self.video_player.current_frame)
+
+        def retain(img: np.ndarray, output_frames: list):
+            """Keep a frame for playing and downloading; when streaming only a preview, if any."""
+            if not exporter:
+                output_frames.append(Image.fromarray(img.copy()))
+            elif keep_preview:
+                output_frames.append(cv.resize(img, (self.width // 2, self.height // 2), interpolation=cv.INTER_AREA))
+
+        def work():
+            output_frames = []
+            written = 1
+            try:
+                retain(first_img, output_frames)
+                if exporter:
+                    exporter.write(first_img, sampler.durations[0])
+                # own capture: the job runs on a worker thread while the player keeps using its own
+                video_path = self.video_player.video_path
+                frames = read_frames(video_path, self.width, self.height, initial_frame_num, sampler=sampler)
+                # the RGBA images live in one reused buffer, so whatever outlives the iteration is a copy
+                context = graph_cut.frame_context() if hasattr(graph_cut, "frame_context") else contextlib.nullcontext()
+                with context:
+                    for _, img, _ in propagate(
+                        graph_cut,
+                        frames,
+                        prev_mask,
+                        is_3d,
+                        energy_term_3d,
+                        adapter,
+                        change_detector,
+                        interpolator,
+                        feathering,
+                    ):
+                        if exporter:  # exporters may encode a frame later, on a pool
+                            exporter.write(Image.fromarray(img.copy()), sampler.durations[written])
+                        retain(img, output_frames)
+                        written += 1
+                if exporter:
+                    with tracer.span("export", format=export_format, frames=written):
+                        exporter.close()
+                    print(f"saved to {exporter.path}!")
+            except BaseException:
+                # as in code.jobs.run_job: stop the exporter's thread and drop the half-written file
+                if exporter:
+                    try:
+                        exporter.close()
+                    except Exception:
+                        pass
+                    if os.path.exists(exporter.path):
+                        os.remove(exporter.path)
+                raise
+            finally:
+                if feathering:
+                    feathering.close()
+                if adapter:  # the adapted copy's solver; the snapshot's is closed with the app
+                    graph_cut.close()
+            return output_frames
+
+        def finish(output_frames):
+            self.output_frames = output_frames
+            self.durations = sampler.durations[: len(self.output_frames)]
+            # streamed runs are already saved, and only kept previews (if anything) to play
+            self.download_button.config(state=tk.DISABLED if exporter else tk.NORMAL)
+            self.play_button.config(state=tk.NORMAL if self.output_frames else tk.DISABLED)
+            print("num of frames in output GIF:", len(self.output_frames))
+            if change_detector:
+                print(change_detector.summary())
+            if interpolator:
+                print(interpolator.summary())
+            if adapter:
+                print(f"colour models refreshed {adapter.num_refreshes} times over {adapter.num_frames} frames")
+            if tracer.enabled:
+                self.export_trace()
+            if self.output_frames:
+                self.play_result()
+
+        self.start_job(work, finish)
+
+    def make_feathering(self):
+        radius = self.slider_feather_radius.get()
+        if radius == 0:
+            return None
+        return EdgeFeathering(radius=radius, temporal=0.5 if self.temporal_alpha_var.get() else 0.0, workers=None)
+
+    def show_frame_breakdown(self, frame_index: int, breakdown: dict):
+        # called on the job's thread, poll_job() puts the text on screen
+        stages = " | ".join(f"{name} {ms:.1f}" for name, ms in breakdown.items() if name != "total")
+        self.breakdown_text = f"frame {frame_index}: {breakdown['total']:.1f} ms  ({stages})"
+
+    def export_trace(self):
         downloads_dir = os.path.join(os.path.expanduser("~"), "Downloads")
-        gif_path = os.path.join(downloads_dir, gif_name)
-
-        self.output_frames[0].save(
-            gif_path,
-            save_all=True,
-            append_images=self.output_frames[1:],
-            loop=0,
-            duration=self.delay,  # TODO: calculate delay?
-            transparency=0,
-            disposal=2,
+        tracer.export_jsonl(os.path.join(downloads_dir, "segmentation_trace.jsonl"))
+        tracer.export_chrome_trace(os.path.join(downloads_dir, "segmentation_trace.json"))
+        summary = tracer.summary()
+        for name, span in sorted(summary["spans"].items(), key=lambda item: -item[1]["total_ms"]):
+            print(f"{name:<20}{span['total_ms']:>10.1f} ms{span['calls']:>8} calls")
+        print(f"counters: {summary['counters']}, peak RSS {summary['peak_rss_mb']:.0f} MB")
+        print(f"trace saved to {downloads_dir}/segmentation_trace.json (chrome://tracing)")
+
+    def play_result(self):
+        """Play the output frames from a preview cache, timed by the wall clock."""
+        if self.preview_cache:
+            self.preview_cache.close()
+        self.preview_cache = PreviewCache(self.output_frames, self.width, self.height)
+        self.preview_clock = PlaybackClock(durations=self.durations)
+        self.preview_photo = ImageTk.PhotoImage("RGB", (self.width, self.height))
+        self.label.config(image=self.preview_photo)
+        self.label.image = self.preview_photo
+        self.preview_shown = -1
+        self.preview_tick(self.preview_cache)
+
+    def preview_tick(self, cache: PreviewCache):
+        if cache is not self.preview_cache:
+            return  # superseded by a newer playback
+        # frames whose time has passed while the main loop was busy are skipped
+        index = min(self.preview_clock.due(), len(self.output_frames) - 1)
+        if index != self.preview_shown:
+            if index > self.preview_shown + 1:
+                tracer.count("preview_dropped", index - self.preview_shown - 1)
+            self.preview_photo.paste(cache.get(index))
+            self.preview_shown = index
+        if index + 1 < len(self.output_frames):
+            self.root.after(self.preview_clock.delay_until(index + 1), self.preview_tick, cache)
+        else:
+            cache.close()
+
+    def ask_export_path(self) -> str:
+        """Output path for the selected format, empty if the dialog was cancelled."""
+        extension = EXPORTERS[self.export_format_var.get()].extension
+        return filedialog.asksaveasfilename(
+            initialdir=os.path.join(os.path.expanduser("~"), "Downloads"),
+            initialfile=f"output.{extension}",
+            defaultextension=f".{extension}",
         )
-        print(f"GIF saved to {gif_path}!")
+
+    def open_exporter(self, path: str):
+        export_format = self.export_format_var.get()
+        options = {}
+        if export_format == "webp":
+            options = {"quality": self.slider_export_quality.get(), "lossless": self.lossless_var.get()}
+        return get_exporter(export_format, path, **options)
+
+    def download(self):
+        path = self.ask_export_path()
+        if not path:
+            return
+        with tracer.span("export", format=self.export_format_var.get(), frames=len(self.output_frames)):
+            with self.open_exporter(path) as exporter:
+                for frame, duration in zip(self.output_frames, self.durations):
+                    exporter.write(frame, duration)
+        print(f"saved to {path}!")
+        if tracer.enabled:
+            self.export_trace()
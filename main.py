@@ -1,9 +1,11 @@
 import tkinter as tk
 from code.main_app import VideoToGIF
 
-# Create the main window
-root = tk.Tk()
-# create and load App
-app = VideoToGIF(root)
-# Run the application
-root.mainloop()
+# guarded: worker processes started with spawn / forkserver (code.keyframes) import this module
+if __name__ == "__main__":
+    # Create the main window
+    root = tk.Tk()
+    # create and load App
+    app = VideoToGIF(root)
+    # Run the application
+    root.mainloop()